@@ -0,0 +1,145 @@
+# ============================================================
+# catalog_columns.py — Columnar Catalog View (struct of arrays)
+# ============================================================
+# The cached catalog is a list of row dicts, which is what responses are
+# built from. This module keeps a parallel column per field — int/float
+# arrays for ids, prices and ranks, small integer codes for category,
+# sub-category and unit, boolean masks for the flags — so filters, sorts
+# and per-category counts run as NumPy operations instead of Python loops.
+# Position i in every column is catalog row i, so a selection maps back to
+# rows by index. NumPy is optional: without it build() returns None and
+# callers keep their row loops.
+from typing import Optional
+
+try:
+    import numpy as np  # type: ignore
+except ImportError:  # pragma: no cover - optional dependency
+    np = None
+
+SORT_KEYS = ("display_order", "price", "-price", "discount", "newest")
+
+
+class _Codes:
+    """A categorical column: one small int per row plus the distinct labels."""
+
+    def __init__(self, values: list):
+        self.labels = sorted(set(values))
+        index = {label: i for i, label in enumerate(self.labels)}
+        dtype = np.int16 if len(self.labels) < 2 ** 15 else np.int32
+        self.codes = np.fromiter((index[v] for v in values), dtype=dtype, count=len(values))
+        self._index = index
+
+    def code(self, label: str) -> int:
+        """The label's code, or -1 (matches no row) if it does not occur."""
+        return self._index.get(label, -1)
+
+    def mask(self, label: str):
+        return self.codes == self.code(label)
+
+
+class CatalogColumns:
+    """Struct-of-arrays copy of a product list. Immutable: rebuilt when the list changes."""
+
+    def __init__(self, products: list):
+        n = len(products)
+        self.rows = products
+        self.id = np.fromiter((p['id'] for p in products), dtype=np.int64, count=n)
+        self.price = np.fromiter((p.get('price') or 0.0 for p in products), dtype=np.float64, count=n)
+        self.mrp = np.fromiter((p.get('mrp') or 0.0 for p in products), dtype=np.float64, count=n)
+        self.display_order = np.fromiter((p.get('display_order') or 0 for p in products), dtype=np.int32, count=n)
+        self.is_visible = np.fromiter((bool(p.get('is_visible', True)) for p in products), dtype=bool, count=n)
+        self.in_stock = np.fromiter((bool(p.get('in_stock', True)) for p in products), dtype=bool, count=n)
+        self.is_newly_launched = np.fromiter((bool(p.get('is_newly_launched')) for p in products), dtype=bool, count=n)
+        self.category = _Codes([p.get('category') or '' for p in products])
+        self.sub_category = _Codes([p.get('sub_category') or '' for p in products])
+        self.unit = _Codes([p.get('unit') or '' for p in products])
+        # Fractional discount off MRP; 0 where MRP is missing or below price
+        with np.errstate(divide="ignore", invalid="ignore"):
+            self.discount = np.where(self.mrp > self.price, (self.mrp - self.price) / self.mrp, 0.0)
+
+    def __len__(self):
+        return len(self.rows)
+
+    @property
+    def nbytes(self) -> int:
+        """Memory held by the column arrays (labels excluded)."""
+        arrays = (self.id, self.price, self.mrp, self.display_order, self.is_visible, self.in_stock,
+                  self.is_newly_launched, self.discount, self.category.codes, self.sub_category.codes, self.unit.codes)
+        return sum(a.nbytes for a in arrays)
+
+    def available(self):
+        """Visible and in stock."""
+        return self.is_visible & self.in_stock
+
+    def mask(self, category: Optional[str] = None, sub_category: Optional[str] = None,
+             min_price: Optional[float] = None, max_price: Optional[float] = None,
+             visible_only: bool = True, in_stock_only: bool = False, exclude_ids=None):
+        """Boolean row mask for the given filters (all optional, combined with AND)."""
+        m = self.is_visible.copy() if visible_only else np.ones(len(self.rows), dtype=bool)
+        if in_stock_only:
+            m &= self.in_stock
+        if category is not None:
+            m &= self.category.mask(category)
+        if sub_category is not None:
+            m &= self.sub_category.mask(sub_category)
+        if min_price is not None:
+            m &= self.price >= min_price
+        if max_price is not None:
+            m &= self.price <= max_price
+        if exclude_ids:
+            m &= ~np.isin(self.id, np.fromiter(exclude_ids, dtype=np.int64))
+        return m
+
+    def select(self, mask, sort: Optional[str] = None, limit: Optional[int] = None) -> list:
+        """Rows matching mask, ordered by sort (catalog order when None), at most limit of them."""
+        idx = np.flatnonzero(mask)
+        if sort is not None and sort != "display_order":
+            if sort == "price":
+                keys = self.price[idx]
+            elif sort == "-price":
+                keys = -self.price[idx]
+            elif sort == "discount":
+                keys = -self.discount[idx]
+            elif sort == "newest":
+                keys = ~self.is_newly_launched[idx]
+            else:
+                raise ValueError(f"Unknown sort {sort!r}; expected one of {SORT_KEYS}")
+            # Stable, so ties keep catalog order (category, then rank)
+            idx = idx[np.argsort(keys, kind="stable")]
+        if limit is not None:
+            idx = idx[:max(limit, 0)]
+        return [self.rows[i] for i in idx.tolist()]
+
+    def first_per_category(self, mask) -> list:
+        """The first matching row of each category, in catalog order."""
+        idx = np.flatnonzero(mask)
+        _, first = np.unique(self.category.codes[idx], return_index=True)
+        return [self.rows[i] for i in np.sort(idx[first]).tolist()]
+
+    def category_summary(self) -> list:
+        """Per-category product counts and price stats for the admin dashboard."""
+        codes = self.category.codes
+        k = len(self.category.labels)
+        total = np.bincount(codes, minlength=k)
+        visible = np.bincount(codes, weights=self.is_visible, minlength=k)
+        out_of_stock = np.bincount(codes, weights=self.is_visible & ~self.in_stock, minlength=k)
+        price_sum = np.bincount(codes, weights=self.price, minlength=k)
+        discount_sum = np.bincount(codes, weights=self.discount, minlength=k)
+        return [
+            {
+                "category": label,
+                "products": int(total[i]),
+                "visible": int(visible[i]),
+                "out_of_stock": int(out_of_stock[i]),
+                "avg_price": round(float(price_sum[i] / total[i]), 2),
+                "avg_discount_pct": round(float(discount_sum[i] / total[i]) * 100, 1),
+            }
+            for i, label in enumerate(self.category.labels) if total[i]
+        ]
+
+
+def build(products: list) -> Optional[CatalogColumns]:
+    """Columns for products, or None when NumPy is not installed."""
+    if np is None:
+        return None
+    return CatalogColumns(products)
@@ -0,0 +1,76 @@
+# ============================================================
+# catalog_snapshot.py — On-Disk Catalog Snapshot for Warm Starts
+# ============================================================
+# Layout (little-endian):
+#   header: magic | catalog version | db fingerprint | schema version | marshal version | rows length | body length
+#   rows:   marshal-encoded list of product dicts (cache order), loaded as ProductRecords
+#   body:   prebuilt JSON body of GET /api/products
+# The file is memory-mapped on load and replaced atomically on save.
+import hashlib
+import marshal
+import mmap
+import os
+import struct
+from typing import Optional
+
+import product_record
+from migrations import MIGRATIONS
+
+SNAPSHOT_PATH = os.getenv("CATALOG_SNAPSHOT_PATH", os.path.join(os.path.dirname(__file__), ".cache", "catalog.snapshot"))
+
+_MAGIC = b"KGSCAT01"
+_HEADER = struct.Struct("<8sq16sIIQQ")
+
+
+class CatalogSnapshot:
+    def __init__(self, version: int, rows: list, body: bytes):
+        self.version = version
+        self.rows = rows
+        self.body = body
+
+
+def _fingerprint() -> bytes:
+    """Ties a snapshot to the database it was taken from."""
+    return hashlib.sha256((os.getenv("DATABASE_URL") or "").encode()).digest()[:16]
+
+
+def _schema_version() -> int:
+    return MIGRATIONS[-1][0]
+
+
+def load(path: str = SNAPSHOT_PATH) -> Optional[CatalogSnapshot]:
+    """Map and decode the snapshot. Returns None if missing, corrupt, or taken from another database/schema."""
+    try:
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            magic, version, fingerprint, schema, marshal_version, rows_len, body_len = _HEADER.unpack_from(mm, 0)
+            if (magic != _MAGIC or fingerprint != _fingerprint() or schema != _schema_version()
+                    or marshal_version != marshal.version or _HEADER.size + rows_len + body_len != len(mm)):
+                print(f"Catalog snapshot at {path} does not match this database/build. Ignoring it.")
+                return None
+            with memoryview(mm) as view:
+                rows = product_record.from_rows(marshal.loads(view[_HEADER.size:_HEADER.size + rows_len]))
+                body = bytes(view[_HEADER.size + rows_len:])
+            return CatalogSnapshot(version, rows, body)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f"Catalog snapshot at {path} is unreadable: {e}")
+        return None
+
+
+def save(version: int, rows: list, body: bytes, path: str = SNAPSHOT_PATH):
+    """Write the snapshot to a temp file and rename it into place, so readers never see a partial file."""
+    encoded = marshal.dumps([dict(row) for row in rows])
+    header = _HEADER.pack(_MAGIC, version, _fingerprint(), _schema_version(), marshal.version, len(encoded), len(body))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(header)
+            f.write(encoded)
+            f.write(body)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
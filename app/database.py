@@ -1,33 +1,211 @@
 import psycopg2  # type: ignore
-from psycopg2 import extras, pool  # type: ignore
+from psycopg2 import errors, extras, pool  # type: ignore
 import os
 import json
 import time
 import html
 import re
+import threading
+from collections import OrderedDict
 from datetime import datetime
 from typing import Optional
 
+import catalog_columns
+import metrics
+import product_record
+import rec_artifacts
+import similarity
+from topk import top_k, first_k
+from migrations import migrate
+
 DATABASE_URL = os.getenv("DATABASE_URL")
 
 # ── Product cache ─────────────────────────────────────────
 _products_cache = None
 _products_cache_time = 0
+_products_by_id = {}
+# catalog_version value the cache was loaded at
+_products_cache_version = None
+# Bumped on every change to the cached list, so derived data (serialized bodies) knows to rebuild
+_products_generation = 0
 
 def _invalidate_products_cache():
-    global _products_cache
+    global _products_cache, _products_by_id, _products_generation
     _products_cache = None
+    _products_by_id = {}
+    _products_generation += 1
 
 def _update_cache_item(product_id, updates):
     """Update a single item in the in-memory cache to avoid full re-fetches."""
-    global _products_cache
+    global _products_generation
     if _products_cache is not None:
-        for p in _products_cache:
-            if p.get('id') == product_id:
-                p.update(updates)
-                break
+        p = _products_by_id.get(product_id)
+        if p is not None:
+            p.update(updates)
+            _products_generation += 1
+
+def products_cache_state() -> tuple:
+    """(generation, catalog_version) of the cached product list."""
+    return _products_generation, _products_cache_version
+
+def prime_products_cache(rows: list, version: int) -> int:
+    """Install an already-validated list of ProductRecords (e.g. from the on-disk snapshot). Returns the new generation."""
+    global _products_cache, _products_cache_time, _products_by_id, _products_cache_version, _products_generation
+    _products_cache = rows
+    _products_by_id = {p['id']: p for p in rows}
+    _products_cache_time = time.time()
+    _products_cache_version = version
+    _products_generation += 1
+    return _products_generation
+
+_catalog_columns = {"key": None, "columns": None}
+
+def get_catalog_columns() -> "Optional[catalog_columns.CatalogColumns]":
+    """Columnar view of the cached catalog, rebuilt when the list changes. None without NumPy."""
+    products = get_all_products()
+    key = (id(products), _products_generation)
+    if _catalog_columns["key"] != key:
+        _catalog_columns["columns"] = catalog_columns.build(products)
+        _catalog_columns["key"] = key
+    return _catalog_columns["columns"]
+
+def query_products(category: Optional[str] = None, sub_category: Optional[str] = None,
+                   min_price: Optional[float] = None, max_price: Optional[float] = None,
+                   in_stock: bool = False, sort: Optional[str] = None, limit: Optional[int] = None,
+                   visible_only: bool = True) -> list:
+    """Products matching the filters (visible ones unless visible_only=False), in catalog order unless sort is one of catalog_columns.SORT_KEYS."""
+    columns = get_catalog_columns()
+    if columns is not None:
+        mask = columns.mask(category=category, sub_category=sub_category, min_price=min_price,
+                            max_price=max_price, visible_only=visible_only, in_stock_only=in_stock)
+        return columns.select(mask, sort=sort, limit=limit)
+    result = [
+        p for p in get_all_products()
+        if (not visible_only or p.get('is_visible', True))
+        and (not in_stock or p.get('in_stock'))
+        and (category is None or p.get('category') == category)
+        and (sub_category is None or p.get('sub_category') == sub_category)
+        and (min_price is None or p['price'] >= min_price)
+        and (max_price is None or p['price'] <= max_price)
+    ]
+    if sort == "price":
+        result.sort(key=lambda p: p['price'])
+    elif sort == "-price":
+        result.sort(key=lambda p: -p['price'])
+    elif sort == "discount":
+        result.sort(key=lambda p: -((p['mrp'] - p['price']) / p['mrp'] if p.get('mrp') and p['mrp'] > p['price'] else 0.0))
+    elif sort == "newest":
+        result.sort(key=lambda p: not p.get('is_newly_launched'))
+    elif sort not in (None, "display_order"):
+        raise ValueError(f"Unknown sort {sort!r}; expected one of {catalog_columns.SORT_KEYS}")
+    return result if limit is None else result[:max(limit, 0)]
+
+def get_catalog_version() -> int:
+    """Current catalog version; changes when a product's content (anything but its stock level) changes."""
+    conn = get_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT version FROM catalog_version")
+        version = cursor.fetchone()["version"]
+        conn.commit()
+        return version
+    finally:
+        release_connection(conn)
+
+def apply_stock_levels(levels: dict):
+    """Patch stock_qty/in_stock of cached products in place after an order or restock.
+
+    The cached dicts are shared by every catalog snapshot holder, so this is
+    visible everywhere without invalidating and re-sorting the whole catalog.
+    """
+    for product_id, qty in levels.items():
+        _update_cache_item(product_id, {"stock_qty": qty, "in_stock": qty > 0})
+
+def sync_stock_levels() -> int:
+    """Pull stock_qty/in_stock of every product into the cache, patching only rows that differ.
+
+    Stock changes do not move the catalog version (migration 9), so this is how
+    another worker's checkouts and cancels reach this worker's cache. Returns the
+    number of cached products updated.
+    """
+    if _products_cache is None:
+        return 0
+    conn = get_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT id, stock_qty, in_stock FROM products")
+        rows = cursor.fetchall()
+        conn.commit()
+    finally:
+        release_connection(conn)
+    changed = 0
+    for row in rows:
+        p = _products_by_id.get(row["id"])
+        if p is not None and (p["stock_qty"] != row["stock_qty"] or p["in_stock"] != row["in_stock"]):
+            _update_cache_item(row["id"], {"stock_qty": row["stock_qty"], "in_stock": row["in_stock"]})
+            changed += 1
+    return changed
+
+# ── Customer cache ────────────────────────────────────────
+# Read-through by phone, write-through from every customer write below
+# (profile and PIN updates, cancellations), so this worker never serves a row
+# older than its own writes. The TTL bounds how long another worker's write can
+# stay invisible here. That is harmless for /api/auth/me, existence checks and
+# the forgot-PIN question, which read through the cache; PIN and security-answer
+# checks read with fresh=True, and the order path locks the row in its own
+# transaction, since a stale copy there would let an old PIN or a fresh cancel
+# slip through.
+_customer_cache: "OrderedDict[str, tuple]" = OrderedDict()
+_customer_cache_lock = threading.Lock()
+CUSTOMER_CACHE_TTL = int(os.getenv("CUSTOMER_CACHE_TTL", "30"))
+CUSTOMER_CACHE_SIZE = int(os.getenv("CUSTOMER_CACHE_SIZE", "2048"))
+
+def _cache_customer(row):
+    """Store a customer row (dict) in the cache, keyed by phone."""
+    if not row:
+        return
+    with _customer_cache_lock:
+        _customer_cache[row["phone"]] = (dict(row), time.time())
+        _customer_cache.move_to_end(row["phone"])
+        if len(_customer_cache) > CUSTOMER_CACHE_SIZE:
+            _customer_cache.popitem(last=False)
+
+def _get_cached_customer(phone: str):
+    with _customer_cache_lock:
+        entry = _customer_cache.get(phone)
+        if entry is None:
+            return None
+        row, cached_at = entry
+        if time.time() - cached_at >= CUSTOMER_CACHE_TTL:
+            del _customer_cache[phone]
+            return None
+        _customer_cache.move_to_end(phone)
+        return dict(row)
+
+def _invalidate_customer(phone: str):
+    with _customer_cache_lock:
+        _customer_cache.pop(phone, None)
+
+class TracingCursor(extras.RealDictCursor):
+    """RealDictCursor that reports each statement's duration to the current request trace."""
+
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            metrics.observe_query(query, time.perf_counter() - started)
+
+    def executemany(self, query, vars_list):
+        started = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            metrics.observe_query(query, time.perf_counter() - started)
 
 _db_pool = None
+# id(conn) -> perf_counter at checkout, for per-request DB time
+_checkout_times = {}
 
 def init_pool():
     global _db_pool
@@ -48,7 +226,7 @@ def init_pool():
                 # Small pool, fast timeout for serverless
                 _db_pool = pool.ThreadedConnectionPool(
                     1, 5, url, 
-                    cursor_factory=extras.RealDictCursor, 
+                    cursor_factory=TracingCursor, 
                     connect_timeout=10
                 )
                 print("Connection Pool Initialized.")
@@ -69,7 +247,12 @@ def get_connection():
     last_err = None
     for attempt in range(max_retries):
         try:
-            return _db_pool.getconn()
+            started = time.perf_counter()
+            conn = _db_pool.getconn()
+            now = time.perf_counter()
+            metrics.observe_pool_wait(now - started)
+            _checkout_times[id(conn)] = now
+            return conn
         except Exception as e:
             last_err = e
             print(f"Connection attempt {attempt+1} failed: {e}")
@@ -80,184 +263,31 @@ def get_connection():
 
 def release_connection(conn):
     if _db_pool is not None and conn is not None:
+        checked_out = _checkout_times.pop(id(conn), None)
+        if checked_out is not None:
+            metrics.observe_db_time(time.perf_counter() - checked_out)
         try:
             _db_pool.putconn(conn)
         except Exception as e:
             print(f"Error releasing connection: {e}")
 
-def init_db():
-    """Create tables and run migrations in a single batch to minimize latency."""
+def init_db() -> dict:
+    """Apply pending schema migrations and seed an empty catalog. Returns per-phase timings in ms."""
+    timings = {}
+    mark = time.perf_counter()
     conn = get_connection()
+    timings["db_connect"] = (time.perf_counter() - mark) * 1000
     try:
         cursor = conn.cursor()
-        
-        # Combine all schema setup into one multi-statement block
-        setup_sql = """
-            -- Products table
-            CREATE TABLE IF NOT EXISTS products (
-                id SERIAL PRIMARY KEY,
-                name TEXT NOT NULL,
-                price REAL NOT NULL,
-                mrp REAL NOT NULL DEFAULT 0.0,
-                description TEXT NOT NULL,
-                image_url TEXT NOT NULL,
-                category TEXT NOT NULL,
-                sub_category TEXT NOT NULL DEFAULT '',
-                base_name TEXT NOT NULL DEFAULT '',
-                unit TEXT NOT NULL DEFAULT 'kg',
-                is_visible BOOLEAN NOT NULL DEFAULT TRUE,
-                in_stock BOOLEAN NOT NULL DEFAULT TRUE,
-                is_newly_launched BOOLEAN NOT NULL DEFAULT FALSE,
-                display_order INTEGER NOT NULL DEFAULT 0
-            );
-
-            -- Migrations for products
-            DO $$ BEGIN
-                IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='products' AND column_name='mrp') THEN
-                    ALTER TABLE products ADD COLUMN mrp REAL NOT NULL DEFAULT 0.0;
-                END IF;
-                IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='products' AND column_name='sub_category') THEN
-                    ALTER TABLE products ADD COLUMN sub_category TEXT NOT NULL DEFAULT '';
-                END IF;
-                IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='products' AND column_name='is_visible') THEN
-                    ALTER TABLE products ADD COLUMN is_visible BOOLEAN NOT NULL DEFAULT TRUE;
-                END IF;
-                IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='products' AND column_name='in_stock') THEN
-                    ALTER TABLE products ADD COLUMN in_stock BOOLEAN NOT NULL DEFAULT TRUE;
-                END IF;
-                IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='products' AND column_name='is_newly_launched') THEN
-                    ALTER TABLE products ADD COLUMN is_newly_launched BOOLEAN NOT NULL DEFAULT FALSE;
-                END IF;
-                IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='products' AND column_name='display_order') THEN
-                    ALTER TABLE products ADD COLUMN display_order INTEGER NOT NULL DEFAULT 0;
-                END IF;
-            END $$;
-
-            -- Fix any 0.0 or null MRPs to match price
-            UPDATE products SET mrp = price WHERE mrp = 0.0 OR mrp IS NULL;
-
-            -- Orders table
-            CREATE TABLE IF NOT EXISTS orders (
-                id SERIAL PRIMARY KEY,
-                token TEXT NOT NULL UNIQUE,
-                phone TEXT NOT NULL,
-                items_json TEXT NOT NULL,
-                status TEXT NOT NULL DEFAULT 'Processing',
-                total REAL NOT NULL,
-                timestamp TEXT NOT NULL,
-                address TEXT,
-                delivery_type TEXT NOT NULL DEFAULT 'pickup',
-                delivery_time TEXT NOT NULL DEFAULT 'same_day',
-                delivered_at TEXT,
-                delivery_otp TEXT,
-                payment_method TEXT NOT NULL DEFAULT 'cod',
-                payment_status TEXT NOT NULL DEFAULT 'pending'
-            );
-
-            -- Migrations for orders payment columns
-            DO $$ BEGIN
-                IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='orders' AND column_name='payment_method') THEN
-                    ALTER TABLE orders ADD COLUMN payment_method TEXT NOT NULL DEFAULT 'cod';
-                END IF;
-                IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='orders' AND column_name='payment_status') THEN
-                    ALTER TABLE orders ADD COLUMN payment_status TEXT NOT NULL DEFAULT 'pending';
-                END IF;
-            END $$;
-
-            -- Customers table
-            CREATE TABLE IF NOT EXISTS customers (
-                phone TEXT PRIMARY KEY,
-                name TEXT,
-                email TEXT,
-                address TEXT,
-                pin_hash TEXT,
-                cancel_timestamps TEXT DEFAULT '[]',
-                created_at TEXT NOT NULL
-            );
-
-            -- Migrations for customer security questions
-            DO $$ BEGIN
-                IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='customers' AND column_name='security_question') THEN
-                    ALTER TABLE customers ADD COLUMN security_question TEXT;
-                END IF;
-                IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='customers' AND column_name='security_answer_hash') THEN
-                    ALTER TABLE customers ADD COLUMN security_answer_hash TEXT;
-                END IF;
-            END $$;
-
-            -- Token counter
-            CREATE TABLE IF NOT EXISTS counters (
-                name TEXT PRIMARY KEY,
-                value INTEGER NOT NULL DEFAULT 100
-            );
-            INSERT INTO counters (name, value) VALUES ('order_token', 100) ON CONFLICT DO NOTHING;
-
-            -- Order token sequence (concurrency lock-free generation)
-            CREATE SEQUENCE IF NOT EXISTS order_token_seq START WITH 101;
-            
-            -- Sync sequence with current max order token to prevent duplicates
-            DO $$
-            BEGIN
-                IF EXISTS (SELECT 1 FROM information_schema.tables WHERE table_name = 'orders') THEN
-                    PERFORM setval('order_token_seq', COALESCE((SELECT MAX(NULLIF(regexp_replace(token, '\D', '', 'g'), '')::integer) FROM orders), 100) + 1, false);
-                END IF;
-            END $$;
-
-            -- Favorites
-            CREATE TABLE IF NOT EXISTS customer_favorites (
-                phone TEXT NOT NULL,
-                product_id INTEGER NOT NULL,
-                added_at TEXT NOT NULL,
-                PRIMARY KEY (phone, product_id)
-            );
-
-            -- Sorting Index for fast product retrieval (per-category rank ordering)
-            CREATE INDEX IF NOT EXISTS idx_products_sorting ON products (
-                category,
-                (CASE WHEN display_order > 0 THEN 0 ELSE 1 END),
-                display_order,
-                base_name,
-                price
-            );
-
-            -- Official categories table
-            CREATE TABLE IF NOT EXISTS official_categories (
-                name TEXT PRIMARY KEY,
-                emoji TEXT NOT NULL DEFAULT '📦',
-                color TEXT NOT NULL DEFAULT '#64748b',
-                display_order INTEGER NOT NULL DEFAULT 0
-            );
-        """
-        cursor.execute(setup_sql)
-
-        # Seed official_categories if empty
-        cursor.execute("SELECT COUNT(*) as count FROM official_categories")
-        row_cat = cursor.fetchone()
-        cat_count = row_cat['count'] if row_cat else 0
-        if cat_count == 0:
-            print("Official categories table empty. Initializing categories...")
-            default_cats = [
-                ('Atta, Rice & Dal', '🌾', '#f59e0b', 1),
-                ('Masala & Dry Fruits', '🌶️', '#ef4444', 2),
-                ('Snacks & Munchies', '🍿', '#8b5cf6', 3),
-                ('Sweet Tooth', '🍭', '#ec4899', 4),
-                ('Cleaning Essentials', '🧼', '#06b6d4', 5),
-                ('Instant & Frozen Food', '🍜', '#f97316', 6),
-                ('Dairy & Bread', '🥛', '#3b82f6', 7),
-                ('Personal Care', '💄', '#d946ef', 8),
-                ('Cold Drinks & Juices', '🥤', '#22c55e', 9),
-                ('Wellness', '💊', '#14b8a6', 10),
-                ('Tea, Coffee & Health Drinks', '☕', '#92400e', 11),
-                ('Home & Lifestyle', '🏠', '#0ea5e9', 12),
-                ('Pooja Needs', '🪔', '#eab308', 13),
-                ('Miscellaneous', '📦', '#64748b', 14)
-            ]
-            cursor.executemany(
-                "INSERT INTO official_categories (name, emoji, color, display_order) VALUES (%s, %s, %s, %s)",
-                default_cats
-            )
-        
+
+        mark = time.perf_counter()
+        applied = migrate(cursor)
+        timings["migrations"] = (time.perf_counter() - mark) * 1000
+        if not applied:
+            print("Schema up to date.")
+
         # Check product count for conditional seeding
+        mark = time.perf_counter()
         cursor.execute("SELECT COUNT(*) as count FROM products")
         row = cursor.fetchone()
         count = row['count'] if row else 0
@@ -276,12 +306,14 @@ def init_db():
             print(f"Products already exist ({count} items). Skipping seeding.")
 
         conn.commit()
+        timings["seed_check"] = (time.perf_counter() - mark) * 1000
     except Exception as e:
         print(f"Database initialization failed: {e}")
         if conn: conn.rollback()
     finally:
         if conn: release_connection(conn)
         _invalidate_products_cache()
+    return timings
 
 def _seed_products(cursor):
     """Seed products from the ultimate Zepto CSV and store.db SQLite."""
@@ -434,21 +466,26 @@ def _seed_products(cursor):
                 "INSERT INTO products (name, price, mrp, description, image_url, category, sub_category, base_name, unit, is_visible, in_stock, is_newly_launched, display_order) VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s, TRUE, TRUE, FALSE, 0)",
                 final_products,
             )
+            # Fix any 0.0 MRPs to match price
+            cursor.execute("UPDATE products SET mrp = price WHERE mrp = 0.0 OR mrp IS NULL")
             print(f"Successfully seeded {len(final_products)} products into database.")
         except Exception as e:
             print(f"Error during PostgreSQL insertion: {e}")
     else:
         print("No products found to seed.")
 
-def get_all_products():
-    """Fetch all products (5-min in-memory cache)."""
-    global _products_cache, _products_cache_time
+def get_all_products(force: bool = False):
+    """Fetch all products (5-min in-memory cache). force=True reloads from the database."""
+    global _products_cache, _products_cache_time, _products_by_id, _products_cache_version, _products_generation
     now = time.time()
-    if _products_cache is not None and (now - _products_cache_time) < 300:
+    if not force and _products_cache is not None and (now - _products_cache_time) < 300:
         return _products_cache
     conn = get_connection()
     try:
         cursor = conn.cursor()
+        # Read the version first: a write landing in between only makes the label older
+        cursor.execute("SELECT version FROM catalog_version")
+        version = cursor.fetchone()["version"]
         # Sort by category first, then ranked products (display_order > 0) before unranked
         # within each category, so rank 1 in Dairy is first IN Dairy, not first globally.
         cursor.execute("""
@@ -461,22 +498,42 @@ def get_all_products():
                 price
         """)
         rows = cursor.fetchall()
-        _products_cache = [dict(row) for row in rows]
+        conn.commit()
+        _products_cache = product_record.from_rows(rows)
+        _products_by_id = {p['id']: p for p in _products_cache}
         _products_cache_time = now
+        _products_cache_version = version
+        _products_generation += 1
         return _products_cache
     finally:
         release_connection(conn)
 
+def get_products_by_id() -> dict:
+    """The cached catalog keyed by id (shares the records of get_all_products())."""
+    products = get_all_products()
+    return _products_by_id or {p['id']: p for p in products}
+
 # ── Customer OTP auth ─────────────────────────────────────
 
-def get_customer(phone: str):
-    """Fetch customer record by phone."""
+def get_customer(phone: str, fresh: bool = False):
+    """Fetch customer record by phone (read-through cache).
+
+    fresh=True skips the cache, for reads that must see other workers' writes
+    (PIN and security-answer checks); the cache is refreshed with the result.
+    """
+    if not fresh:
+        cached = _get_cached_customer(phone)
+        if cached is not None:
+            return cached
     conn = get_connection()
     try:
         cursor = conn.cursor()
         cursor.execute("SELECT * FROM customers WHERE phone = %s", (phone,))
         row = cursor.fetchone()
-        return dict(row) if row else None
+        if not row:
+            return None
+        _cache_customer(row)
+        return dict(row)
     finally:
         release_connection(conn)
 
@@ -487,65 +544,62 @@ def get_customer_by_email(email: str):
         cursor = conn.cursor()
         cursor.execute("SELECT * FROM customers WHERE email = %s", (email,))
         row = cursor.fetchone()
-        return dict(row) if row else None
+        if not row:
+            return None
+        _cache_customer(row)
+        return dict(row)
     finally:
         release_connection(conn)
 
 def create_or_update_customer(phone: str, name: "Optional[str]" = None, email: "Optional[str]" = None, address: "Optional[str]" = None, pin_hash: "Optional[str]" = None, security_question: "Optional[str]" = None, security_answer_hash: "Optional[str]" = None):
-    """Insert or update customer details."""
-    existing = get_customer(phone)
-    conn = get_connection()
-    try:
-        if existing:
-            # Update existing
-            if name or email or address or pin_hash or security_question or security_answer_hash:
-                query = "UPDATE customers SET "
-                params = []
-                if name:
-                    query += "name = %s, "
-                    params.append(name)
-                if email:
-                    query += "email = %s, "
-                    params.append(email)
-                if address:
-                    query += "address = %s, "
-                    params.append(address)
-                if pin_hash:
-                    query += "pin_hash = %s, "
-                    params.append(pin_hash)
-                if security_question:
-                    query += "security_question = %s, "
-                    params.append(security_question)
-                if security_answer_hash:
-                    query += "security_answer_hash = %s, "
-                    params.append(security_answer_hash)
-                
-                query = query.rstrip(', ')
-                query += " WHERE phone = %s"
-                params.append(phone)
-                cursor = conn.cursor()
-                cursor.execute(query, tuple(params))
-        else:
-            # Insert new
-            cursor = conn.cursor()
-            cursor.execute(
-                "INSERT INTO customers (phone, name, email, address, pin_hash, cancel_timestamps, created_at, security_question, security_answer_hash) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)",
-                (phone, name, email, address, pin_hash, "[]", datetime.now().strftime("%Y-%m-%d %H:%M:%S"), security_question, security_answer_hash)
-            )
-        conn.commit()
-    finally:
-        release_connection(conn)
+    """Insert or update customer details in one UPSERT.
 
-def update_customer_cancels(phone: str, cancel_timestamps_json: str):
-    """Update a customer's cancel timestamps JSON string."""
+    On update only non-empty fields overwrite the stored values. The
+    resulting row is written through to the customer cache.
+    """
+    fields = ("name", "email", "address", "pin_hash", "security_question", "security_answer_hash")
+    updates = ", ".join(f"{f} = COALESCE(NULLIF(EXCLUDED.{f}, ''), customers.{f})" for f in fields)
     conn = get_connection()
     try:
         cursor = conn.cursor()
-        cursor.execute("UPDATE customers SET cancel_timestamps = %s WHERE phone = %s", (cancel_timestamps_json, phone))
+        cursor.execute(
+            f"""
+            INSERT INTO customers (phone, name, email, address, pin_hash, cancel_timestamps, created_at, security_question, security_answer_hash)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+            ON CONFLICT (phone) DO UPDATE SET {updates}
+            RETURNING *
+            """,
+            (phone, name, email, address, pin_hash, "[]", datetime.now().strftime("%Y-%m-%d %H:%M:%S"), security_question, security_answer_hash)
+        )
+        row = cursor.fetchone()
         conn.commit()
+        _cache_customer(row)
+    except Exception:
+        _invalidate_customer(phone)
+        raise
     finally:
         release_connection(conn)
 
+def _record_cancel(cursor, phone: str, cancelled_at: str, since: str):
+    """Append a cancellation and drop those older than since, in one UPDATE so
+    concurrent cancels are never lost. Returns the updated customer row, or None."""
+    cursor.execute(
+        """
+        UPDATE customers SET cancel_timestamps = (
+            SELECT COALESCE(jsonb_agg(c.ts ORDER BY c.ts), '[]'::jsonb)::text
+            FROM (
+                SELECT DISTINCT ts
+                FROM jsonb_array_elements_text(COALESCE(NULLIF(cancel_timestamps, ''), '[]')::jsonb || to_jsonb(%s::text)) AS e(ts)
+                WHERE ts::timestamp > %s::timestamp
+            ) c
+        )
+        WHERE phone = %s
+        RETURNING *
+        """,
+        (cancelled_at, since, phone)
+    )
+    return cursor.fetchone()
+
 def get_all_customers():
     """Fetch all signed-up customers."""
     conn = get_connection()
@@ -557,40 +611,83 @@ def get_all_customers():
     finally:
         release_connection(conn)
 
-# ── Orders ────────────────────────────────────────────────
-
-def create_order(phone: str, items: list, total: float, delivery_type: str = "pickup", delivery_time: str = "same_day", address: "Optional[str]" = None, payment_method: str = "cod") -> str:
-    """Create a new order and return the generated token."""
-    conn = get_connection()
-    try:
-        cursor = conn.cursor()
-        
-        # Lock-free sequence generation
-        cursor.execute("SELECT nextval('order_token_seq') AS value")
-        token_num = cursor.fetchone()['value']
-        token = str(token_num)
+# ── Inventory ─────────────────────────────────────────────
 
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        items_json = json.dumps(items)
-        
-        # Payment status: UPI orders start as 'pending', COD orders as 'cod'
-        payment_status = "pending" if payment_method == "upi" else "cod"
-        
-        # Delivery OTP: for UPI it's generated later by admin. For COD it's generated now.
-        import random
-        delivery_otp = None
-        if delivery_type == "delivery" and payment_method == "cod":
-            delivery_otp = str(random.randint(1000, 9999))
+def reserve_stock(cursor, token: str, quantities: dict) -> dict:
+    """Decrement tracked stock for an order and record the reservations, in one statement.
 
-        cursor.execute(
-            "INSERT INTO orders (token, phone, items_json, status, total, timestamp, delivery_type, delivery_time, address, delivery_otp, payment_method, payment_status) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)",
-            (token, phone, items_json, "Processing", total, timestamp, delivery_type, delivery_time, address, delivery_otp, payment_method, payment_status),
+    quantities maps product_id -> quantity. Products with stock_qty NULL are
+    not tracked and are skipped. Only the affected rows are locked; overselling
+    is rejected by the stock_qty >= 0 check constraint, which aborts the
+    caller's transaction. Returns {product_id: new stock_qty}.
+    """
+    if not quantities:
+        return {}
+    cursor.execute(
+        """
+        WITH d(id, qty) AS (SELECT * FROM unnest(%s::int[], %s::int[])),
+        dec AS (
+            UPDATE products p
+            SET stock_qty = p.stock_qty - d.qty, in_stock = p.stock_qty - d.qty > 0
+            FROM d
+            WHERE p.id = d.id AND p.stock_qty IS NOT NULL
+            RETURNING p.id, p.stock_qty, d.qty
+        ),
+        res AS (
+            INSERT INTO stock_reservations (order_token, product_id, quantity)
+            SELECT %s, id, qty FROM dec
         )
+        SELECT id, stock_qty FROM dec
+        """,
+        (list(quantities.keys()), list(quantities.values()), token)
+    )
+    return {row['id']: row['stock_qty'] for row in cursor.fetchall()}
 
-        conn.commit()
-        return token, delivery_otp
-    finally:
-        release_connection(conn)
+def _release_stock(cursor, token: str) -> dict:
+    """Return an order's reserved stock to the shelf. Idempotent: reservations are deleted as they are released.
+
+    Orders without tracked items have no reservations and never touch products.
+    """
+    cursor.execute(
+        "DELETE FROM stock_reservations WHERE order_token = %s RETURNING product_id, quantity",
+        (token,)
+    )
+    released = {}
+    for row in cursor.fetchall():
+        released[row['product_id']] = released.get(row['product_id'], 0) + row['quantity']
+    if not released:
+        return {}
+    cursor.execute(
+        """
+        UPDATE products p
+        SET stock_qty = p.stock_qty + r.qty, in_stock = TRUE
+        FROM unnest(%s::int[], %s::int[]) AS r(id, qty)
+        WHERE p.id = r.id AND p.stock_qty IS NOT NULL
+        RETURNING p.id, p.stock_qty
+        """,
+        (list(released.keys()), list(released.values()))
+    )
+    return {row['id']: row['stock_qty'] for row in cursor.fetchall()}
+
+def _order_quantities(items: list) -> dict:
+    quantities = {}
+    for item in items:
+        pid = int(item["product_id"])
+        quantities[pid] = quantities.get(pid, 0) + int(item["quantity"])
+    return quantities
+
+# ── Job outbox ────────────────────────────────────────────
+
+def enqueue_jobs(cursor, jobs: list):
+    """Insert (kind, partition_key, payload) jobs with the caller's cursor, so they commit with its transaction."""
+    if not jobs:
+        return
+    cursor.execute(
+        "INSERT INTO job_outbox (kind, partition_key, payload) SELECT * FROM unnest(%s::text[], %s::text[], %s::text[])",
+        ([j[0] for j in jobs], [j[1] for j in jobs], [json.dumps(j[2]) for j in jobs])
+    )
+
+# ── Orders ────────────────────────────────────────────────
 
 def confirm_payment_and_generate_otp(order_token: str) -> "Optional[str]":
     """Admin action: mark payment as received, generate secure delivery OTP.
@@ -672,19 +769,91 @@ def get_orders_by_phone(phone: str):
     finally:
         release_connection(conn)
 
-def update_order_status(token: str, status: str) -> bool:
-    """Update order status. Returns True if updated."""
+def _set_order_status(cursor, token: str, status: str) -> tuple:
+    """Set an order's status with its stock and profile side effects. Returns (row or None, new stock levels).
+
+    Cancelling releases the order's reserved stock; un-cancelling reserves it
+    again and raises ValueError (the caller's transaction is then aborted) if
+    there is no longer enough.
+    """
+    cursor.execute(
+        """
+        UPDATE orders o SET status = %s
+        FROM (SELECT id, status FROM orders WHERE token = %s FOR UPDATE) prev
+        WHERE o.id = prev.id
+        RETURNING o.phone, o.items_json, prev.status AS previous_status
+        """,
+        (status, token)
+    )
+    row = cursor.fetchone()
+    if row is None:
+        return None, {}
+    try:
+        items = json.loads(row['items_json'])
+    except ValueError:
+        items = []
+    levels = {}
+    if status == "Cancelled":
+        levels = _release_stock(cursor, token)
+    elif row['previous_status'] == "Cancelled":
+        try:
+            levels = reserve_stock(cursor, token, _order_quantities(items))
+        except errors.CheckViolation:
+            raise ValueError("Not enough stock left to restore this order")
+    # Cancelled orders do not count towards preferences; un-cancelling counts them again
+    if (row['previous_status'] == "Cancelled") != (status == "Cancelled"):
+        apply_order_to_profile(cursor, row['phone'], items, sign=-1 if status == "Cancelled" else 1)
+        # EWMA intervals cannot be un-applied, so recompute this customer's from history
+        _rebuild_purchase_stats(cursor, row['phone'])
+    return row, levels
+
+def update_order_status(token: str, status: str, jobs: "Optional[list]" = None) -> bool:
+    """Update order status. Returns True if updated. Cancelling restocks the order's reserved items;
+    un-cancelling reserves them again (ValueError if they are no longer in stock).
+
+    jobs are enqueued to the outbox in the same transaction, only if the order was updated.
+    """
     conn = get_connection()
     try:
         cursor = conn.cursor()
-        cursor.execute("UPDATE orders SET status = %s WHERE token = %s", (status, token))
-        updated = cursor.rowcount > 0
+        row, levels = _set_order_status(cursor, token, status)
+        if row is not None and jobs:
+            enqueue_jobs(cursor, jobs)
         conn.commit()
-        return updated
+        apply_stock_levels(levels)
+        return row is not None
     finally:
         release_connection(conn)
     return False
 
+def cancel_order_for_customer(token: str, phone: str, cancelled_at: str, since: str, jobs: "Optional[list]" = None) -> "Optional[int]":
+    """Cancel an order on the customer's behalf and add it to their cancel history, in one transaction.
+
+    The next order check sees the cancel as soon as this returns. Returns the
+    customer's cancellations after since (ISO timestamps), this one included,
+    or None if the order was not updated.
+    """
+    conn = get_connection()
+    try:
+        cursor = conn.cursor()
+        # Customer row first: place_order locks it (FOR SHARE) before the product rows
+        customer = _record_cancel(cursor, phone, cancelled_at, since)
+        row, levels = _set_order_status(cursor, token, "Cancelled")
+        if row is None:
+            conn.rollback()
+            return None
+        if jobs:
+            enqueue_jobs(cursor, jobs)
+        conn.commit()
+    except Exception:
+        _invalidate_customer(phone)
+        raise
+    finally:
+        release_connection(conn)
+    apply_stock_levels(levels)
+    _cache_customer(customer)
+    return len(json.loads(customer["cancel_timestamps"])) if customer else 1
+
 def reject_order_payment(token: str) -> bool:
     """Explicitly mark a payment as rejected/unverified."""
     conn = get_connection()
@@ -712,6 +881,8 @@ def mark_delivered(token: str) -> bool:
             (delivered_at, token)
         )
         updated = cursor.rowcount > 0
+        # Delivered goods have left the shelf for good
+        cursor.execute("DELETE FROM stock_reservations WHERE order_token = %s", (token,))
         conn.commit()
         return updated
     finally:
@@ -730,7 +901,7 @@ def clean_html_entities(text: str) -> str:
         curr = html.unescape(prev)
     return curr.strip()
 
-def add_product(name: str, price: float, mrp: float, description: str, image_url: str, category: str, sub_category: str = "", base_name: str = "", unit: str = "kg", is_newly_launched: bool = False) -> Optional[int]:
+def add_product(name: str, price: float, mrp: float, description: str, image_url: str, category: str, sub_category: str = "", base_name: str = "", unit: str = "kg", is_newly_launched: bool = False, stock_qty: "Optional[int]" = None) -> Optional[int]:
     """Add a new product to the database."""
     category = clean_html_entities(category)
     sub_category = clean_html_entities(sub_category)
@@ -740,8 +911,8 @@ def add_product(name: str, price: float, mrp: float, description: str, image_url
     try:
         cursor = conn.cursor()
         cursor.execute(
-            "INSERT INTO products (name, price, mrp, description, image_url, category, sub_category, base_name, unit, is_visible, in_stock, is_newly_launched, display_order) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, TRUE, TRUE, %s, 0) RETURNING id",
-            (name, price, mrp, description, image_url, category, sub_category, base_name, unit, is_newly_launched)
+            "INSERT INTO products (name, price, mrp, description, image_url, category, sub_category, base_name, unit, is_visible, in_stock, is_newly_launched, display_order, stock_qty) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, TRUE, %s, %s, 0, %s) RETURNING id",
+            (name, price, mrp, description, image_url, category, sub_category, base_name, unit, stock_qty is None or stock_qty > 0, is_newly_launched, stock_qty)
         )
         product_id = cursor.fetchone()['id']
         conn.commit()
@@ -765,6 +936,10 @@ def update_product(product_id: int, updates: dict) -> bool:
         else:
             updates.pop('mrp', None)
             
+    # in_stock is derived whenever the quantity is tracked
+    if updates.get('stock_qty') is not None:
+        updates['in_stock'] = updates['stock_qty'] > 0
+
     # Clean HTML entities if category or sub_category are updated
     if 'category' in updates and updates['category']:
         updates['category'] = clean_html_entities(updates['category'])
@@ -898,6 +1073,8 @@ def add_favorite(phone: str, product_id: int) -> bool:
             (phone, product_id, datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
         )
         added = cursor.rowcount > 0
+        if added:
+            _apply_profile_delta(cursor, phone, {c: FAVORITE_WEIGHT for c in _product_categories(cursor, [product_id]).values()})
         conn.commit()
         return added
     finally:
@@ -913,73 +1090,208 @@ def remove_favorite(phone: str, product_id: int) -> bool:
             (phone, product_id)
         )
         removed = cursor.rowcount > 0
+        if removed:
+            _apply_profile_delta(cursor, phone, {c: -FAVORITE_WEIGHT for c in _product_categories(cursor, [product_id]).values()})
         conn.commit()
         return removed
     finally:
         release_connection(conn)
 
-def get_category_preferences(phone: str) -> dict:
-    """Compute category weights from order history and favorites.
-    Returns {category_name: weight} sorted by weight descending.
+# ── Customer preference profiles ──────────────────────────
+# customer_profiles holds what personalized recommendations read: category
+# weights (1 per ordered unit, FAVORITE_WEIGHT per favorited product),
+# per-product order counts and the last order time. Order and favorite writes
+# apply deltas in their own transactions; a customer's row is built from full
+# history the first time it is read. Builds and deltas for one customer take
+# the same transaction-scoped advisory lock, so a build never snapshots
+# history while a delta that found no row yet is still uncommitted.
+FAVORITE_WEIGHT = 2
+# Namespace (first key) of the per-customer advisory locks; the second key is hashtext(phone)
+CUSTOMER_LOCK_NS = 734203
+
+def _lock_customer(cursor, phone: str):
+    """Serialize profile and purchase-stats writes for one customer until the transaction ends."""
+    cursor.execute("SELECT pg_advisory_xact_lock(%s, hashtext(%s))", (CUSTOMER_LOCK_NS, phone))
+
+_PROFILE_DELTA_SQL = """
+    UPDATE customer_profiles SET
+        category_weights = jsonb_add_counts(category_weights, %(categories)s::jsonb),
+        product_counts = jsonb_add_counts(product_counts, %(products)s::jsonb),
+        order_count = GREATEST(order_count + %(orders)s, 0),
+        last_order_at = GREATEST(last_order_at, %(ordered_at)s),
+        updated_at = now()
+    WHERE phone = %(phone)s
+"""
+
+def _product_categories(cursor, product_ids) -> dict:
+    cursor.execute("SELECT id, category FROM products WHERE id = ANY(%s)", (list(product_ids),))
+    return {row['id']: row['category'] for row in cursor.fetchall()}
+
+def _apply_profile_delta(cursor, phone: str, categories: dict, products: Optional[dict] = None, orders: int = 0, ordered_at: Optional[str] = None):
+    """Add deltas to an existing profile row. Customers without a row are skipped;
+    their profile is built from history (including this change) on first read."""
+    _lock_customer(cursor, phone)
+    cursor.execute(_PROFILE_DELTA_SQL, {
+        "phone": phone,
+        "categories": json.dumps(categories),
+        "products": json.dumps({str(pid): n for pid, n in (products or {}).items()}),
+        "orders": orders,
+        "ordered_at": ordered_at,
+    })
+
+def apply_order_to_profile(cursor, phone: str, items: list, sign: int = 1, ordered_at: Optional[str] = None, categories: Optional[dict] = None):
+    """Count an order's items into (sign=1) or out of (sign=-1) the customer's profile, in the caller's transaction.
+
+    categories maps product_id -> category when the caller already has them (e.g. from locked product rows).
     """
-    all_products = {p['id']: p for p in get_all_products()}
-    favorite_ids = get_favorites(phone)
-    
+    quantities = _order_quantities(items)
+    if categories is None:
+        categories = _product_categories(cursor, quantities)
+    category_delta = {}
+    for pid, qty in quantities.items():
+        cat = categories.get(pid)
+        if cat:
+            category_delta[cat] = category_delta.get(cat, 0) + sign * qty
+    _apply_profile_delta(cursor, phone, category_delta, {pid: sign * qty for pid, qty in quantities.items()}, orders=sign, ordered_at=ordered_at)
+
+def _build_customer_profile(cursor, phone: str) -> dict:
+    """Compute a profile from the customer's full order history and favorites and store it.
+    Call with _lock_customer held, so concurrent deltas either commit first or see the row."""
+    cursor.execute("SELECT items_json, timestamp FROM orders WHERE phone = %s AND status != 'Cancelled'", (phone,))
+    orders = cursor.fetchall()
+    cursor.execute("SELECT product_id FROM customer_favorites WHERE phone = %s", (phone,))
+    favorite_ids = [row['product_id'] for row in cursor.fetchall()]
+
+    product_counts = {}
+    last_order_at = None
+    for order in orders:
+        try:
+            for pid, qty in _order_quantities(json.loads(order['items_json'])).items():
+                product_counts[pid] = product_counts.get(pid, 0) + qty
+        except Exception:
+            continue
+        if last_order_at is None or order['timestamp'] > last_order_at:
+            last_order_at = order['timestamp']
+
+    categories = _product_categories(cursor, set(product_counts) | set(favorite_ids))
+    weights = {}
+    for pid, qty in product_counts.items():
+        if pid in categories:
+            weights[categories[pid]] = weights.get(categories[pid], 0) + qty
+    for fid in favorite_ids:
+        if fid in categories:
+            weights[categories[fid]] = weights.get(categories[fid], 0) + FAVORITE_WEIGHT
+
+    _rebuild_purchase_stats(cursor, phone, orders)
+    profile = {
+        "category_weights": weights,
+        "product_counts": product_counts,
+        "order_count": len(orders),
+        "last_order_at": last_order_at,
+    }
+    cursor.execute(
+        """
+        INSERT INTO customer_profiles (phone, category_weights, product_counts, order_count, last_order_at)
+        VALUES (%s, %s, %s, %s, %s)
+        ON CONFLICT (phone) DO NOTHING
+        """,
+        (phone, json.dumps(weights), json.dumps({str(pid): n for pid, n in product_counts.items()}), len(orders), last_order_at)
+    )
+    return profile
+
+_LOAD_PROFILE_SQL = "SELECT category_weights, product_counts, order_count, last_order_at FROM customer_profiles WHERE phone = %s"
+
+def _load_customer_profile(cursor, phone: str) -> dict:
+    cursor.execute(_LOAD_PROFILE_SQL, (phone,))
+    row = cursor.fetchone()
+    if row is None:
+        _lock_customer(cursor, phone)
+        # Another request may have built it while we waited for the lock
+        cursor.execute(_LOAD_PROFILE_SQL, (phone,))
+        row = cursor.fetchone()
+        if row is None:
+            return _build_customer_profile(cursor, phone)
+    return {
+        "category_weights": row['category_weights'],
+        "product_counts": {int(pid): n for pid, n in row['product_counts'].items()},
+        "order_count": row['order_count'],
+        "last_order_at": row['last_order_at'],
+    }
+
+def get_customer_profile(phone: str) -> dict:
+    """Materialized preferences: category_weights, product_counts {product_id: qty}, order_count, last_order_at."""
     conn = get_connection()
     try:
-        cursor = conn.cursor()
-        weights = {}
+        profile = _load_customer_profile(conn.cursor(), phone)
+        conn.commit()
+        return profile
+    finally:
+        release_connection(conn)
 
-        # Weight from order history (1 pt per item ordered in that category)
+def get_customer_context(phone: str) -> dict:
+    """Everything the per-customer recommenders read, fetched in one connection checkout:
+    a catalog snapshot, the preference profile, favorite product ids and due reorder product ids."""
+    products = get_all_products()
+    conn = get_connection()
+    try:
+        cursor = conn.cursor()
+        profile = _load_customer_profile(cursor, phone)
         cursor.execute(
-            "SELECT items_json FROM orders WHERE phone = %s AND status != 'Cancelled' ORDER BY id DESC LIMIT 20",
+            "SELECT product_id FROM customer_favorites WHERE phone = %s ORDER BY added_at DESC",
             (phone,)
         )
-        orders = cursor.fetchall()
-        for order in orders:
-            try:
-                items = json.loads(order['items_json'])
-                for item in items:
-                    pid = item.get('product_id')
-                    if pid and pid in all_products:
-                        cat = all_products[pid].get('category', '')
-                        weights[cat] = weights.get(cat, 0) + item.get('quantity', 1)
-            except Exception:
-                pass
-
-        # Weight from favorites (2 pts per favorited product — stronger signal)
-        for fid in favorite_ids:
-            if fid in all_products:
-                cat = all_products[fid].get('category', '')
-                weights[cat] = weights.get(cat, 0) + 2
-
-        return dict(sorted(weights.items(), key=lambda x: x[1], reverse=True))
+        favorite_ids = [row['product_id'] for row in cursor.fetchall()]
+        reorder_ids = _reorder_due_ids(cursor, phone)
+        conn.commit()
     finally:
         release_connection(conn)
+    return {
+        "products": products,
+        "products_by_id": _products_by_id or {p['id']: p for p in products},
+        "profile": profile,
+        "favorite_ids": favorite_ids,
+        "reorder_ids": reorder_ids,
+    }
+
+def get_category_preferences(phone: str, profile: Optional[dict] = None) -> dict:
+    """Category weights from the customer's profile (order history and favorites).
+    Returns {category_name: weight} sorted by weight descending.
+    """
+    profile = profile or get_customer_profile(phone)
+    return dict(sorted(profile["category_weights"].items(), key=lambda x: x[1], reverse=True))
 
 _trending_cache = {
-    "products": None,
+    "counts": None,
     "timestamp": 0.0
 }
 TRENDING_CACHE_TTL = 3600  # 1 hour cache TTL
 
+def _is_available(p: dict) -> bool:
+    """Whether a product may be recommended right now."""
+    return bool(p.get('is_visible') and p.get('in_stock'))
+
 def get_trending_products(limit: int = 12) -> list:
-    """Return most-ordered products for trending/guest recommendations with high-performance caching."""
-    current_time = time.time()
-    if _trending_cache["products"] is not None and (current_time - _trending_cache["timestamp"] < TRENDING_CACHE_TTL):
-        return _trending_cache["products"][:limit]
+    """Return most-ordered available products for trending/guest recommendations.
 
-    all_products = {p['id']: p for p in get_all_products()}
-    conn = get_connection()
-    try:
-        cursor = conn.cursor()
-        # Get top product_ids by order frequency across all orders
-        cursor.execute("""
-            SELECT items_json FROM orders 
-            WHERE status != 'Cancelled' 
-            ORDER BY id DESC LIMIT 200
-        """)
-        rows = cursor.fetchall()
+    Order counts are cached for an hour; visibility and stock are checked live
+    while the top `limit` are selected.
+    """
+    all_products = get_all_products()
+    by_id = _products_by_id or {p['id']: p for p in all_products}
+    current_time = time.time()
+    if _trending_cache["counts"] is None or (current_time - _trending_cache["timestamp"] >= TRENDING_CACHE_TTL):
+        conn = get_connection()
+        try:
+            cursor = conn.cursor()
+            # Get top product_ids by order frequency across all orders
+            cursor.execute("""
+                SELECT items_json FROM orders 
+                WHERE status != 'Cancelled' 
+                ORDER BY id DESC LIMIT 200
+            """)
+            rows = cursor.fetchall()
+        finally:
+            release_connection(conn)
         pid_counts = {}
         for row in rows:
             try:
@@ -990,47 +1302,71 @@ def get_trending_products(limit: int = 12) -> list:
                         pid_counts[pid] = pid_counts.get(pid, 0) + item.get('quantity', 1)
             except Exception:
                 pass
-
-        # Sort by frequency
-        sorted_pids = sorted(pid_counts.keys(), key=lambda x: pid_counts[x], reverse=True)
-        result = [all_products[pid] for pid in sorted_pids if pid in all_products]
-
-        # If no order history, pick a diverse curated set from different categories
-        if not result:
-            seen_cats = set()
-            for p in get_all_products():
-                cat = p.get('category', '')
-                if cat not in seen_cats:
-                    result.append(p)
-                    seen_cats.add(cat)
-                if len(result) >= limit * 2:
-                    break
-
-        _trending_cache["products"] = result
+        _trending_cache["counts"] = pid_counts
         _trending_cache["timestamp"] = current_time
-        return result[:limit]
-    finally:
-        release_connection(conn)
 
-def get_personalized_recommendations(phone: str, limit: int = 12) -> list:
-    """Return personalized recommendations for a logged-in user."""
-    prefs = get_category_preferences(phone)
-    all_products = get_all_products()
-    favorite_ids = set(get_favorites(phone))
+    pid_counts = _trending_cache["counts"]
+    top = top_k(pid_counts, limit, key=pid_counts.__getitem__, predicate=lambda pid: pid in by_id and _is_available(by_id[pid]))
+    result = [by_id[pid] for pid in top]
+
+    # If no order history, pick a diverse curated set from different categories
+    if not result:
+        columns = get_catalog_columns()
+        if columns is not None:
+            return columns.first_per_category(columns.available())[:limit]
+        seen_cats = set()
+        for p in all_products:
+            cat = p.get('category', '')
+            if cat not in seen_cats and _is_available(p):
+                result.append(p)
+                seen_cats.add(cat)
+            if len(result) >= limit:
+                break
+    return result
 
-    if not prefs:
-        # No history: fall back to trending
-        return get_trending_products(limit)
+def get_personalized_recommendations(phone: str, limit: int = 12, context: Optional[dict] = None) -> list:
+    """Return personalized recommendations for a logged-in user.
+
+    Customers the offline model was trained on get its ranked list (a pure
+    lookup); otherwise, or to fill it up, picks come from their preferred categories.
+    """
+    if context is None:
+        all_products = get_all_products()
+        by_id = _products_by_id or {p['id']: p for p in all_products}
+    else:
+        all_products, by_id = context["products"], context["products_by_id"]
+    model = rec_artifacts.current()
 
     result = []
     seen_ids = set()
+    if model is not None and phone.isdigit():
+        ranked = model.lookup("user_recs", int(phone))
+        result = [by_id[pid] for pid in first_k(ranked, limit, lambda pid: pid in by_id and _is_available(by_id[pid]))]
+        if len(result) >= limit:
+            return result
+        seen_ids.update(p['id'] for p in result)
+
+    profile = context["profile"] if context is not None else get_customer_profile(phone)
+    prefs = get_category_preferences(phone, profile)
+
+    if not prefs and not result:
+        # No history: fall back to trending
+        return get_trending_products(limit)
+
     top_cats = list(prefs.keys())[:5]  # Top 5 preferred categories
 
     # Pick products from preferred categories (exclude already favorited ones to show new things)
+    columns = get_catalog_columns()
     for cat in top_cats:
-        cat_products = [p for p in all_products if p.get('category') == cat and p['id'] not in seen_ids]
-        # Mix: some favorited, mostly new picks
-        picks = cat_products[:3]
+        popular = model.category_popular.get(cat) if model is not None else None
+        if popular:
+            # Most purchased in the category, per the offline model
+            picks = [by_id[pid] for pid in first_k(popular, 3, lambda pid: pid in by_id and pid not in seen_ids and _is_available(by_id[pid]))]
+        elif columns is not None:
+            picks = columns.select(columns.mask(category=cat, visible_only=False, exclude_ids=seen_ids), limit=3)
+        else:
+            # Mix: some favorited, mostly new picks
+            picks = first_k(all_products, 3, lambda p: p.get('category') == cat and p['id'] not in seen_ids)
         for p in picks:
             result.append(p)
             seen_ids.add(p['id'])
@@ -1055,14 +1391,8 @@ _orders_fbt_cache = {
 }
 ORDERS_FBT_CACHE_TTL = 3600
 
-def get_frequently_bought_together(product_ids: list, limit: int = 4) -> list:
-    """Analyze co-occurrence in orders of given product_ids to find highly associated cross-sell items."""
-    if not product_ids:
-        return []
-    
-    product_ids_set = set(int(pid) for pid in product_ids)
-    all_products = {p['id']: p for p in get_all_products()}
-    
+def _order_co_occurrences(product_ids_set: set, all_products: dict) -> dict:
+    """Count how often other products appear in recent orders containing any of product_ids_set."""
     current_time = time.time()
     if _orders_fbt_cache["orders"] is not None and (current_time - _orders_fbt_cache["timestamp"] < ORDERS_FBT_CACHE_TTL):
         orders = _orders_fbt_cache["orders"]
@@ -1094,11 +1424,29 @@ def get_frequently_bought_together(product_ids: list, limit: int = 4) -> list:
                         co_occurrences[other_pid] = co_occurrences.get(other_pid, 0) + 1
         except Exception:
             pass
+    return co_occurrences
 
-    sorted_pids = sorted(co_occurrences.keys(), key=lambda x: co_occurrences[x], reverse=True)
+def get_frequently_bought_together(product_ids: list, limit: int = 4) -> list:
+    """Cross-sell items for a cart: the offline model's item neighbors when trained,
+    otherwise co-occurrence counted over recent orders."""
+    if not product_ids:
+        return []
     
-    # Return matched products
-    result = [all_products[pid] for pid in sorted_pids if all_products[pid].get('is_visible') and all_products[pid].get('in_stock')]
+    product_ids_set = set(int(pid) for pid in product_ids)
+    all_products = get_products_by_id()
+    model = rec_artifacts.current()
+    if model is not None:
+        # Rank-weighted vote of each cart item's precomputed neighbors
+        co_occurrences = {}
+        for pid in product_ids_set:
+            for rank, other_pid in enumerate(model.lookup("item_neighbors", pid)):
+                if other_pid not in product_ids_set and other_pid in all_products:
+                    co_occurrences[other_pid] = co_occurrences.get(other_pid, 0) + 1.0 / (rank + 1)
+    else:
+        co_occurrences = _order_co_occurrences(product_ids_set, all_products)
+
+    top = top_k(co_occurrences, limit, key=co_occurrences.__getitem__, predicate=lambda pid: _is_available(all_products[pid]))
+    result = [all_products[pid] for pid in top]
     
     # If not enough, pad with trending
     if len(result) < limit:
@@ -1111,125 +1459,174 @@ def get_frequently_bought_together(product_ids: list, limit: int = 4) -> list:
                 
     return result[:limit]
 
-def get_smart_reorder_reminders(phone: str, limit: int = 6) -> list:
-    """Analyze client order history to calculate product repurchase intervals and identify replenishment items."""
-    all_products = {p['id']: p for p in get_all_products()}
-    conn = get_connection()
+def get_smart_reorder_reminders(phone: str, limit: int = 6, context: Optional[dict] = None) -> list:
+    """Visible, in-stock products from the customer's precomputed due-soon list, most urgent first."""
     try:
-        cursor = conn.cursor()
-        # Fetch up to 50 historical orders for this client
-        cursor.execute(
-            "SELECT items_json, timestamp FROM orders WHERE phone = %s AND status != 'Cancelled' ORDER BY id DESC LIMIT 50",
-            (phone,)
-        )
-        orders = cursor.fetchall()
-        if not orders:
-            return []
-
-        # Map product_id to purchase timestamps
-        product_purchase_dates = {}
-        for order in orders:
+        if context is None:
+            conn = get_connection()
             try:
-                items = json.loads(order['items_json'])
-                ts_str = order['timestamp']
-                try:
-                    dt = datetime.fromisoformat(ts_str.replace("Z", "+00:00"))
-                except ValueError:
-                    dt = datetime.strptime(ts_str[:19], "%Y-%m-%d %H:%M:%S")
-                
-                for item in items:
-                    pid = item.get('product_id')
-                    if pid and pid in all_products:
-                        if pid not in product_purchase_dates:
-                            product_purchase_dates[pid] = []
-                        product_purchase_dates[pid].append(dt)
-            except Exception:
-                pass
-
-        now = datetime.now()
-        reorder_candidates = []
-
-        for pid, dates in product_purchase_dates.items():
-            if len(dates) < 1:
-                continue
-            
-            # Sort chronologically
-            dates.sort()
-            last_purchase = dates[-1]
-            days_since_last_purchase = (now - last_purchase).days
-
-            # Calculate average interval if bought multiple times
-            if len(dates) >= 2:
-                intervals = []
-                for i in range(len(dates) - 1):
-                    intervals.append((dates[i+1] - dates[i]).days)
-                avg_interval = max(3, sum(intervals) / len(intervals))
-            else:
-                # Default grocery replenishment cycle (14 days)
-                avg_interval = 14.0
-
-            # If within replenishment window: (interval - 3 days) to (interval + 14 days)
-            if avg_interval - 3 <= days_since_last_purchase <= avg_interval + 14:
-                # Calculate urgency score
-                urgency = days_since_last_purchase / avg_interval
-                reorder_candidates.append((pid, urgency))
-
-        # Sort by highest urgency score
-        reorder_candidates.sort(key=lambda x: x[1], reverse=True)
-        
-        result = [all_products[pid] for pid, _ in reorder_candidates if all_products[pid].get('is_visible') and all_products[pid].get('in_stock')]
-        return result[:limit]
+                due_ids = _reorder_due_ids(conn.cursor(), phone)
+                conn.commit()
+            finally:
+                release_connection(conn)
+            all_products = get_products_by_id()
+        else:
+            due_ids, all_products = context["reorder_ids"], context["products_by_id"]
+        # Already ranked by urgency: take the first available ones
+        return [all_products[pid] for pid in first_k(due_ids, limit, lambda pid: pid in all_products and _is_available(all_products[pid]))]
     except Exception as e:
         print(f"Error computing reorders: {e}")
         return []
+
+# ── Replenishment schedule ────────────────────────────────
+# purchase_stats keeps, per (customer, product), the purchase count, the last
+# purchase and an EWMA of the days between purchases; every order updates it.
+# A nightly job turns it into reorder_due, the due-soon list the reorder
+# endpoint reads (and that batch reminders can be sent from).
+REORDER_EWMA_ALPHA = 0.3
+REORDER_MIN_INTERVAL_DAYS = 3
+# Interval assumed for a product bought once (typical grocery cycle)
+REORDER_DEFAULT_INTERVAL_DAYS = 14
+# Due window: from LEAD days before the expected repurchase to GRACE days after
+REORDER_LEAD_DAYS = 3
+REORDER_GRACE_DAYS = 14
+
+_RECORD_PURCHASES_SQL = """
+    INSERT INTO purchase_stats (phone, product_id, purchase_count, last_purchase_at)
+    SELECT %(phone)s, pid, 1, %(at)s FROM unnest(%(pids)s::int[]) AS pid
+    ON CONFLICT (phone, product_id) DO UPDATE SET
+        ewma_interval_days = COALESCE(
+            %(alpha)s * GREATEST(EXTRACT(EPOCH FROM EXCLUDED.last_purchase_at - purchase_stats.last_purchase_at) / 86400, 0)
+                + (1 - %(alpha)s) * purchase_stats.ewma_interval_days,
+            GREATEST(EXTRACT(EPOCH FROM EXCLUDED.last_purchase_at - purchase_stats.last_purchase_at) / 86400, 0)
+        ),
+        purchase_count = purchase_stats.purchase_count + 1,
+        last_purchase_at = GREATEST(purchase_stats.last_purchase_at, EXCLUDED.last_purchase_at)
+"""
+
+_REORDER_DUE_SQL = """
+    INSERT INTO reorder_due (phone, product_id, urgency, due_at)
+    SELECT phone, product_id, days_since / interval_days, last_purchase_at + make_interval(secs => interval_days * 86400)
+    FROM (
+        SELECT phone, product_id, last_purchase_at,
+               FLOOR(EXTRACT(EPOCH FROM %(now)s - last_purchase_at) / 86400) AS days_since,
+               CASE WHEN purchase_count >= 2 THEN GREATEST(ewma_interval_days, %(min_interval)s)
+                    ELSE %(default_interval)s END AS interval_days
+        FROM purchase_stats
+        WHERE %(phone)s::text IS NULL OR phone = %(phone)s
+    ) s
+    WHERE days_since BETWEEN interval_days - %(lead)s AND interval_days + %(grace)s
+    ON CONFLICT (phone, product_id) DO UPDATE SET urgency = EXCLUDED.urgency, due_at = EXCLUDED.due_at
+"""
+
+def _parse_order_time(ts: str) -> datetime:
+    try:
+        return datetime.fromisoformat(ts.replace("Z", "+00:00")).replace(tzinfo=None)
+    except ValueError:
+        return datetime.strptime(ts[:19], "%Y-%m-%d %H:%M:%S")
+
+def record_purchases(cursor, phone: str, product_ids, purchased_at: str):
+    """Update purchase stats for a new order, in the caller's transaction. Bought items stop being due."""
+    pids = sorted(set(product_ids))
+    _lock_customer(cursor, phone)
+    cursor.execute(_RECORD_PURCHASES_SQL, {"phone": phone, "pids": pids, "at": purchased_at, "alpha": REORDER_EWMA_ALPHA})
+    cursor.execute("DELETE FROM reorder_due WHERE phone = %s AND product_id = ANY(%s)", (phone, pids))
+
+def _rebuild_purchase_stats(cursor, phone: str, orders: Optional[list] = None):
+    """Recompute a customer's purchase stats and due list from their non-cancelled order history."""
+    # Delete-and-insert: without the lock, two rebuilds (or a rebuild and an
+    # order's upsert) for the same customer collide on the primary key
+    _lock_customer(cursor, phone)
+    if orders is None:
+        cursor.execute("SELECT items_json, timestamp FROM orders WHERE phone = %s AND status != 'Cancelled'", (phone,))
+        orders = cursor.fetchall()
+    purchases = {}
+    for order in orders:
+        try:
+            at = _parse_order_time(order['timestamp'])
+            for pid in _order_quantities(json.loads(order['items_json'])):
+                purchases.setdefault(pid, []).append(at)
+        except Exception:
+            continue
+
+    rows = []
+    for pid, dates in purchases.items():
+        dates.sort()
+        ewma = None
+        for prev, cur in zip(dates, dates[1:]):
+            gap = (cur - prev).total_seconds() / 86400
+            ewma = gap if ewma is None else REORDER_EWMA_ALPHA * gap + (1 - REORDER_EWMA_ALPHA) * ewma
+        rows.append((phone, pid, len(dates), dates[-1], ewma))
+
+    cursor.execute("DELETE FROM purchase_stats WHERE phone = %s", (phone,))
+    if rows:
+        extras.execute_values(
+            cursor,
+            "INSERT INTO purchase_stats (phone, product_id, purchase_count, last_purchase_at, ewma_interval_days) VALUES %s",
+            rows
+        )
+    _refresh_reorder_due(cursor, phone)
+
+def _refresh_reorder_due(cursor, phone: Optional[str] = None) -> int:
+    """Recompute due-soon rows for one customer, or for everyone when phone is None."""
+    if phone is None:
+        cursor.execute("DELETE FROM reorder_due")
+    else:
+        cursor.execute("DELETE FROM reorder_due WHERE phone = %s", (phone,))
+    cursor.execute(_REORDER_DUE_SQL, {
+        "phone": phone, "now": datetime.now(),
+        "min_interval": REORDER_MIN_INTERVAL_DAYS, "default_interval": REORDER_DEFAULT_INTERVAL_DAYS,
+        "lead": REORDER_LEAD_DAYS, "grace": REORDER_GRACE_DAYS,
+    })
+    return cursor.rowcount
+
+def _reorder_due_ids(cursor, phone: str) -> list:
+    cursor.execute("SELECT product_id FROM reorder_due WHERE phone = %s ORDER BY urgency DESC, product_id", (phone,))
+    return [row['product_id'] for row in cursor.fetchall()]
+
+def refresh_reorder_due() -> dict:
+    """Nightly: build profiles (and purchase stats) for customers who have orders but none yet,
+    one transaction each, then recompute every due-soon list in one transaction."""
+    conn = get_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT DISTINCT o.phone FROM orders o
+            WHERE NOT EXISTS (SELECT 1 FROM customer_profiles p WHERE p.phone = o.phone)
+        """)
+        missing = [row['phone'] for row in cursor.fetchall()]
+        conn.commit()
+        for phone in missing:
+            # One transaction per customer: each holds that customer's lock only briefly
+            # (and thousands of advisory locks in one transaction would exhaust the lock table)
+            _load_customer_profile(cursor, phone)
+            conn.commit()
+        due = _refresh_reorder_due(cursor)
+        cursor.execute("SELECT COUNT(DISTINCT phone) AS customers FROM reorder_due")
+        customers = cursor.fetchone()['customers']
+        conn.commit()
+        return {"profiles_built": len(missing), "due_items": due, "customers": customers}
+    except Exception:
+        conn.rollback()
+        raise
     finally:
         release_connection(conn)
 
-def get_similar_products(product_id: int, limit: int = 6) -> list:
-    """Find products in the same category/sub-category with high keyword/n-gram title similarity."""
-    all_products = get_all_products()
-    ref_product = None
-    for p in all_products:
-        if p['id'] == product_id:
-            ref_product = p
-            break
-            
-    if not ref_product:
-        return []
+_similarity_index = similarity.SimilarityIndex()
 
-    ref_name = (ref_product.get('base_name') or ref_product.get('name') or "").lower()
-    ref_words = set(re.findall(r'\w+', ref_name))
-    
-    # Filter products in the same category, excluding the product itself
-    candidates = [
-        p for p in all_products 
-        if p.get('category') == ref_product.get('category') 
-        and p['id'] != product_id 
-        and p.get('is_visible') 
-        and p.get('in_stock')
-    ]
-
-    scored_candidates = []
-    for p in candidates:
-        name = (p.get('base_name') or p.get('name') or "").lower()
-        words = set(re.findall(r'\w+', name))
-        
-        # Calculate Jaccard similarity coefficient: Intersection / Union
-        intersection = ref_words.intersection(words)
-        union = ref_words.union(words)
-        similarity = len(intersection) / len(union) if union else 0.0
-        
-        # Boost similarity score if subcategory matches
-        if p.get('sub_category') and p.get('sub_category') == ref_product.get('sub_category'):
-            similarity += 0.25
-            
-        scored_candidates.append((p, similarity))
+def refresh_similarity_index() -> str:
+    """Sync the similar-products index with the cached catalog (incremental when few products changed)."""
+    products = get_all_products()
+    return _similarity_index.sync(products, (id(products), _products_generation))
 
-    # Sort by similarity descending
-    scored_candidates.sort(key=lambda x: x[1], reverse=True)
-    
-    # Return similar products
-    return [p for p, _ in scored_candidates][:limit]
+def get_similar_products(product_id: int, limit: int = 6) -> list:
+    """Visible, in-stock products most similar by title in the same category (precomputed neighbors)."""
+    refresh_similarity_index()
+    if product_id not in _products_by_id:
+        return []
+    by_id = _products_by_id
+    # Visibility and stock change often, so they are checked at read time, not baked into the index
+    return [by_id[pid] for pid in first_k(_similarity_index.neighbors(product_id), limit, lambda pid: pid in by_id and _is_available(by_id[pid]))]
 
 # ── Official Categories Helper Functions ───────────────────
 
@@ -1288,6 +1685,15 @@ def rename_category(old_name: str, new_name: str) -> bool:
             "UPDATE products SET category = %s WHERE category = %s",
             (new_name, old_name)
         )
+        # 3. Carry preference weights over to the new name
+        cursor.execute(
+            """
+            UPDATE customer_profiles
+            SET category_weights = jsonb_add_counts(category_weights - %s, jsonb_build_object(%s, category_weights->%s))
+            WHERE category_weights ? %s
+            """,
+            (old_name, new_name, old_name, old_name)
+        )
         conn.commit()
         _invalidate_products_cache()
         return True
@@ -0,0 +1,63 @@
+# ============================================================
+# fast_json.py — orjson Responses for Already-Validated Data
+# ============================================================
+# Endpoints with a response_model normally have FastAPI validate every
+# returned row against the model before serializing it. Catalog rows were
+# validated on the way in (ProductCreate / ProductUpdate) and orders are
+# built by the server itself, so read endpoints can opt out by returning
+# respond(data): the data is serialized with orjson and sent as-is. The
+# route keeps its response_model, so the OpenAPI schema is unchanged.
+# FAST_JSON=0 turns the bypass off (responses go back through validation).
+import datetime
+import json
+import os
+from collections.abc import Mapping
+from decimal import Decimal
+
+from fastapi import Response
+
+from product_record import ProductRecord
+
+try:
+    import orjson  # type: ignore
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+ENABLED = os.getenv("FAST_JSON", "1") != "0"
+
+_ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS if orjson is not None else 0
+
+
+def _default(obj):
+    """Types orjson (or json) does not encode natively."""
+    if isinstance(obj, ProductRecord):
+        return obj.as_dict()
+    if isinstance(obj, Mapping):
+        return dict(obj)
+    if isinstance(obj, (set, frozenset, tuple)):
+        return list(obj)
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if isinstance(obj, (datetime.datetime, datetime.date)):
+        return obj.isoformat()
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def dumps(content) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content, default=_default, option=_ORJSON_OPTIONS)
+    return json.dumps(content, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+def respond(content, **kwargs):
+    """Serialize content without response-model validation (unless FAST_JSON=0)."""
+    if not ENABLED:
+        return content
+    return FastJSONResponse(content, **kwargs)
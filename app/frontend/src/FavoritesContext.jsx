@@ -1,6 +1,6 @@
 import { createContext, useContext, useState, useEffect, useCallback } from 'react'
 import { useAuth } from './AuthContext'
-import { getFavorites, toggleFavorite as apiToggleFavorite } from './api'
+import { getHomeFeed, toggleFavorite as apiToggleFavorite } from './api'
 
 const FavoritesContext = createContext(null)
 
@@ -28,9 +28,9 @@ export function FavoritesProvider({ children }) {
   // When user logs in, fetch server favorites and merge
   useEffect(() => {
     if (user && !synced) {
-      getFavorites()
-        .then(products => {
-          const serverIds = new Set(products.map(p => p.id))
+      getHomeFeed()
+        .then(feed => {
+          const serverIds = new Set(feed.favorites.map(p => p.id))
           // REPLACE instead of merging to avoid seeing old user's favorites
           setFavorites(serverIds)
           setSynced(true)
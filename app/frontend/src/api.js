@@ -163,6 +163,34 @@ export const getFrequentlyBoughtTogether = (productIds) =>
 export const getReorderReminders = () =>
     request('GET', '/api/recommendations/reorder')
 
+// ── Home feed ──────────────────────────────────────────────
+// One /api/home request serves the home-screen widgets (recommendations,
+// reorder reminders, favorites). Widgets mounting together share the request.
+const HOME_FEED_TTL_MS = 5000
+let homeFeed = { token: null, at: 0, promise: null }
+
+export const getHomeFeed = () => {
+    const token = localStorage.getItem('kgsToken')
+    if (!token) return Promise.reject(new Error('Not logged in'))
+    if (homeFeed.promise && homeFeed.token === token && Date.now() - homeFeed.at < HOME_FEED_TTL_MS) {
+        return homeFeed.promise
+    }
+    const promise = request('GET', `/api/home?t=${Date.now()}`).then(feed => {
+        const byId = new Map(feed.products.map(p => [p.id, p]))
+        const pick = ids => ids.map(id => byId.get(id)).filter(Boolean)
+        return {
+            trending: pick(feed.trending),
+            recommended: pick(feed.recommended),
+            reorder: pick(feed.reorder),
+            favorites: pick(feed.favorites),
+        }
+    })
+    // A failed request is not reused
+    promise.catch(() => { if (homeFeed.promise === promise) homeFeed = { token: null, at: 0, promise: null } })
+    homeFeed = { token, at: Date.now(), promise }
+    return promise
+}
+
 export const getSimilarProducts = (productId) =>
     request('GET', `/api/recommendations/similar/${productId}`)
 
@@ -3,7 +3,7 @@ import { motion, AnimatePresence } from 'framer-motion'
 import { useAuth } from '../AuthContext'
 import { useFavorites } from '../FavoritesContext'
 import { useCart } from '../CartContext'
-import { getRecommendations, getTrending } from '../api'
+import { getHomeFeed, getTrending } from '../api'
 import ProductDetailsModal from './ProductDetailsModal'
 import { getMRP } from '../utils/pricing'
 
@@ -109,9 +109,9 @@ export default function RecommendationsSection() {
     setLoading(true)
     if (user) {
       setLabel('✨ Just For You')
-      getRecommendations()
-        .then(data => {
-          const allRecs = Array.isArray(data) ? data : []
+      getHomeFeed()
+        .then(feed => {
+          const allRecs = feed.recommended
           setProducts(allRecs)
           setLoading(false)
         })
@@ -6,7 +6,7 @@ import HeroBanner from '../components/HeroBanner'
 import RecommendationsSection from '../components/RecommendationsSection'
 import { useCart } from '../CartContext'
 import { useAuth } from '../AuthContext'
-import { getProducts, getReorderReminders, getCategories } from '../api'
+import { getProducts, getHomeFeed, getCategories } from '../api'
 import ProductDetailsModal from '../components/ProductDetailsModal'
 import { getMRP } from '../utils/pricing'
 
@@ -476,9 +476,9 @@ export default function CatalogPage({ searchQuery = '', onSearchFocus, navCatego
       return
     }
     setReorderLoading(true)
-    getReorderReminders()
-      .then(data => {
-        setReorderItems(Array.isArray(data) ? data : [])
+    getHomeFeed()
+      .then(feed => {
+        setReorderItems(feed.reorder)
         setReorderLoading(false)
       })
       .catch(err => {
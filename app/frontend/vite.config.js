@@ -1,8 +1,48 @@
 import { defineConfig } from 'vite'
 import react from '@vitejs/plugin-react'
+import { readdirSync, readFileSync, statSync, writeFileSync } from 'node:fs'
+import { extname, join, resolve } from 'node:path'
+import { brotliCompressSync, gzipSync, constants } from 'node:zlib'
+
+const COMPRESSIBLE = new Set(['.html', '.js', '.mjs', '.css', '.json', '.svg', '.txt', '.xml', '.webmanifest', '.map'])
+
+// Writes .br (quality 11) and .gz (level 9) next to every text asset in dist/,
+// so the API server sends them as-is instead of compressing per request.
+function precompress() {
+  let outDir = 'dist'
+  const walk = (dir) => {
+    for (const name of readdirSync(dir)) {
+      const path = join(dir, name)
+      if (statSync(path).isDirectory()) {
+        walk(path)
+        continue
+      }
+      if (!COMPRESSIBLE.has(extname(name))) continue
+      const data = readFileSync(path)
+      if (data.length < 1000) continue
+      writeFileSync(`${path}.br`, brotliCompressSync(data, {
+        params: {
+          [constants.BROTLI_PARAM_QUALITY]: 11,
+          [constants.BROTLI_PARAM_SIZE_HINT]: data.length,
+        },
+      }))
+      writeFileSync(`${path}.gz`, gzipSync(data, { level: 9 }))
+    }
+  }
+  return {
+    name: 'precompress',
+    apply: 'build',
+    configResolved(config) {
+      outDir = resolve(config.root, config.build.outDir)
+    },
+    closeBundle() {
+      walk(outDir)
+    },
+  }
+}
 
 export default defineConfig({
-  plugins: [react()],
+  plugins: [react(), precompress()],
   server: {
     port: 5173,
     proxy: {
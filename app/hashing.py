@@ -0,0 +1,127 @@
+# ============================================================
+# hashing.py — bcrypt Offload to a Dedicated Process Pool
+# ============================================================
+import asyncio
+import hashlib
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", "2"))
+# Requests allowed to wait for a free worker before we shed load with 503
+HASH_QUEUE_LIMIT = int(os.getenv("HASH_QUEUE_LIMIT", "16"))
+
+
+class HashQueueFull(Exception):
+    """Raised when too many hash operations are already queued."""
+
+
+# ── Worker-side functions (run in the pool processes) ────
+# bcrypt is imported here so only the pool processes ever load it
+
+def _hash_worker(pin: str):
+    import bcrypt
+    started = time.time()
+    hashed = bcrypt.hashpw(pin.encode(), bcrypt.gensalt()).decode()
+    return hashed, started
+
+
+def _verify_worker(pin: str, hashed_pin: str):
+    import bcrypt
+    started = time.time()
+    try:
+        ok = bcrypt.checkpw(pin.encode(), hashed_pin.encode())
+    except ValueError:
+        # Fallback for old SHA-256 hashes during migration
+        ok = hashlib.sha256(pin.encode()).hexdigest() == hashed_pin
+    return ok, started
+
+
+# ── Metrics ──────────────────────────────────────────────
+
+class HashMetrics:
+    """Counters for hash latency and queue wait, per operation."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.ops = {
+            op: {"count": 0, "wait_seconds_sum": 0.0, "run_seconds_sum": 0.0, "run_seconds_max": 0.0}
+            for op in ("hash", "verify")
+        }
+        self.rejected = 0
+        self.in_flight = 0
+
+    def observe(self, op: str, wait: float, run: float):
+        with self._lock:
+            stats = self.ops[op]
+            stats["count"] += 1
+            stats["wait_seconds_sum"] += wait
+            stats["run_seconds_sum"] += run
+            stats["run_seconds_max"] = max(stats["run_seconds_max"], run)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "workers": HASH_WORKERS,
+                "queue_limit": HASH_QUEUE_LIMIT,
+                "in_flight": self.in_flight,
+                "rejected": self.rejected,
+                "ops": {op: dict(stats) for op, stats in self.ops.items()},
+            }
+
+
+metrics = HashMetrics()
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                # spawn: never fork a process that already runs threads (threadpool, DB pool)
+                _executor = ProcessPoolExecutor(max_workers=HASH_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _executor
+
+
+def start():
+    """Spin up the pool workers ahead of the first login."""
+    executor = _get_executor()
+    for _ in range(HASH_WORKERS):
+        executor.submit(time.time)
+
+
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+async def _run(op: str, fn, *args):
+    with metrics._lock:
+        if metrics.in_flight >= HASH_WORKERS + HASH_QUEUE_LIMIT:
+            metrics.rejected += 1
+            raise HashQueueFull()
+        metrics.in_flight += 1
+    submitted = time.time()
+    try:
+        result, started = await asyncio.wrap_future(_get_executor().submit(fn, *args))
+    finally:
+        with metrics._lock:
+            metrics.in_flight -= 1
+    finished = time.time()
+    metrics.observe(op, wait=max(0.0, started - submitted), run=finished - started)
+    return result
+
+
+async def hash_pin(pin: str) -> str:
+    return await _run("hash", _hash_worker, pin)
+
+
+async def verify_pin(pin: str, hashed_pin: str) -> bool:
+    return await _run("verify", _verify_worker, pin, hashed_pin)
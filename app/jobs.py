@@ -0,0 +1,247 @@
+# ============================================================
+# jobs.py — Write-Behind Queue for Non-Critical Side Effects
+# ============================================================
+import asyncio
+import json
+import logging
+import os
+from datetime import datetime, timedelta
+
+from database import get_connection, release_connection, enqueue_jobs
+
+JOB_BATCH_SIZE = int(os.getenv("JOB_BATCH_SIZE", "20"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "8"))
+# A claimed job is invisible to other workers for this long; if the worker
+# dies mid-job the lease simply expires and the job runs again.
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "60"))
+# Fallback poll for jobs enqueued by other processes or due for retry
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "5"))
+
+# Advisory lock namespace for scheduling daily jobs (second key: hash of the kind)
+DAILY_LOCK_ID = 734202
+
+_handlers = {}
+_daily = {}   # kind -> local hour it runs at
+_loop = None
+_wakeup = None
+
+# Only the oldest live job of each partition is runnable, so jobs for one
+# customer run strictly in order while different customers run in parallel.
+_CLAIM_SQL = """
+    UPDATE job_outbox SET attempts = attempts + 1, locked_until = now() + make_interval(secs => %s)
+    WHERE id IN (
+        SELECT j.id FROM job_outbox j
+        WHERE j.failed_at IS NULL
+          AND j.run_after <= now()
+          AND (j.locked_until IS NULL OR j.locked_until < now())
+          AND NOT EXISTS (
+              SELECT 1 FROM job_outbox e
+              WHERE e.partition_key = j.partition_key AND e.failed_at IS NULL AND e.id < j.id
+          )
+        ORDER BY j.id
+        LIMIT %s
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING id, kind, partition_key, payload, attempts
+"""
+
+
+def handler(kind: str):
+    """Register a sync or async function as the handler for a job kind. It receives the decoded payload."""
+    def register(fn):
+        _handlers[kind] = fn
+        return fn
+    return register
+
+
+def daily(kind: str, hour: int):
+    """Register a handler that runs once a day at hour:00 server time, on one worker.
+
+    The run is an ordinary outbox job (retries, failure parking); each worker
+    makes sure exactly one future run is pending at startup and after a run.
+    """
+    def register(fn):
+        _handlers[kind] = fn
+        _daily[kind] = hour
+        return fn
+    return register
+
+
+def _next_daily_run(hour: int) -> datetime:
+    now = datetime.now()
+    run_at = now.replace(hour=hour, minute=0, second=0, microsecond=0)
+    return run_at if run_at > now else run_at + timedelta(days=1)
+
+
+def _schedule_daily(kinds=None):
+    conn = get_connection()
+    try:
+        cursor = conn.cursor()
+        for kind in kinds or _daily:
+            # Serialize workers scheduling the same kind so only one run is ever pending
+            cursor.execute("SELECT pg_advisory_xact_lock(%s, hashtext(%s))", (DAILY_LOCK_ID, kind))
+            cursor.execute(
+                """
+                INSERT INTO job_outbox (kind, partition_key, payload, run_after)
+                SELECT %s, %s, '{}', %s
+                WHERE NOT EXISTS (SELECT 1 FROM job_outbox WHERE kind = %s AND failed_at IS NULL)
+                """,
+                (kind, kind, _next_daily_run(_daily[kind]), kind)
+            )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        release_connection(conn)
+
+
+def notify():
+    """Wake the worker now instead of at the next poll. Safe to call from any thread."""
+    if _loop is not None and _wakeup is not None:
+        _loop.call_soon_threadsafe(_wakeup.set)
+
+
+def enqueue(kind: str, partition_key: str, payload: dict):
+    """Enqueue one job in its own transaction and wake the worker.
+
+    Prefer database.enqueue_jobs(cursor, ...) inside the transaction that
+    produced the side effect, so the job commits (or not) with it.
+    """
+    conn = get_connection()
+    try:
+        enqueue_jobs(conn.cursor(), [(kind, partition_key, payload)])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        release_connection(conn)
+    notify()
+
+
+def _claim_batch() -> list:
+    conn = get_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(_CLAIM_SQL, (JOB_LEASE_SECONDS, JOB_BATCH_SIZE))
+        rows = cursor.fetchall()
+        conn.commit()
+        return rows
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        release_connection(conn)
+
+
+def _complete(job_id: int):
+    conn = get_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM job_outbox WHERE id = %s", (job_id,))
+        conn.commit()
+    finally:
+        release_connection(conn)
+
+
+def _fail(job: dict, error: str):
+    """Schedule a retry with exponential backoff, or park the job once it runs out of attempts."""
+    dead = job["attempts"] >= JOB_MAX_ATTEMPTS
+    conn = get_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            UPDATE job_outbox SET locked_until = NULL, last_error = %s,
+                run_after = now() + make_interval(secs => %s),
+                failed_at = CASE WHEN %s THEN now() ELSE NULL END
+            WHERE id = %s
+            """,
+            (error[:1000], min(2 ** job["attempts"], 300), dead, job["id"])
+        )
+        conn.commit()
+    finally:
+        release_connection(conn)
+    if dead:
+        logging.error("JOB_FAILED: id=%s kind=%s partition=%s error=%s", job["id"], job["kind"], job["partition_key"], error)
+
+
+async def _run_job(job: dict):
+    try:
+        fn = _handlers.get(job["kind"])
+        if fn is None:
+            raise LookupError(f"No handler registered for job kind '{job['kind']}'")
+        payload = json.loads(job["payload"])
+        if asyncio.iscoroutinefunction(fn):
+            await fn(payload)
+        else:
+            await asyncio.to_thread(fn, payload)
+    except Exception as e:
+        logging.warning("Job %s (%s) attempt %s failed: %s", job["id"], job["kind"], job["attempts"], e)
+        outcome = (_fail, job, repr(e))
+    else:
+        outcome = (_complete, job["id"])
+    try:
+        await asyncio.to_thread(*outcome)
+    except Exception as e:
+        # Left claimed: the job is picked up again once its lease expires
+        logging.error("Recording the outcome of job %s (%s) failed: %s", job["id"], job["kind"], e)
+    if job["kind"] in _daily:
+        try:
+            await asyncio.to_thread(_schedule_daily, [job["kind"]])
+        except Exception as e:
+            logging.error("Scheduling next %s run failed: %s", job["kind"], e)
+
+
+async def run_worker():
+    """Drain the outbox until cancelled. Started from the app lifespan."""
+    global _loop, _wakeup
+    _loop = asyncio.get_running_loop()
+    _wakeup = asyncio.Event()
+    if _daily:
+        try:
+            await asyncio.to_thread(_schedule_daily)
+        except Exception as e:
+            logging.error("Scheduling daily jobs failed: %s", e)
+    while True:
+        _wakeup.clear()
+        try:
+            batch = await asyncio.to_thread(_claim_batch)
+        except Exception as e:
+            logging.error("Job outbox claim failed: %s", e)
+            batch = []
+
+        if batch:
+            # Each claimed job heads a different partition, so they can run concurrently.
+            # Finishing one may unblock the next job of its partition: claim again right away.
+            await asyncio.gather(*(_run_job(job) for job in batch))
+            continue
+
+        try:
+            await asyncio.wait_for(_wakeup.wait(), JOB_POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+
+
+def stats() -> dict:
+    """Outbox depth for the admin metrics endpoint."""
+    conn = get_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            SELECT kind,
+                   COUNT(*) FILTER (WHERE failed_at IS NULL) AS pending,
+                   COUNT(*) FILTER (WHERE failed_at IS NOT NULL) AS failed,
+                   MIN(created_at) FILTER (WHERE failed_at IS NULL) AS oldest_pending
+            FROM job_outbox GROUP BY kind
+            """
+        )
+        rows = cursor.fetchall()
+        conn.commit()
+        return {row["kind"]: {"pending": row["pending"], "failed": row["failed"],
+                              "oldest_pending": row["oldest_pending"].isoformat() if row["oldest_pending"] else None}
+                for row in rows}
+    finally:
+        release_connection(conn)
@@ -6,55 +6,46 @@
 
 # 
 
+import time
+
+_BOOT_STARTED = time.perf_counter()
+
 import os
 
 import re
 
 import json
 
-import time
-
 from typing import List, Optional
 
-from contextlib import asynccontextmanager
-
-from datetime import datetime, timedelta, timezone
-
-import hashlib
+from collections import OrderedDict
 
+import threading
 
+from contextlib import asynccontextmanager
 
-import bcrypt
+from datetime import datetime, timedelta, timezone
 
 import jwt
 
-import uvicorn
-
-import requests
-
-from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect, Request, Depends
+from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect, Request, Response, Depends, Header, Query
 
 from fastapi.responses import JSONResponse, FileResponse
 
 from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers
 
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 import logging
 
-from pydantic import BaseModel
+from pydantic import BaseModel, TypeAdapter
 
 from dotenv import load_dotenv
 
 
 
-import firebase_admin
-
-from firebase_admin import credentials, auth as firebase_auth
-
-
-
 import os
 
 from dotenv import load_dotenv
@@ -70,17 +61,18 @@ load_dotenv(env_path)
 
 
 from database import (
-    init_db, get_all_products, create_order,
-    get_all_orders, get_order_by_token, update_order_status, mark_delivered,
+    init_db, get_all_products,
+    get_all_orders, get_order_by_token, update_order_status, cancel_order_for_customer, mark_delivered,
     get_orders_by_phone, get_customer, create_or_update_customer, get_all_customers,
-    get_customer_by_email, update_customer_cancels,
+    get_customer_by_email,
     add_product, update_product, delete_product, bulk_reorder_products,
     get_favorites, add_favorite, remove_favorite,
     get_trending_products, get_personalized_recommendations,
     confirm_payment_and_generate_otp, reject_order_payment,
     get_frequently_bought_together, get_smart_reorder_reminders,
-    get_similar_products, get_official_categories, make_category_official,
-    rename_category
+    get_similar_products, refresh_similarity_index, get_customer_context, refresh_reorder_due, get_official_categories, make_category_official,
+    rename_category, get_catalog_version, prime_products_cache, products_cache_state, sync_stock_levels,
+    query_products, get_catalog_columns, get_products_by_id
 )
 
 from models import (
@@ -88,67 +80,29 @@ from models import (
     OrderCreate, OrderOut, OrderStatusUpdate, ProductOut, ProductCreate, ProductUpdate,
 
     OTPRequest, OTPVerifyRequest, CustomerOut, SignupRequest, LoginRequest, ForgotPinQuestionRequest, ForgotPinVerifyRequest, ResetPinRequest,
-    CategoryMakeOfficial, CategoryRename, ChangePinRequest, ProfileUpdateRequest, AdminResetPinRequest
+    CategoryMakeOfficial, CategoryRename, ChangePinRequest, ProfileUpdateRequest, AdminResetPinRequest, HomeFeed
 
 )
 
 from websocket import manager
 
+from rate_limit import create_backend
 
+import hashing
 
-# Initialize Firebase Admin
-
-try:
-
-    service_account_json = os.getenv("FIREBASE_SERVICE_ACCOUNT_JSON")
-
-    if service_account_json:
-
-        if service_account_json.strip().startswith("{"):
-
-            print("Initializing Firebase Admin from environment variable...")
-
-            cred_dict = json.loads(service_account_json)
-
-            cred = credentials.Certificate(cred_dict)
+import order_service
+import jobs
+import catalog_snapshot
+import fast_json
+import precompressed
+import rec_artifacts
+import metrics
+from metrics import log_event
+import profiling
 
-        else:
-
-            print(f"Initializing Firebase Admin from path: {service_account_json}")
-
-            cred = credentials.Certificate(service_account_json)
-
-    else:
-
-        # Try local path first, then app/ path
+from order_service import OrderRejected
 
-        cert_path = "firebase-adminsdk.json"
-
-        if not os.path.exists(cert_path):
-
-            cert_path = os.path.join("app", "firebase-adminsdk.json")
-
-            
-
-        if os.path.exists(cert_path):
-
-            print(f"Initializing Firebase Admin from file: {cert_path}")
-
-            cred = credentials.Certificate(cert_path)
-
-        else:
-
-            print("Firebase Admin config not found (checked firebase-adminsdk.json and app/firebase-adminsdk.json)")
-
-            raise FileNotFoundError("firebase-adminsdk.json not found")
-
-    
-
-    firebase_admin.initialize_app(cred)
-
-except Exception as e:
-
-    print(f"Firebase Admin initialization failed: {e}")
+from hashing import hash_pin, verify_pin, HashQueueFull
 
 
 
@@ -162,7 +116,8 @@ if not SECRET_KEY:
 
 
 
-rate_limit_store: dict = {}
+# Shared across workers when RATE_LIMIT_BACKEND=postgres, per-process otherwise
+rate_limit_backend = create_backend()
 
 RATE_LIMIT  = int(os.getenv("RATE_LIMIT", "60"))
 
@@ -185,40 +140,24 @@ import asyncio
 async def cleanup_rate_limits():
     while True:
         await asyncio.sleep(600)  # Cleanup every 10 minutes
-        current_time = time.time()
-        keys_to_delete = []
-        for key, timestamps in list(rate_limit_store.items()):
-            valid_timestamps = [t for t in timestamps if current_time - t < 3600]
-            if not valid_timestamps:
-                keys_to_delete.append(key)
-            else:
-                rate_limit_store[key] = valid_timestamps
-        for key in keys_to_delete:
-            rate_limit_store.pop(key, None)
+        # Each step guarded: an error must not end the loop (and every later cleanup with it)
+        for prune in (rate_limit_backend.prune, order_service.prune_idempotency_keys):
+            try:
+                await asyncio.to_thread(prune)
+            except Exception as e:
+                logging.error(f"Cleanup step {prune.__qualname__} failed: {e}")
 
 def check_rate_limit(request: Request, limit: int, window: int, scope: str):
+    # Can block on a database round trip (RATE_LIMIT_BACKEND=postgres): async handlers call it via asyncio.to_thread
 
     client_ip = request.client.host if request.client else "127.0.0.1"
 
     key = f"rate_limit:{scope}:{client_ip}"
 
-    if len(rate_limit_store) > 10000:
-        rate_limit_store.clear()
-
-    current_time = time.time()
-
-    if key not in rate_limit_store:
-
-        rate_limit_store[key] = []
-
-    rate_limit_store[key] = [t for t in rate_limit_store[key] if current_time - t < window]
-
-    if len(rate_limit_store[key]) >= limit:
+    if not rate_limit_backend.hit(key, limit, window):
 
         raise HTTPException(status_code=429, detail="Too many requests. Please slow down.")
 
-    rate_limit_store[key].append(current_time)
-
 
 
 def verify_admin_password(password: str) -> bool:
@@ -245,11 +184,42 @@ def create_access_token(data: dict, expires_delta: timedelta):
 
 
 
+# Verified-token cache: (signing key, token) -> (claims, exp). Keying on the
+# signing key means a rotated SECRET_KEY never matches tokens verified before.
+_token_cache: "OrderedDict[tuple, tuple]" = OrderedDict()
+_token_cache_lock = threading.Lock()
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "4096"))
+
+def decode_access_token(token: str) -> dict:
+    """Verify a JWT, skipping signature checks for tokens already verified and not yet expired."""
+    cache_key = (SECRET_KEY, token)
+    now = time.time()
+    with _token_cache_lock:
+        cached = _token_cache.get(cache_key)
+        if cached is not None:
+            claims, exp = cached
+            if now < exp:
+                _token_cache.move_to_end(cache_key)
+                return dict(claims)
+            del _token_cache[cache_key]
+            raise jwt.ExpiredSignatureError("Signature has expired")
+
+    claims = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    exp = claims.get("exp")
+    if isinstance(exp, (int, float)):
+        with _token_cache_lock:
+            _token_cache[cache_key] = (claims, exp)
+            if len(_token_cache) > TOKEN_CACHE_SIZE:
+                _token_cache.popitem(last=False)
+    return dict(claims)
+
+
+
 def get_current_admin(credentials: HTTPAuthorizationCredentials = Depends(security)):
 
     try:
 
-        payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = decode_access_token(credentials.credentials)
 
         if payload.get("role") != "admin":
 
@@ -267,30 +237,11 @@ def get_current_admin(credentials: HTTPAuthorizationCredentials = Depends(securi
 
 
 
-def hash_pin(pin: str) -> str:
-
-    return bcrypt.hashpw(pin.encode(), bcrypt.gensalt()).decode()
-
-
-def verify_pin(pin: str, hashed_pin: str) -> bool:
-
-    try:
-
-        return bcrypt.checkpw(pin.encode(), hashed_pin.encode())
-
-    except ValueError:
-
-        # Fallback for old SHA-256 hashes during migration
-
-        return hashlib.sha256(pin.encode()).hexdigest() == hashed_pin
-
-
-
 def get_current_customer(credentials: HTTPAuthorizationCredentials = Depends(security)):
 
     try:
 
-        payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = decode_access_token(credentials.credentials)
 
         if payload.get("role") != "customer":
 
@@ -312,7 +263,7 @@ def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(securit
 
     try:
 
-        payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = decode_access_token(credentials.credentials)
 
         if payload.get("role") not in ("customer", "admin"):
 
@@ -330,24 +281,79 @@ def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(securit
 
 
 
+# ── Write-behind job handlers ────────────────────────────
+
+# Local hour the nightly reorder-reminder refresh runs at
+REORDER_DUE_HOUR = int(os.getenv("REORDER_DUE_HOUR", "3"))
+
+@jobs.handler("broadcast")
+async def _broadcast_job(payload: dict):
+    await manager.broadcast_all(payload)
+
+
+@jobs.handler("save_address")
+def _save_address_job(payload: dict):
+    create_or_update_customer(phone=payload["phone"], address=payload["address"])
+
+
+@jobs.daily("refresh_reorder_due", hour=REORDER_DUE_HOUR)
+def _refresh_reorder_due_job(payload: dict):
+    log_event("reorder_due_refreshed", **refresh_reorder_due())
+
+
+
 @asynccontextmanager
 
 async def lifespan(app: FastAPI):
 
-    init_db()
+    phases = {"imports": (time.perf_counter() - _BOOT_STARTED) * 1000}
+
+    phases.update(init_db())
+
+    mark = time.perf_counter()
+
+    warm_start_catalog()
+
+    rec_artifacts.refresh()
+
+    phases["catalog"] = (time.perf_counter() - mark) * 1000
+
+    mark = time.perf_counter()
+
+    catalog_task = asyncio.create_task(catalog_refresh_loop())
+
+    body_task = asyncio.create_task(products_body_loop())
 
     cleanup_task = asyncio.create_task(cleanup_rate_limits())
 
+    hashing.start()
+
+    jobs_task = asyncio.create_task(jobs.run_worker())
+
+    phases["background"] = (time.perf_counter() - mark) * 1000
+
     print("=" * 55)
 
     print("KGS Grain Store - FastAPI Backend v3.0")
 
+    print("Startup: " + " | ".join(f"{name} {ms:.1f}ms" for name, ms in phases.items())
+
+          + f" | total {(time.perf_counter() - _BOOT_STARTED) * 1000:.1f}ms")
+
     print("=" * 55)
 
     yield
 
     cleanup_task.cancel()
 
+    jobs_task.cancel()
+
+    catalog_task.cancel()
+
+    body_task.cancel()
+
+    hashing.shutdown()
+
 
 
 app = FastAPI(
@@ -377,6 +383,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Dynamic fallback: pre-compressed responses (catalog body, dist assets) already carry
+# Content-Encoding and pass through untouched
+# Passes pre-encoded responses (precompressed.py) through as-is: needs starlette>=0.37.2
 app.add_middleware(GZipMiddleware, minimum_size=1000)
 
 # Security Headers Middleware
@@ -398,6 +407,9 @@ async def add_security_headers(request: Request, call_next):
     )
     return response
 
+# Outermost, so latency covers every other middleware too
+app.add_middleware(metrics.MetricsMiddleware)
+
 
 
 from fastapi.exceptions import RequestValidationError
@@ -444,6 +456,13 @@ async def http_exception_handler(request: Request, exc: HTTPException):
 
 
 
+@app.exception_handler(HashQueueFull)
+async def hash_queue_full_handler(request: Request, exc: HashQueueFull):
+    # Shed auth load instead of letting it queue behind the catalog endpoints
+    return JSONResponse(status_code=503, content={"detail": "Server busy. Please try again in a moment."}, headers={"Retry-After": "2"})
+
+
+
 # In-memory caching for products
 _products_cache = {
     "all_products": None,
@@ -454,42 +473,161 @@ PRODUCTS_CACHE_TTL = 300  # 5 minutes cache TTL
 def get_cached_products():
     current_time = time.time()
     if _products_cache["all_products"] is not None and (current_time - _products_cache["timestamp"] < PRODUCTS_CACHE_TTL):
-        print("DEBUG: Serving products from memory cache")
+        log_event("products_cache_hit", level=logging.DEBUG, sample=0.01)
         return _products_cache["all_products"]
     
     products = get_all_products()
     _products_cache["all_products"] = products
     _products_cache["timestamp"] = current_time
-    print("DEBUG: Products memory cache populated")
+    log_event("products_cache_fill", count=len(products))
     return products
 
 def invalidate_products_cache():
     _products_cache["all_products"] = None
     _products_cache["timestamp"] = 0.0
-    print("DEBUG: Products memory cache invalidated")
+    log_event("products_cache_invalidated")
+
+# Serialized GET /api/products body. Rebuilt on the request when the cached list is
+# replaced (reload, admin edit); in-place stock patches are folded in by
+# products_body_loop at most every PRODUCTS_BODY_DEBOUNCE seconds, together with
+# the br/gzip variants, so a busy checkout never re-serializes 5k rows per order.
+_product_list_adapter = TypeAdapter(List[ProductOut])
+_products_body = {"key": None, "body": b"", "compressed": None}
+_products_body_lock = threading.Lock()
+CATALOG_REFRESH_SECONDS = int(os.getenv("CATALOG_REFRESH_SECONDS", "60"))
+PRODUCTS_BODY_DEBOUNCE = float(os.getenv("PRODUCTS_BODY_DEBOUNCE", "5"))
+
+def _products_body_key() -> tuple:
+    return id(get_cached_products()), products_cache_state()[0]
+
+def _build_products_body(key: tuple):
+    visible = [p for p in get_cached_products() if p.get("is_visible", True)]
+    _products_body["body"] = _product_list_adapter.dump_json(_product_list_adapter.validate_python(visible))
+    _products_body["key"] = key
+
+def get_products_body() -> bytes:
+    """The current body; rebuilt here only if the cached list was replaced since it was built."""
+    key = _products_body_key()
+    built = _products_body["key"]
+    if built is None or built[0] != key[0]:
+        with _products_body_lock:
+            key = _products_body_key()
+            if _products_body["key"] is None or _products_body["key"][0] != key[0]:
+                _build_products_body(key)
+    return _products_body["body"]
+
+def _products_compressed_for(body: bytes) -> Optional[dict]:
+    entry = _products_body["compressed"]
+    return entry[1] if entry is not None and entry[0] is body else None
+
+def refresh_products_body():
+    """Rebuild the body if stock patches made it stale, then build its br/gzip variants (tens of ms)."""
+    with _products_body_lock:
+        key = _products_body_key()
+        if _products_body["key"] != key:
+            _build_products_body(key)
+        body = _products_body["body"]
+        if body and _products_compressed_for(body) is None:
+            # Paired with the body it was built from, so a reader never mixes versions
+            _products_body["compressed"] = (body, precompressed.compress(body))
+
+def warm_start_catalog():
+    """Serve the catalog from the on-disk snapshot if it matches the database's catalog version."""
+    snapshot = catalog_snapshot.load()
+    if snapshot is None:
+        return
+    try:
+        version = get_catalog_version()
+    except Exception as e:
+        print(f"Catalog version check failed, not using snapshot: {e}")
+        return
+    if snapshot.version != version:
+        print(f"Catalog snapshot is stale (v{snapshot.version}, database v{version}).")
+        return
+    generation = prime_products_cache(snapshot.rows, snapshot.version)
+    _products_body["body"] = snapshot.body
+    _products_body["key"] = (id(snapshot.rows), generation)
+    print(f"Catalog warm-started from snapshot v{version} ({len(snapshot.rows)} products).")
+
+def refresh_catalog(force: bool = False):
+    """Reload the catalog when the database version moved (or when forced) and persist a new snapshot; otherwise sync stock levels."""
+    _, cached_version = products_cache_state()
+    if force or cached_version is None or cached_version != get_catalog_version():
+        products = get_all_products(force=True)
+        invalidate_products_cache()
+        body = get_products_body()
+        catalog_snapshot.save(products_cache_state()[1], products, body)
+        # Rebuild similar-product neighbors here rather than on the first request after a change
+        refresh_similarity_index()
+    else:
+        # Stock moves do not change the version: patch other workers' checkouts in place
+        sync_stock_levels()
+
+async def catalog_refresh_loop():
+    # The first pass replaces a warm-started snapshot with a fresh read, off the request path.
+    force = True
+    while True:
+        try:
+            await asyncio.to_thread(refresh_catalog, force)
+            force = False
+        except Exception as e:
+            logging.error(f"Catalog refresh failed: {e}")
+        try:
+            # Hot-swap a newly published recommendation model (scripts/train_recommendations.py)
+            await asyncio.to_thread(rec_artifacts.refresh)
+        except Exception as e:
+            logging.error(f"Recommendation model refresh failed: {e}")
+        await asyncio.sleep(CATALOG_REFRESH_SECONDS)
+
+async def products_body_loop():
+    while True:
+        try:
+            await asyncio.to_thread(refresh_products_body)
+        except Exception as e:
+            logging.error(f"Catalog body refresh failed: {e}")
+        await asyncio.sleep(PRODUCTS_BODY_DEBOUNCE)
 
 @app.get("/api/products", response_model=List[ProductOut])
-def list_products(request: Request, include_hidden: bool = False):
+def list_products(
+    request: Request,
+    include_hidden: bool = False,
+    category: Optional[str] = None,
+    sub_category: Optional[str] = None,
+    min_price: Optional[float] = Query(None, ge=0),
+    max_price: Optional[float] = Query(None, ge=0),
+    in_stock: bool = False,
+    sort: Optional[str] = Query(None, pattern="^(display_order|price|-price|discount|newest)$"),
+    limit: Optional[int] = Query(None, ge=1, le=500),
+):
     check_rate_limit(request, limit=120, window=60, scope="products")
-    products = get_cached_products()
-    
-    # If not explicitly requested to include hidden, filter them out
+    if (category or sub_category or min_price is not None or max_price is not None
+            or in_stock or sort or limit):
+        # Filtered views run against the columnar catalog (vectorized masks and sorts)
+        return fast_json.respond(query_products(category=category, sub_category=sub_category, min_price=min_price,
+                                                max_price=max_price, in_stock=in_stock, sort=sort, limit=limit,
+                                                visible_only=not include_hidden))
     if not include_hidden:
-        products = [p for p in products if p.get("is_visible", True)]
+        # Prebuilt body of the visible catalog: no per-request validation, serialization or compression
+        body = get_products_body()
+        # Variants come from products_body_loop; until then GZipMiddleware covers the request
+        variants = _products_compressed_for(body)
+        return precompressed.response(body, variants, request.headers.get("accept-encoding"), "application/json")
+    products = get_cached_products()
     
-    print(f"DEBUG: Serving {len(products)} products to endpoint (include_hidden={include_hidden})")
-    return products
+    log_event("products_served", level=logging.DEBUG, sample=0.01, count=len(products), include_hidden=include_hidden)
+    # Rows were validated when written (ProductCreate / ProductUpdate): skip re-validating 5k of them
+    return fast_json.respond(products)
 
 @app.get("/api/admin/products", response_model=List[ProductOut])
 def admin_list_products(request: Request, admin: dict = Depends(get_current_admin)):
     check_rate_limit(request, limit=120, window=60, scope="admin-products")
-    return get_cached_products()
+    return fast_json.respond(get_cached_products())
 
 
 
 @app.post("/api/orders")
 
-async def place_order(order: OrderCreate, request: Request, customer_token: dict = Depends(get_current_customer)):
+async def place_order(order: OrderCreate, request: Request, response: Response, customer_token: dict = Depends(get_current_customer), idempotency_key: Optional[str] = Header(None, max_length=255)):
 
     # check_rate_limit(request, limit=3, window=600, scope="orders")
 
@@ -497,154 +635,53 @@ async def place_order(order: OrderCreate, request: Request, customer_token: dict
 
     phone = customer_token.get("phone")
 
-    db_cust = await asyncio.to_thread(get_customer, phone)
-
-    if not db_cust:
-
-        raise HTTPException(status_code=404, detail="Customer not found")
-
-        
-
-    try:
-
-        cancels = json.loads(db_cust.get("cancel_timestamps", "[]"))
-
-    except:
-
-        cancels = []
-
-        
-
-    now = datetime.now()
-
-    one_hour_ago = now - timedelta(hours=1)
-
-    recent_cancels = [c for c in cancels if datetime.fromisoformat(c) > one_hour_ago]
-
-    
-
-    if len(recent_cancels) >= 3:
-
-        raise HTTPException(status_code=403, detail="Too many cancellations. You are blocked from placing new orders for 1 hour.")
-
-        
-
-    if len(recent_cancels) != len(cancels):
-
-        await asyncio.to_thread(update_customer_cancels, phone, json.dumps(recent_cancels))
-
-
-
-    all_prods = await asyncio.to_thread(get_all_products)
-    products = {p["id"]: p for p in all_prods}
-
-    validated_items = []
-
-    calculated_total = 0.0
-
-
-
-    for item in order.items:
-
-        if item.product_id not in products:
-
-            raise HTTPException(status_code=400, detail="Product not found")
-
-        product = products[item.product_id]
-
-        if not product.get("is_visible", True):
-
-            raise HTTPException(status_code=400, detail=f"Product '{product['name']}' is no longer available.")
-
-        if not product.get("in_stock", True):
-
-            raise HTTPException(status_code=400, detail=f"Product '{product['name']}' is out of stock.")
-
-        subtotal = product["price"] * item.quantity
-
-        calculated_total += subtotal
-
-        validated_items.append({
-
-            "product_id": item.product_id,
-
-            "name": product["name"],
-
-            "price": product["price"],
-
-            "quantity": item.quantity,
-
-            "subtotal": subtotal,
-
-        })
-
-
-
-    if order.delivery_type == "delivery" and calculated_total < 1000.0:
-
-        calculated_total += 40.0
-
-
-
-    if abs(calculated_total - order.total) > 1.0:
-
-        raise HTTPException(status_code=400, detail="Total mismatch")
-
-
-
-    address_str = db_cust.get("address")
+    address_str = None
 
     if order.delivery_type == "delivery" and order.address:
 
-        address_dict = order.address.model_dump()
-
-        address_str = json.dumps(address_dict)
-
-        if order.save_as_home:
+        address_str = json.dumps(order.address.model_dump())
 
-            await asyncio.to_thread(create_or_update_customer, phone=phone, address=address_str)
+    items = [(item.product_id, item.quantity) for item in order.items]
 
+    try:
 
+        result, timings = await asyncio.to_thread(
 
-    token, delivery_otp = await asyncio.to_thread(create_order, phone, validated_items, calculated_total, order.delivery_type, order.delivery_time, address_str, order.payment_method)
-
-    response = {"token": token, "total": calculated_total, "status": "Processing", "payment_method": order.payment_method}
-
-    if delivery_otp:
-
-        response["delivery_otp"] = delivery_otp
-
+            order_service.place_order, phone, items, order.total,
 
+            order.delivery_type, order.delivery_time, address_str, order.payment_method, idempotency_key,
 
-    # Broadcast new order to WebSocket channels
+            bool(address_str and order.save_as_home)
 
-    try:
+        )
 
-        await manager.broadcast_all({
+    except OrderRejected as e:
 
-            "type": "new_order",
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
 
-            "token": token,
+    response.headers["Server-Timing"] = ", ".join(f"{stage};dur={ms:.1f}" for stage, ms in timings.items())
 
-            "customer_name": db_cust.get("name") or "Anonymous User",
+    if result["replayed"]:
 
-            "phone": phone
+        # Retry of an order that already went through: no second insert, save or broadcast
 
-        })
+        response.headers["Idempotent-Replayed"] = "true"
 
-    except Exception as ws_err:
+        return result["response"]
 
-        logging.error(f"WebSocket broadcast error: {ws_err}")
+    logging.info("ORDER_PLACED: token=%s stages=%s", result["token"], {k: round(v, 1) for k, v in timings.items()})
 
+    # Address save and broadcast were queued with the order; they run after we respond
 
+    jobs.notify()
 
-    return response
+    return result["response"]
 
 
 @app.post("/api/admin/orders/{order_token}/confirm-payment")
 async def confirm_payment(order_token: str, request: Request, admin_token: dict = Depends(get_current_admin)):
     """Admin confirms payment received. Generates delivery OTP and moves order to Ready for Pickup."""
-    check_rate_limit(request, limit=30, window=60, scope="admin-confirm-payment")
+    await asyncio.to_thread(check_rate_limit, request, limit=30, window=60, scope="admin-confirm-payment")
     order = await asyncio.to_thread(get_order_by_token, order_token)
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
@@ -659,7 +696,7 @@ async def confirm_payment(order_token: str, request: Request, admin_token: dict
 
 @app.post("/api/admin/orders/{order_token}/reject-payment")
 async def reject_payment(order_token: str, request: Request, admin: dict = Depends(get_current_admin)):
-    check_rate_limit(request, limit=30, window=60, scope="admin-payment")
+    await asyncio.to_thread(check_rate_limit, request, limit=30, window=60, scope="admin-payment")
     order = await asyncio.to_thread(get_order_by_token, order_token)
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
@@ -683,7 +720,7 @@ def list_all_orders(request: Request, admin_token: dict = Depends(get_current_ad
     # Strip delivery OTP — admin must not know it; only customer has it
     for o in orders:
         o.pop("delivery_otp", None)
-    return orders
+    return fast_json.respond(orders)
 
 
 
@@ -698,20 +735,20 @@ def list_customers(request: Request, admin: dict = Depends(get_current_admin)):
 
 
 @app.post("/api/admin/customers/{phone}/reset-pin")
-def admin_reset_customer_pin(phone: str, body: AdminResetPinRequest, request: Request, admin: dict = Depends(get_current_admin)):
-    check_rate_limit(request, limit=60, window=60, scope="admin-reset-pin")
+async def admin_reset_customer_pin(phone: str, body: AdminResetPinRequest, request: Request, admin: dict = Depends(get_current_admin)):
+    await asyncio.to_thread(check_rate_limit, request, limit=60, window=60, scope="admin-reset-pin")
     cleaned_phone = phone.replace(" ", "").replace("-", "").replace("+", "")
     if cleaned_phone.startswith("91") and len(cleaned_phone) == 12:
         cleaned_phone = cleaned_phone[2:]
     elif cleaned_phone.startswith("0") and len(cleaned_phone) == 11:
         cleaned_phone = cleaned_phone[1:]
         
-    customer = get_customer(cleaned_phone)
+    customer = await asyncio.to_thread(get_customer, cleaned_phone)
     if not customer:
         raise HTTPException(status_code=404, detail="Customer not found")
         
-    hashed_pin = hash_pin(body.new_pin)
-    create_or_update_customer(phone=cleaned_phone, pin_hash=hashed_pin)
+    hashed_pin = await hash_pin(body.new_pin)
+    await asyncio.to_thread(create_or_update_customer, phone=cleaned_phone, pin_hash=hashed_pin)
     return {"message": "Customer PIN reset successfully"}
 
 
@@ -722,7 +759,7 @@ def get_customer_orders(request: Request, customer_token: dict = Depends(get_cur
 
     check_rate_limit(request, limit=30, window=60, scope="customer-orders")
 
-    return get_orders_by_phone(customer_token.get("phone"))
+    return fast_json.respond(get_orders_by_phone(customer_token.get("phone")))
 
 
 
@@ -747,7 +784,7 @@ def get_order_details(token: str, request: Request, user: dict = Depends(get_cur
     if user.get("role") == "admin":
         order.pop("delivery_otp", None)
 
-    return order
+    return fast_json.respond(order)
 
 
 
@@ -755,7 +792,7 @@ def get_order_details(token: str, request: Request, user: dict = Depends(get_cur
 
 async def cancel_customer_order(token: str, request: Request, customer_token: dict = Depends(get_current_customer)):
 
-    check_rate_limit(request, limit=10, window=60, scope="order-cancel")
+    await asyncio.to_thread(check_rate_limit, request, limit=10, window=60, scope="order-cancel")
 
     phone = customer_token.get("phone")
 
@@ -775,47 +812,24 @@ async def cancel_customer_order(token: str, request: Request, customer_token: di
 
         
 
-    updated = await asyncio.to_thread(update_order_status, token, "Cancelled")
-
-    if not updated:
-
-        raise HTTPException(status_code=500, detail="Failed to cancel order")
-
-        
-
-    db_cust = await asyncio.to_thread(get_customer, phone)
-
-    try:
-
-        cancels = json.loads(db_cust.get("cancel_timestamps", "[]"))
-
-    except:
-
-        cancels = []
-
-        
+    # The cancel history is updated in the cancelling transaction, so the block applies to
+    # the very next order and the count below is exact; the broadcast is written behind
 
     now = datetime.now()
 
-    cancels.append(now.isoformat())
-
-    
-
-    one_hour_ago = now - timedelta(hours=1)
+    side_effects = [("broadcast", phone, {"type": "status_update", "token": token, "status": "Cancelled"})]
 
-    recent_cancels = [c for c in cancels if datetime.fromisoformat(c) > one_hour_ago]
-
-    
+    count = await asyncio.to_thread(cancel_order_for_customer, token, phone, now.isoformat(),
 
-    await asyncio.to_thread(update_customer_cancels, phone, json.dumps(recent_cancels))
+                                    (now - timedelta(hours=1)).isoformat(), side_effects)
 
-    
+    if count is None:
 
-    await manager.broadcast_all({"type": "status_update", "token": token, "status": "Cancelled"})
+        raise HTTPException(status_code=500, detail="Failed to cancel order")
 
-    
+    jobs.notify()
 
-    count = len(recent_cancels)
+        
 
     if count >= 3:
 
@@ -835,7 +849,7 @@ async def cancel_customer_order(token: str, request: Request, customer_token: di
 
 async def update_status(token: str, body: OrderStatusUpdate, request: Request, admin_token: dict = Depends(get_current_admin)):
 
-    check_rate_limit(request, limit=60, window=60, scope="admin-orders-update")
+    await asyncio.to_thread(check_rate_limit, request, limit=60, window=60, scope="admin-orders-update")
 
     if body.status == "Delivered":
 
@@ -855,7 +869,10 @@ async def update_status(token: str, body: OrderStatusUpdate, request: Request, a
 
     else:
 
-        updated = await asyncio.to_thread(update_order_status, token, body.status)
+        try:
+            updated = await asyncio.to_thread(update_order_status, token, body.status)
+        except ValueError as e:
+            raise HTTPException(status_code=409, detail=str(e))
 
         logging.info(f"ADMIN_ACTION: Order {token} status changed to {body.status} by admin")
 
@@ -915,7 +932,9 @@ def admin_add_product(body: ProductCreate, admin: dict = Depends(get_current_adm
 
         base_name=body.base_name,
 
-        unit=body.unit
+        unit=body.unit,
+
+        stock_qty=body.stock_qty
 
     )
 
@@ -933,10 +952,10 @@ def admin_add_product(body: ProductCreate, admin: dict = Depends(get_current_adm
 
 def admin_update_product(product_id: int, body: ProductUpdate, admin: dict = Depends(get_current_admin)):
 
-    print(f"DEBUG: Updating product {product_id} with data: {body.model_dump(exclude_unset=True)}")
-
     updates = body.model_dump(exclude_unset=True)
 
+    log_event("product_update", product_id=product_id, fields=sorted(updates))
+
     if not updates:
 
         raise HTTPException(status_code=400, detail="No update data provided")
@@ -947,7 +966,7 @@ def admin_update_product(product_id: int, body: ProductUpdate, admin: dict = Dep
 
     if not success:
 
-        print(f"DEBUG: Update failed for product {product_id}. Either ID doesn't exist or no rows changed.")
+        log_event("product_update_failed", level=logging.WARNING, product_id=product_id)
 
         raise HTTPException(status_code=404, detail="Product not found or update failed")
 
@@ -955,8 +974,6 @@ def admin_update_product(product_id: int, body: ProductUpdate, admin: dict = Dep
 
     invalidate_products_cache()
 
-    print(f"DEBUG: Product {product_id} updated successfully!")
-
     return {"message": "Product updated successfully"}
 
 
@@ -1028,8 +1045,8 @@ def get_me(request: Request, customer: dict = Depends(get_current_customer)):
 
 
 @app.patch("/api/auth/profile")
-def update_profile(body: ProfileUpdateRequest, request: Request, customer: dict = Depends(get_current_customer)):
-    check_rate_limit(request, limit=10, window=60, scope="auth-profile-update")
+async def update_profile(body: ProfileUpdateRequest, request: Request, customer: dict = Depends(get_current_customer)):
+    await asyncio.to_thread(check_rate_limit, request, limit=10, window=60, scope="auth-profile-update")
     name = body.name.strip()
     if not name or len(name) < 2:
         raise HTTPException(status_code=400, detail="Name must be at least 2 characters")
@@ -1043,9 +1060,10 @@ def update_profile(body: ProfileUpdateRequest, request: Request, customer: dict
         if not security_question or not body.security_answer:
             raise HTTPException(status_code=400, detail="Both security question and answer must be provided to update security details")
         ans_normalized = body.security_answer.strip().lower()
-        security_answer_hash = hash_pin(ans_normalized)
+        security_answer_hash = await hash_pin(ans_normalized)
 
-    create_or_update_customer(
+    await asyncio.to_thread(
+        create_or_update_customer,
         phone=phone,
         name=name,
         security_question=security_question,
@@ -1079,20 +1097,19 @@ def check_phone(phone: str, request: Request):
 
 
 @app.post("/api/auth/signup")
-def signup(body: SignupRequest, request: Request):
-    check_rate_limit(request, limit=5, window=60, scope="auth-signup")
+async def signup(body: SignupRequest, request: Request):
+    await asyncio.to_thread(check_rate_limit, request, limit=5, window=60, scope="auth-signup")
     
-    if get_customer(body.phone):
+    if await asyncio.to_thread(get_customer, body.phone):
         raise HTTPException(status_code=400, detail="Phone number is already registered")
         
-    pin_hash = hash_pin(body.pin)
-    
-    # Normalize security answer and hash it
+    # Normalize security answer and hash it alongside the PIN
     ans_normalized = body.security_answer.strip().lower()
-    security_answer_hash = hash_pin(ans_normalized)
+    pin_hash, security_answer_hash = await asyncio.gather(hash_pin(body.pin), hash_pin(ans_normalized))
     
     # Save user to database
-    create_or_update_customer(
+    await asyncio.to_thread(
+        create_or_update_customer,
         phone=body.phone,
         name=body.name,
         pin_hash=pin_hash,
@@ -1111,21 +1128,19 @@ def signup(body: SignupRequest, request: Request):
 
 
 
-failed_login_attempts = {}
-
 @app.post("/api/auth/login")
 
-def login(body: LoginRequest, request: Request):
+async def login(body: LoginRequest, request: Request):
 
-    check_rate_limit(request, limit=5, window=60, scope="auth-login")
+    await asyncio.to_thread(check_rate_limit, request, limit=5, window=60, scope="auth-login")
 
     
 
-    customer = get_customer(body.identifier)
+    customer = await asyncio.to_thread(get_customer, body.identifier, fresh=True)
 
     if not customer:
 
-        customer = get_customer_by_email(body.identifier)
+        customer = await asyncio.to_thread(get_customer_by_email, body.identifier)
 
         
 
@@ -1138,38 +1153,34 @@ def login(body: LoginRequest, request: Request):
     now = time.time()
     
     # Check if account is locked
-    lock_info = failed_login_attempts.get(phone)
-    if lock_info and lock_info["locked_until"] > now:
-        minutes_left = int((lock_info["locked_until"] - now + 59) // 60)
+    locked_until = await asyncio.to_thread(rate_limit_backend.get_lockout, phone)
+    if locked_until > now:
+        minutes_left = int((locked_until - now + 59) // 60)
         raise HTTPException(
             status_code=423,
             detail=f"Account temporarily locked due to too many failed attempts. Try again in {minutes_left} minutes."
         )
 
-    if not verify_pin(body.pin, customer["pin_hash"]):
+    if not await verify_pin(body.pin, customer["pin_hash"]):
         logging.warning(f"FAILED_LOGIN: Attempt on phone {customer['phone'][-4:].rjust(10, '*')}")
         
-        # Track failed attempts
-        lock_info = failed_login_attempts.get(phone, {"attempts": 0, "locked_until": 0})
-        lock_info["attempts"] += 1
+        # Track failed attempts (15 minutes lockout after 5)
+        attempts, _ = await asyncio.to_thread(rate_limit_backend.record_failure, phone, 5, 900)
         
-        if lock_info["attempts"] >= 5:
-            lock_info["locked_until"] = now + 900  # 15 minutes lockout
-            failed_login_attempts[phone] = lock_info
+        if attempts >= 5:
             raise HTTPException(
                 status_code=423,
                 detail="Account locked for 15 minutes due to 5 failed PIN attempts."
             )
         else:
-            failed_login_attempts[phone] = lock_info
-            attempts_left = 5 - lock_info["attempts"]
+            attempts_left = 5 - attempts
             raise HTTPException(
                 status_code=401,
                 detail=f"Incorrect PIN. {attempts_left} attempts remaining before account lock."
             )
 
     # Clear lockout on success
-    failed_login_attempts.pop(phone, None)
+    await asyncio.to_thread(rate_limit_backend.clear_failures, phone)
 
     token = create_access_token({"role": "customer", "phone": customer["phone"]}, timedelta(days=7))
 
@@ -1206,9 +1217,9 @@ def forgot_pin_question(body: ForgotPinQuestionRequest, request: Request):
     return {"security_question": question}
 
 @app.post("/api/auth/forgot-pin/verify")
-def forgot_pin_verify(body: ForgotPinVerifyRequest, request: Request):
-    check_rate_limit(request, limit=5, window=60, scope="forgot-pin-verify")
-    customer = get_customer(body.phone)
+async def forgot_pin_verify(body: ForgotPinVerifyRequest, request: Request):
+    await asyncio.to_thread(check_rate_limit, request, limit=5, window=60, scope="forgot-pin-verify")
+    customer = await asyncio.to_thread(get_customer, body.phone, fresh=True)
     if not customer:
         raise HTTPException(status_code=404, detail="Phone number not registered")
         
@@ -1220,7 +1231,7 @@ def forgot_pin_verify(body: ForgotPinVerifyRequest, request: Request):
         )
         
     # Verify the answer (normalized to lowercase and stripped)
-    if not verify_pin(body.security_answer, ans_hash):
+    if not await verify_pin(body.security_answer, ans_hash):
         raise HTTPException(status_code=401, detail="Incorrect answer to security question")
         
     reset_token = create_access_token({"role": "reset", "phone": customer["phone"]}, timedelta(minutes=15))
@@ -1231,23 +1242,23 @@ def forgot_pin_verify(body: ForgotPinVerifyRequest, request: Request):
     }
 
 @app.post("/api/auth/change-pin")
-def change_pin(body: ChangePinRequest, request: Request, customer_token: dict = Depends(get_current_customer)):
-    check_rate_limit(request, limit=5, window=60, scope="change-pin")
+async def change_pin(body: ChangePinRequest, request: Request, customer_token: dict = Depends(get_current_customer)):
+    await asyncio.to_thread(check_rate_limit, request, limit=5, window=60, scope="change-pin")
     phone = customer_token.get("phone")
-    customer = get_customer(phone)
+    customer = await asyncio.to_thread(get_customer, phone, fresh=True)
     if not customer:
         raise HTTPException(status_code=404, detail="Customer not found")
         
-    if not verify_pin(body.old_pin, customer["pin_hash"]):
+    if not await verify_pin(body.old_pin, customer["pin_hash"]):
         raise HTTPException(status_code=401, detail="Incorrect current PIN")
         
-    new_pin_hash = hash_pin(body.new_pin)
-    create_or_update_customer(phone, pin_hash=new_pin_hash)
+    new_pin_hash = await hash_pin(body.new_pin)
+    await asyncio.to_thread(create_or_update_customer, phone, pin_hash=new_pin_hash)
     return {"message": "PIN updated successfully"}
 
 @app.post("/api/auth/reset-pin")
-def reset_pin(body: ResetPinRequest, request: Request):
-    check_rate_limit(request, limit=3, window=60, scope="reset-pin")
+async def reset_pin(body: ResetPinRequest, request: Request):
+    await asyncio.to_thread(check_rate_limit, request, limit=3, window=60, scope="reset-pin")
     try:
         payload = jwt.decode(body.token, SECRET_KEY, algorithms=[ALGORITHM])
 
@@ -1259,7 +1270,7 @@ def reset_pin(body: ResetPinRequest, request: Request):
 
         
 
-        db_cust = get_customer(phone)
+        db_cust = await asyncio.to_thread(get_customer, phone)
 
         if not db_cust:
 
@@ -1267,9 +1278,9 @@ def reset_pin(body: ResetPinRequest, request: Request):
 
             
 
-        new_pin_hash = hash_pin(body.new_pin)
+        new_pin_hash = await hash_pin(body.new_pin)
 
-        create_or_update_customer(phone, pin_hash=new_pin_hash)
+        await asyncio.to_thread(create_or_update_customer, phone, pin_hash=new_pin_hash)
 
         
 
@@ -1281,6 +1292,10 @@ def reset_pin(body: ResetPinRequest, request: Request):
 
         raise HTTPException(status_code=400, detail="Reset token expired")
 
+    except HashQueueFull:
+
+        raise
+
     except Exception:
 
         raise HTTPException(status_code=400, detail="Invalid token")
@@ -1319,6 +1334,58 @@ def health_check():
 
 
 
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics(request: Request):
+    """Prometheus scrape endpoint. Requires 'Authorization: Bearer $METRICS_TOKEN' when that is set."""
+    if METRICS_TOKEN and request.headers.get("authorization") != f"Bearer {METRICS_TOKEN}":
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.post("/api/admin/profile/cpu", include_in_schema=False)
+async def profile_cpu(seconds: float = 10, interval_ms: float = 5, include_idle: bool = False, admin: dict = Depends(get_current_admin)):
+    """Sample this worker's stacks for `seconds`; returns flamegraph collapsed stacks."""
+    try:
+        stacks = await asyncio.to_thread(profiling.sample_cpu, seconds, max(interval_ms, 1) / 1000, include_idle)
+    except profiling.ProfilerBusy:
+        raise HTTPException(status_code=409, detail="A profile is already running")
+    logging.info(f"ADMIN_ACTION: CPU profile captured ({seconds}s)")
+    return Response(content=stacks, media_type="text/plain")
+
+
+@app.post("/api/admin/profile/memory", include_in_schema=False)
+async def profile_memory(seconds: float = 10, top: int = 25, frames: int = 1, admin: dict = Depends(get_current_admin)):
+    """Trace allocations for `seconds`; returns the top allocation sites by size."""
+    try:
+        return await asyncio.to_thread(profiling.allocation_snapshot, seconds, min(max(top, 1), 200), min(max(frames, 1), 25))
+    except profiling.ProfilerBusy:
+        raise HTTPException(status_code=409, detail="A profile is already running")
+
+
+@app.get("/api/admin/catalog/summary")
+def catalog_summary(admin: dict = Depends(get_current_admin)):
+    """Per-category product counts, out-of-stock counts and price/discount averages."""
+    columns = get_catalog_columns()
+    if columns is None:
+        raise HTTPException(status_code=501, detail="Catalog analytics need NumPy installed")
+    return {"products": len(columns), "columns_bytes": columns.nbytes, "categories": columns.category_summary()}
+
+
+@app.get("/api/admin/metrics/jobs")
+def job_metrics(admin: dict = Depends(get_current_admin)):
+    """Write-behind outbox depth per job kind."""
+    return jobs.stats()
+
+
+@app.get("/api/admin/metrics/hashing")
+def hashing_metrics(admin: dict = Depends(get_current_admin)):
+    """PIN hashing pool stats: queue wait and bcrypt latency per operation."""
+    return hashing.metrics.snapshot()
+
+
+
 # ── Favorites ────────────────────────────────────────────────
 
 
@@ -1335,11 +1402,11 @@ def list_favorites(request: Request, customer: dict = Depends(get_current_custom
 
     # Enrich with full product data
 
-    all_prods = {p['id']: p for p in get_all_products()}
+    all_prods = get_products_by_id()
 
     result = [all_prods[fid] for fid in favorite_ids if fid in all_prods]
 
-    return result
+    return fast_json.respond(result)
 
 
 
@@ -1383,7 +1450,7 @@ def get_recommendations(request: Request, customer: dict = Depends(get_current_c
 
     phone = customer.get("phone")
 
-    return get_personalized_recommendations(phone, limit=12)
+    return fast_json.respond(get_personalized_recommendations(phone, limit=12))
 
 
 
@@ -1395,7 +1462,40 @@ def get_trending(request: Request):
 
     check_rate_limit(request, limit=30, window=60, scope="trending")
 
-    return get_trending_products(limit=12)
+    return fast_json.respond(get_trending_products(limit=12))
+
+@app.get("/api/home", response_model=HomeFeed)
+async def get_home(request: Request, customer: dict = Depends(get_current_customer)):
+    """Home-screen widgets in one request: trending, recommended, reorder reminders and favorites.
+
+    Trending and the customer's context (catalog snapshot, favorites, recent
+    orders) are fetched concurrently; every widget is then computed from that
+    one context. Products are listed once and widgets reference them by id.
+    """
+    await asyncio.to_thread(check_rate_limit, request, limit=30, window=60, scope="home")
+    phone = customer.get("phone")
+    trending, context = await asyncio.gather(
+        asyncio.to_thread(get_trending_products, 12),
+        asyncio.to_thread(get_customer_context, phone),
+    )
+
+    def compose() -> dict:
+        by_id = context["products_by_id"]
+        widgets = {
+            "trending": trending,
+            "recommended": get_personalized_recommendations(phone, limit=12, context=context),
+            "reorder": get_smart_reorder_reminders(phone, limit=6, context=context),
+            "favorites": [by_id[fid] for fid in context["favorite_ids"] if fid in by_id],
+        }
+        products = {}
+        for items in widgets.values():
+            for p in items:
+                products.setdefault(p['id'], p)
+        feed = {name: [p['id'] for p in items] for name, items in widgets.items()}
+        feed["products"] = list(products.values())
+        return feed
+
+    return fast_json.respond(await asyncio.to_thread(compose))
 
 class FBTRequest(BaseModel):
     product_ids: List[int]
@@ -1404,20 +1504,20 @@ class FBTRequest(BaseModel):
 def get_fbt_recs(request: Request, body: FBTRequest):
     """Fetch cross-sell recommendations based on items in the current cart."""
     check_rate_limit(request, limit=60, window=60, scope="fbt-recs")
-    return get_frequently_bought_together(body.product_ids, limit=4)
+    return fast_json.respond(get_frequently_bought_together(body.product_ids, limit=4))
 
 @app.get("/api/recommendations/reorder", response_model=List[ProductOut])
 def get_reorder_reminders_route(request: Request, customer: dict = Depends(get_current_customer)):
     """Fetch cyclical grocery reorder recommendations for a logged-in user."""
     check_rate_limit(request, limit=30, window=60, scope="reorder-recs")
     phone = customer.get("phone")
-    return get_smart_reorder_reminders(phone, limit=6)
+    return fast_json.respond(get_smart_reorder_reminders(phone, limit=6))
 
 @app.get("/api/recommendations/similar/{product_id}", response_model=List[ProductOut])
 def get_similar_products_route(product_id: int, request: Request):
     """Fetch semantic title-matched similar products in the same category."""
     check_rate_limit(request, limit=60, window=60, scope="similar-recs")
-    return get_similar_products(product_id, limit=6)
+    return fast_json.respond(get_similar_products(product_id, limit=6))
 
 
 
@@ -1436,6 +1536,8 @@ def list_available_images(admin: dict = Depends(get_current_admin)):
 
     
 
+    import requests  # only this admin tool needs it; keep it off the startup path
+
     all_images = []
 
     
@@ -1579,17 +1681,33 @@ if os.path.exists(DIST_PATH):
 
     import mimetypes
 
+    def _text_media_type(content_type: Optional[str]) -> Optional[str]:
+        if content_type and (
+            content_type.startswith("text/")
+            or "javascript" in content_type
+            or "json" in content_type
+            or "svg" in content_type
+        ) and "charset" not in content_type:
+            return f"{content_type}; charset=utf-8"
+        return content_type
+
     class UTF8StaticFiles(StaticFiles):
-        def file_response(self, *args, **kwargs):
-            response = super().file_response(*args, **kwargs)
-            content_type = response.headers.get("content-type", "")
-            if (
-                content_type.startswith("text/") 
-                or "javascript" in content_type 
-                or "json" in content_type 
-                or "svg" in content_type
-            ) and "charset" not in content_type:
-                response.headers["content-type"] = f"{content_type}; charset=utf-8"
+        def file_response(self, full_path, stat_result, scope, status_code=200):
+            # Serve the build's .br/.gz sibling when the client takes it
+            accept_encoding = Headers(scope=scope).get("accept-encoding")
+            send_path, encoding, varies = precompressed.sibling(str(full_path), accept_encoding)
+            if encoding is not None:
+                response = super().file_response(send_path, os.stat(send_path), scope, status_code)
+                # The type of the original file, not of the .br/.gz
+                response.headers["content-type"] = mimetypes.guess_type(str(full_path))[0] or "application/octet-stream"
+                response.headers["content-encoding"] = encoding
+            else:
+                response = super().file_response(full_path, stat_result, scope, status_code)
+            if varies:
+                response.headers["vary"] = "Accept-Encoding"
+            content_type = response.headers.get("content-type")
+            if content_type:
+                response.headers["content-type"] = _text_media_type(content_type)
             return response
 
     app.mount("/assets", UTF8StaticFiles(directory=os.path.join(DIST_PATH, "assets")), name="assets")
@@ -1597,7 +1715,7 @@ if os.path.exists(DIST_PATH):
     
 
     @app.get("/{full_path:path}")
-    async def serve_frontend(full_path: str):
+    async def serve_frontend(full_path: str, request: Request):
         # If the path starts with api/, it's a 404 for API
         if full_path.startswith("api/"):
             raise HTTPException(status_code=404, detail="API endpoint not found")
@@ -1612,16 +1730,7 @@ if os.path.exists(DIST_PATH):
                 headers["Expires"] = "0"
             
             content_type, _ = mimetypes.guess_type(file_path)
-            media_type = content_type
-            if content_type and (
-                content_type.startswith("text/") 
-                or "javascript" in content_type 
-                or "json" in content_type 
-                or "svg" in content_type
-            ) and "charset" not in content_type:
-                media_type = f"{content_type}; charset=utf-8"
-                
-            return FileResponse(file_path, headers=headers, media_type=media_type)
+            return _precompressed_file(file_path, request, headers, _text_media_type(content_type))
             
         index_file = os.path.join(DIST_PATH, "index.html")
         headers = {
@@ -1629,7 +1738,15 @@ if os.path.exists(DIST_PATH):
             "Pragma": "no-cache",
             "Expires": "0"
         }
-        return FileResponse(index_file, headers=headers, media_type="text/html; charset=utf-8")
+        return _precompressed_file(index_file, request, headers, "text/html; charset=utf-8")
+
+    def _precompressed_file(path: str, request: Request, headers: dict, media_type: Optional[str]) -> FileResponse:
+        send_path, encoding, varies = precompressed.sibling(path, request.headers.get("accept-encoding"))
+        if encoding is not None:
+            headers["Content-Encoding"] = encoding
+        if varies:
+            headers["Vary"] = "Accept-Encoding"
+        return FileResponse(send_path, headers=headers, media_type=media_type)
 
 else:
 
@@ -1639,6 +1756,8 @@ else:
 
 if __name__ == "__main__":
 
+    import uvicorn
+
     port = int(os.getenv("PORT", 8000))
 
     uvicorn.run(app, host="0.0.0.0", port=port)
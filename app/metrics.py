@@ -0,0 +1,235 @@
+# ============================================================
+# metrics.py — Request Metrics, /metrics Rendering, Structured Logs
+# ============================================================
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+# Queries per request above which a warning is logged (likely N+1 or missing batching)
+QUERY_BUDGET = int(os.getenv("QUERY_BUDGET", "8"))
+# Per-statement timings kept per request; the count and totals are always exact
+MAX_TRACED_STATEMENTS = 50
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+POOL_WAIT_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+
+class Histogram:
+    """Prometheus-style histogram. Callers hold the registry lock."""
+
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name: str, labels: str, lines: list):
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels}le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels}le="+Inf"}} {self.count}')
+        suffix = f"{{{labels.rstrip(',')}}}" if labels else ""
+        lines.append(f"{name}_sum{suffix} {self.sum:.6f}")
+        lines.append(f"{name}_count{suffix} {self.count}")
+
+
+_lock = threading.Lock()
+_latency = {}     # (method, route) -> Histogram
+_db_time = {}     # (method, route) -> Histogram
+_responses = {}   # (method, route, status) -> count
+_pool_wait = Histogram(POOL_WAIT_BUCKETS)
+_in_flight = 0
+
+class RequestTrace:
+    """DB activity of one request. asyncio.to_thread copies the context, so
+    DB work in worker threads records into the same trace object."""
+
+    __slots__ = ("held_seconds", "pool_wait_seconds", "query_count", "query_seconds", "statements")
+
+    def __init__(self):
+        self.held_seconds = 0.0
+        self.pool_wait_seconds = 0.0
+        self.query_count = 0
+        self.query_seconds = 0.0
+        self.statements = []
+
+    def server_timing(self) -> str:
+        return (f'db;dur={self.query_seconds * 1000:.1f};desc="{self.query_count} queries", '
+                f"db-pool;dur={self.pool_wait_seconds * 1000:.1f}")
+
+
+_request_trace: ContextVar = ContextVar("request_trace", default=None)
+
+
+def _statement_label(sql) -> str:
+    if isinstance(sql, bytes):
+        sql = sql.decode(errors="replace")
+    return " ".join(str(sql).split())[:120]
+
+
+# ── Hooks called from database.py ────────────────────────
+
+def observe_pool_wait(seconds: float):
+    with _lock:
+        _pool_wait.observe(seconds)
+    trace = _request_trace.get()
+    if trace is not None:
+        trace.pool_wait_seconds += seconds
+
+
+def observe_db_time(seconds: float):
+    """Time a pooled connection was checked out by the current request."""
+    trace = _request_trace.get()
+    if trace is not None:
+        trace.held_seconds += seconds
+
+
+def observe_query(sql, seconds: float):
+    """One statement executed by the current request (parameters are never recorded)."""
+    trace = _request_trace.get()
+    if trace is None:
+        return
+    trace.query_count += 1
+    trace.query_seconds += seconds
+    if len(trace.statements) < MAX_TRACED_STATEMENTS:
+        trace.statements.append((_statement_label(sql), round(seconds * 1000, 2)))
+
+
+# ── ASGI middleware ──────────────────────────────────────
+
+class MetricsMiddleware:
+    """Records latency, status, DB time and in-flight count per route template,
+    adds DB timings to Server-Timing, and flags requests over QUERY_BUDGET."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        global _in_flight
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status = [500]
+        trace = RequestTrace()
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"server-timing", trace.server_timing().encode())]
+            await send(message)
+
+        token = _request_trace.set(trace)
+        with _lock:
+            _in_flight += 1
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            _request_trace.reset(token)
+            route = scope.get("route")
+            # Route templates keep label cardinality bounded (no raw ids in paths)
+            key = (scope["method"], getattr(route, "path", "<unmatched>"))
+            with _lock:
+                _in_flight -= 1
+                _latency.setdefault(key, Histogram(LATENCY_BUCKETS)).observe(elapsed)
+                _db_time.setdefault(key, Histogram(LATENCY_BUCKETS)).observe(trace.held_seconds)
+                _responses[key + (status[0],)] = _responses.get(key + (status[0],), 0) + 1
+            if trace.query_count:
+                _log_trace(key, trace, elapsed)
+
+
+def _log_trace(key: tuple, trace: RequestTrace, elapsed: float):
+    fields = {
+        "method": key[0], "route": key[1], "queries": trace.query_count,
+        "db_ms": round(trace.query_seconds * 1000, 2), "total_ms": round(elapsed * 1000, 2),
+    }
+    if trace.query_count > QUERY_BUDGET:
+        # Repeated statements are the usual N+1 signature
+        repeats = {}
+        for sql, _ in trace.statements:
+            repeats[sql] = repeats.get(sql, 0) + 1
+        log_event("query_budget_exceeded", level=logging.WARNING, budget=QUERY_BUDGET,
+                  repeated={sql: n for sql, n in repeats.items() if n > 1}, statements=trace.statements, **fields)
+    elif logger.isEnabledFor(logging.DEBUG):
+        log_event("request_trace", level=logging.DEBUG, statements=trace.statements, **fields)
+
+
+# ── Prometheus text exposition ───────────────────────────
+
+def _label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"')
+
+
+def render() -> str:
+    lines = []
+    with _lock:
+        lines.append("# HELP http_request_duration_seconds Request latency by route.")
+        lines.append("# TYPE http_request_duration_seconds histogram")
+        for (method, route), hist in sorted(_latency.items()):
+            hist.render("http_request_duration_seconds", f'method="{method}",route="{_label(route)}",', lines)
+
+        lines.append("# HELP http_request_db_seconds Time each request held database connections.")
+        lines.append("# TYPE http_request_db_seconds histogram")
+        for (method, route), hist in sorted(_db_time.items()):
+            hist.render("http_request_db_seconds", f'method="{method}",route="{_label(route)}",', lines)
+
+        lines.append("# HELP http_responses_total Responses by route and status code.")
+        lines.append("# TYPE http_responses_total counter")
+        for (method, route, status), count in sorted(_responses.items()):
+            lines.append(f'http_responses_total{{method="{method}",route="{_label(route)}",status="{status}"}} {count}')
+
+        lines.append("# HELP http_requests_in_flight Requests currently being handled.")
+        lines.append("# TYPE http_requests_in_flight gauge")
+        lines.append(f"http_requests_in_flight {_in_flight}")
+
+        lines.append("# HELP db_pool_wait_seconds Time spent waiting for a pooled connection.")
+        lines.append("# TYPE db_pool_wait_seconds histogram")
+        _pool_wait.render("db_pool_wait_seconds", "", lines)
+    return "\n".join(lines) + "\n"
+
+
+# ── Structured logging ───────────────────────────────────
+
+class _JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "event": record.getMessage(),
+        }
+        entry.update(getattr(record, "fields", {}))
+        return json.dumps(entry, default=str)
+
+
+logger = logging.getLogger("kgs")
+if not logger.handlers:
+    _handler = logging.StreamHandler(sys.stderr)
+    _handler.setFormatter(_JsonFormatter())
+    logger.addHandler(_handler)
+    logger.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+    logger.propagate = False
+
+
+def log_event(event: str, level: int = logging.INFO, sample: float = 1.0, **fields):
+    """Emit one JSON log line. sample < 1 keeps only that fraction of hot-path events."""
+    if not logger.isEnabledFor(level):
+        return
+    if sample < 1.0 and random.random() >= sample:
+        return
+    if sample < 1.0:
+        fields["sample"] = sample
+    logger.log(level, event, extra={"fields": fields})
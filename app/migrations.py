@@ -0,0 +1,366 @@
+# ============================================================
+# migrations.py — Versioned Schema Migrations
+# ============================================================
+# Each migration runs once, in order, and is recorded in schema_migrations,
+# so a boot against an up-to-date database costs a single round trip.
+# Append new migrations at the end; never edit one that has shipped.
+
+# Arbitrary constant: serializes workers that boot at the same time
+MIGRATION_LOCK_ID = 734201
+
+MIGRATIONS = [
+    (1, "baseline schema", r"""
+        -- Products table
+        CREATE TABLE IF NOT EXISTS products (
+            id SERIAL PRIMARY KEY,
+            name TEXT NOT NULL,
+            price REAL NOT NULL,
+            mrp REAL NOT NULL DEFAULT 0.0,
+            description TEXT NOT NULL,
+            image_url TEXT NOT NULL,
+            category TEXT NOT NULL,
+            sub_category TEXT NOT NULL DEFAULT '',
+            base_name TEXT NOT NULL DEFAULT '',
+            unit TEXT NOT NULL DEFAULT 'kg',
+            is_visible BOOLEAN NOT NULL DEFAULT TRUE,
+            in_stock BOOLEAN NOT NULL DEFAULT TRUE,
+            is_newly_launched BOOLEAN NOT NULL DEFAULT FALSE,
+            display_order INTEGER NOT NULL DEFAULT 0
+        );
+
+        -- Migrations for products
+        DO $$ BEGIN
+            IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='products' AND column_name='mrp') THEN
+                ALTER TABLE products ADD COLUMN mrp REAL NOT NULL DEFAULT 0.0;
+            END IF;
+            IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='products' AND column_name='sub_category') THEN
+                ALTER TABLE products ADD COLUMN sub_category TEXT NOT NULL DEFAULT '';
+            END IF;
+            IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='products' AND column_name='is_visible') THEN
+                ALTER TABLE products ADD COLUMN is_visible BOOLEAN NOT NULL DEFAULT TRUE;
+            END IF;
+            IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='products' AND column_name='in_stock') THEN
+                ALTER TABLE products ADD COLUMN in_stock BOOLEAN NOT NULL DEFAULT TRUE;
+            END IF;
+            IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='products' AND column_name='is_newly_launched') THEN
+                ALTER TABLE products ADD COLUMN is_newly_launched BOOLEAN NOT NULL DEFAULT FALSE;
+            END IF;
+            IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='products' AND column_name='display_order') THEN
+                ALTER TABLE products ADD COLUMN display_order INTEGER NOT NULL DEFAULT 0;
+            END IF;
+        END $$;
+
+        -- Fix any 0.0 or null MRPs to match price
+        UPDATE products SET mrp = price WHERE mrp = 0.0 OR mrp IS NULL;
+
+        -- Orders table
+        CREATE TABLE IF NOT EXISTS orders (
+            id SERIAL PRIMARY KEY,
+            token TEXT NOT NULL UNIQUE,
+            phone TEXT NOT NULL,
+            items_json TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'Processing',
+            total REAL NOT NULL,
+            timestamp TEXT NOT NULL,
+            address TEXT,
+            delivery_type TEXT NOT NULL DEFAULT 'pickup',
+            delivery_time TEXT NOT NULL DEFAULT 'same_day',
+            delivered_at TEXT,
+            delivery_otp TEXT,
+            payment_method TEXT NOT NULL DEFAULT 'cod',
+            payment_status TEXT NOT NULL DEFAULT 'pending'
+        );
+
+        -- Migrations for orders payment columns
+        DO $$ BEGIN
+            IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='orders' AND column_name='payment_method') THEN
+                ALTER TABLE orders ADD COLUMN payment_method TEXT NOT NULL DEFAULT 'cod';
+            END IF;
+            IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='orders' AND column_name='payment_status') THEN
+                ALTER TABLE orders ADD COLUMN payment_status TEXT NOT NULL DEFAULT 'pending';
+            END IF;
+        END $$;
+
+        -- Customers table
+        CREATE TABLE IF NOT EXISTS customers (
+            phone TEXT PRIMARY KEY,
+            name TEXT,
+            email TEXT,
+            address TEXT,
+            pin_hash TEXT,
+            cancel_timestamps TEXT DEFAULT '[]',
+            created_at TEXT NOT NULL
+        );
+
+        -- Migrations for customer security questions
+        DO $$ BEGIN
+            IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='customers' AND column_name='security_question') THEN
+                ALTER TABLE customers ADD COLUMN security_question TEXT;
+            END IF;
+            IF NOT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name='customers' AND column_name='security_answer_hash') THEN
+                ALTER TABLE customers ADD COLUMN security_answer_hash TEXT;
+            END IF;
+        END $$;
+
+        -- Token counter
+        CREATE TABLE IF NOT EXISTS counters (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL DEFAULT 100
+        );
+        INSERT INTO counters (name, value) VALUES ('order_token', 100) ON CONFLICT DO NOTHING;
+
+        -- Order token sequence (concurrency lock-free generation)
+        CREATE SEQUENCE IF NOT EXISTS order_token_seq START WITH 101;
+
+        -- Sync sequence with current max order token to prevent duplicates
+        DO $$
+        BEGIN
+            IF EXISTS (SELECT 1 FROM information_schema.tables WHERE table_name = 'orders') THEN
+                PERFORM setval('order_token_seq', COALESCE((SELECT MAX(NULLIF(regexp_replace(token, '\D', '', 'g'), '')::integer) FROM orders), 100) + 1, false);
+            END IF;
+        END $$;
+
+        -- Favorites
+        CREATE TABLE IF NOT EXISTS customer_favorites (
+            phone TEXT NOT NULL,
+            product_id INTEGER NOT NULL,
+            added_at TEXT NOT NULL,
+            PRIMARY KEY (phone, product_id)
+        );
+
+        -- Sorting Index for fast product retrieval (per-category rank ordering)
+        CREATE INDEX IF NOT EXISTS idx_products_sorting ON products (
+            category,
+            (CASE WHEN display_order > 0 THEN 0 ELSE 1 END),
+            display_order,
+            base_name,
+            price
+        );
+
+        -- Official categories table
+        CREATE TABLE IF NOT EXISTS official_categories (
+            name TEXT PRIMARY KEY,
+            emoji TEXT NOT NULL DEFAULT '📦',
+            color TEXT NOT NULL DEFAULT '#64748b',
+            display_order INTEGER NOT NULL DEFAULT 0
+        );
+
+        -- Seed official categories on a fresh database
+        INSERT INTO official_categories (name, emoji, color, display_order)
+        SELECT * FROM (VALUES
+            ('Atta, Rice & Dal', '🌾', '#f59e0b', 1),
+            ('Masala & Dry Fruits', '🌶️', '#ef4444', 2),
+            ('Snacks & Munchies', '🍿', '#8b5cf6', 3),
+            ('Sweet Tooth', '🍭', '#ec4899', 4),
+            ('Cleaning Essentials', '🧼', '#06b6d4', 5),
+            ('Instant & Frozen Food', '🍜', '#f97316', 6),
+            ('Dairy & Bread', '🥛', '#3b82f6', 7),
+            ('Personal Care', '💄', '#d946ef', 8),
+            ('Cold Drinks & Juices', '🥤', '#22c55e', 9),
+            ('Wellness', '💊', '#14b8a6', 10),
+            ('Tea, Coffee & Health Drinks', '☕', '#92400e', 11),
+            ('Home & Lifestyle', '🏠', '#0ea5e9', 12),
+            ('Pooja Needs', '🪔', '#eab308', 13),
+            ('Miscellaneous', '📦', '#64748b', 14)
+        ) AS defaults (name, emoji, color, display_order)
+        WHERE NOT EXISTS (SELECT 1 FROM official_categories);
+    """),
+    (2, "shared rate-limit and lockout tables", """
+        -- Shared rate-limit / lockout state (UNLOGGED: no WAL, lost on crash by design)
+        CREATE UNLOGGED TABLE IF NOT EXISTS rate_limits (
+            key TEXT PRIMARY KEY,
+            window_start BIGINT NOT NULL,
+            prev_count INTEGER NOT NULL DEFAULT 0,
+            curr_count INTEGER NOT NULL DEFAULT 0,
+            allowed BOOLEAN NOT NULL DEFAULT TRUE,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+        CREATE UNLOGGED TABLE IF NOT EXISTS login_lockouts (
+            key TEXT PRIMARY KEY,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            locked_until DOUBLE PRECISION NOT NULL DEFAULT 0,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+    """),
+    (3, "stock quantities and reservations", """
+        -- NULL stock_qty = quantity not tracked, in_stock stays a manual flag
+        ALTER TABLE products ADD COLUMN IF NOT EXISTS stock_qty INTEGER CHECK (stock_qty IS NULL OR stock_qty >= 0);
+
+        -- Stock held by open orders, released back on cancellation
+        CREATE TABLE IF NOT EXISTS stock_reservations (
+            order_token TEXT NOT NULL,
+            product_id INTEGER NOT NULL,
+            quantity INTEGER NOT NULL,
+            PRIMARY KEY (order_token, product_id)
+        );
+    """),
+    (4, "idempotency keys", """
+        -- Idempotency-Key replays for order placement (pruned after IDEMPOTENCY_TTL)
+        CREATE TABLE IF NOT EXISTS idempotency_keys (
+            phone TEXT NOT NULL,
+            key TEXT NOT NULL,
+            request_hash TEXT NOT NULL,
+            response_json TEXT,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            PRIMARY KEY (phone, key)
+        );
+    """),
+    (5, "job outbox", """
+        -- Transactional outbox for write-behind side effects (see jobs.py)
+        CREATE TABLE IF NOT EXISTS job_outbox (
+            id BIGSERIAL PRIMARY KEY,
+            kind TEXT NOT NULL,
+            partition_key TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            run_after TIMESTAMPTZ NOT NULL DEFAULT now(),
+            locked_until TIMESTAMPTZ,
+            failed_at TIMESTAMPTZ,
+            last_error TEXT,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+        CREATE INDEX IF NOT EXISTS idx_job_outbox_live ON job_outbox (partition_key, id) WHERE failed_at IS NULL;
+    """),
+    (6, "catalog version counter", """
+        -- Bumped by every statement that changes products. A sequence rather than a
+        -- counter row, so concurrent checkouts never queue on a single row lock.
+        CREATE SEQUENCE IF NOT EXISTS catalog_version_seq;
+        CREATE OR REPLACE FUNCTION bump_catalog_version() RETURNS trigger AS $$
+        BEGIN
+            PERFORM nextval('catalog_version_seq');
+            RETURN NULL;
+        END $$ LANGUAGE plpgsql;
+        DROP TRIGGER IF EXISTS products_catalog_version ON products;
+        CREATE TRIGGER products_catalog_version
+            AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON products
+            FOR EACH STATEMENT EXECUTE FUNCTION bump_catalog_version();
+    """),
+    (7, "customer preference profiles", """
+        -- Materialized recommendation inputs per customer, kept current by order and
+        -- favorite writes. A row is built from history on first read (database.py).
+        CREATE TABLE IF NOT EXISTS customer_profiles (
+            phone TEXT PRIMARY KEY,
+            category_weights JSONB NOT NULL DEFAULT '{}'::jsonb,
+            product_counts JSONB NOT NULL DEFAULT '{}'::jsonb,
+            order_count INTEGER NOT NULL DEFAULT 0,
+            last_order_at TEXT,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+        -- Adds delta's numbers into base key by key; keys that fall to zero are dropped
+        CREATE OR REPLACE FUNCTION jsonb_add_counts(base JSONB, delta JSONB) RETURNS JSONB AS $$
+            SELECT COALESCE(jsonb_object_agg(key, total), '{}'::jsonb)
+            FROM (
+                SELECT key, SUM(value::numeric) AS total
+                FROM (SELECT * FROM jsonb_each_text(base) UNION ALL SELECT * FROM jsonb_each_text(delta)) kv
+                GROUP BY key
+            ) sums
+            WHERE total > 0
+        $$ LANGUAGE sql IMMUTABLE;
+    """),
+    (8, "replenishment schedule", """
+        -- Per (customer, product) repurchase statistics, updated on every order
+        CREATE TABLE IF NOT EXISTS purchase_stats (
+            phone TEXT NOT NULL,
+            product_id INTEGER NOT NULL,
+            purchase_count INTEGER NOT NULL DEFAULT 1,
+            last_purchase_at TIMESTAMP NOT NULL,
+            ewma_interval_days REAL,
+            PRIMARY KEY (phone, product_id)
+        );
+        -- Due-soon reorder reminders, recomputed nightly from purchase_stats
+        CREATE TABLE IF NOT EXISTS reorder_due (
+            phone TEXT NOT NULL,
+            product_id INTEGER NOT NULL,
+            urgency REAL NOT NULL,
+            due_at TIMESTAMP NOT NULL,
+            PRIMARY KEY (phone, product_id)
+        );
+        -- Profiles are derived data: drop them so each is rebuilt, together with its
+        -- purchase stats, on first read or by the nightly refresh
+        DELETE FROM customer_profiles;
+    """),
+    (9, "catalog version on content changes only", """
+        -- The statement trigger of migration 6 bumped the sequence for zero-row
+        -- statements, for rolled-back ones (nextval is not transactional) and for every
+        -- checkout's stock decrement, forcing a full catalog reload each refresh tick.
+        -- Now: a counter row, bumped in the writing transaction and only when a row's
+        -- content other than stock_qty / in_stock changes. Stock levels are synced in
+        -- place by the refresh loop (database.sync_stock_levels). Checkouts no longer
+        -- touch the counter, so its row lock is only taken by catalog edits.
+        CREATE TABLE IF NOT EXISTS catalog_version (
+            id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+            version BIGINT NOT NULL
+        );
+        INSERT INTO catalog_version (version)
+            SELECT last_value + 1 FROM catalog_version_seq
+            ON CONFLICT (id) DO NOTHING;
+        CREATE OR REPLACE FUNCTION bump_catalog_version() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                IF NOT EXISTS (SELECT 1 FROM new_rows) THEN RETURN NULL; END IF;
+            ELSIF TG_OP = 'DELETE' THEN
+                IF NOT EXISTS (SELECT 1 FROM old_rows) THEN RETURN NULL; END IF;
+            ELSIF TG_OP = 'UPDATE' THEN
+                IF NOT EXISTS (
+                    SELECT to_jsonb(n) - 'stock_qty' - 'in_stock' FROM new_rows n
+                    EXCEPT
+                    SELECT to_jsonb(o) - 'stock_qty' - 'in_stock' FROM old_rows o
+                ) THEN RETURN NULL; END IF;
+            END IF;
+            UPDATE catalog_version SET version = version + 1;
+            RETURN NULL;
+        END $$ LANGUAGE plpgsql;
+        DROP TRIGGER IF EXISTS products_catalog_version ON products;
+        DROP TRIGGER IF EXISTS products_catalog_version_insert ON products;
+        DROP TRIGGER IF EXISTS products_catalog_version_update ON products;
+        DROP TRIGGER IF EXISTS products_catalog_version_delete ON products;
+        DROP TRIGGER IF EXISTS products_catalog_version_truncate ON products;
+        -- Transition tables allow one event per trigger
+        CREATE TRIGGER products_catalog_version_insert
+            AFTER INSERT ON products REFERENCING NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION bump_catalog_version();
+        CREATE TRIGGER products_catalog_version_update
+            AFTER UPDATE ON products REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION bump_catalog_version();
+        CREATE TRIGGER products_catalog_version_delete
+            AFTER DELETE ON products REFERENCING OLD TABLE AS old_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION bump_catalog_version();
+        CREATE TRIGGER products_catalog_version_truncate
+            AFTER TRUNCATE ON products
+            FOR EACH STATEMENT EXECUTE FUNCTION bump_catalog_version();
+        DROP SEQUENCE IF EXISTS catalog_version_seq;
+    """),
+]
+
+
+def migrate(cursor) -> list:
+    """Apply pending migrations with the caller's cursor. Returns the versions applied.
+
+    The caller owns the transaction: on error nothing is recorded and every
+    pending migration is retried on the next boot.
+    """
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+        SELECT COALESCE(MAX(version), 0) AS version FROM schema_migrations;
+    """)
+    if cursor.fetchone()["version"] >= MIGRATIONS[-1][0]:
+        return []
+
+    # Another worker may be migrating right now: wait for it, then re-check
+    cursor.execute("SELECT pg_advisory_xact_lock(%s)", (MIGRATION_LOCK_ID,))
+    cursor.execute("SELECT COALESCE(MAX(version), 0) AS version FROM schema_migrations")
+    current = cursor.fetchone()["version"]
+
+    applied = []
+    for version, name, sql in MIGRATIONS:
+        if version <= current:
+            continue
+        cursor.execute(sql)
+        cursor.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+        print(f"Applied migration {version:03d}: {name}")
+        applied.append(version)
+    return applied
@@ -92,6 +92,15 @@ class ProductOut(BaseModel):
     in_stock: bool = True
     is_newly_launched: bool = False
     display_order: int = 0
+    stock_qty: Optional[int] = None
+
+class HomeFeed(BaseModel):
+    """Home-screen widgets. Each product appears once in `products`; widgets list ids."""
+    products: List[ProductOut]
+    trending: List[int]
+    recommended: List[int]
+    reorder: List[int]
+    favorites: List[int]
 
 class ProductCreate(BaseModel):
     name: str = Field(..., min_length=1, max_length=100)
@@ -107,6 +116,7 @@ class ProductCreate(BaseModel):
     in_stock: bool = True
     is_newly_launched: bool = False
     display_order: int = 0
+    stock_qty: Optional[int] = Field(None, ge=0)
 
     @field_validator("name", "description", "category", "sub_category", "base_name", "unit")
     @classmethod
@@ -127,6 +137,7 @@ class ProductUpdate(BaseModel):
     in_stock: Optional[bool] = None
     is_newly_launched: Optional[bool] = None
     display_order: Optional[int] = None
+    stock_qty: Optional[int] = Field(None, ge=0)
 
     @field_validator("name", "description", "category", "sub_category", "base_name", "unit")
     @classmethod
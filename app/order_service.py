@@ -0,0 +1,312 @@
+# ============================================================
+# order_service.py — Single-Transaction Order Placement
+# ============================================================
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Optional
+
+from database import get_connection, release_connection, reserve_stock, apply_stock_levels, enqueue_jobs, apply_order_to_profile, record_purchases
+
+DELIVERY_FEE = 40.0
+FREE_DELIVERY_MIN = 1000.0
+MAX_CANCELS_PER_HOUR = 3
+
+# How long an Idempotency-Key keeps replaying the original response
+IDEMPOTENCY_TTL = int(os.getenv("IDEMPOTENCY_TTL", "86400"))
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "1024"))
+
+
+class OrderRejected(Exception):
+    """Order failed validation; carries the HTTP status and message for the client."""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+class _StageTimer:
+    def __init__(self):
+        self.timings = {}
+        self._start = self._last = time.perf_counter()
+
+    def mark(self, stage: str):
+        now = time.perf_counter()
+        self.timings[stage] = (now - self._last) * 1000
+        self._last = now
+
+    def finish(self) -> dict:
+        self.timings["total"] = (time.perf_counter() - self._start) * 1000
+        return self.timings
+
+
+# ── Idempotency ──────────────────────────────────────────
+# (phone, key) -> (stored_at, request_hash, response). Hot path for retries
+# that land on the same worker; the idempotency_keys table covers the rest.
+_replays: "OrderedDict[tuple, tuple]" = OrderedDict()
+_replays_lock = threading.Lock()
+
+# Claims the key inside the order transaction. A concurrent request with the
+# same key blocks on the unique index until this one commits or rolls back.
+# Expired keys are taken over instead of replayed.
+_CLAIM_SQL = """
+    INSERT INTO idempotency_keys (phone, key, request_hash)
+    VALUES (%s, %s, %s)
+    ON CONFLICT (phone, key) DO UPDATE SET
+        request_hash = EXCLUDED.request_hash, response_json = NULL, created_at = now()
+    WHERE idempotency_keys.created_at < now() - make_interval(secs => %s)
+    RETURNING key
+"""
+
+
+def _request_hash(items: list, expected_total: float, delivery_type: str, delivery_time: str, address: "Optional[str]", payment_method: str) -> str:
+    payload = json.dumps([sorted(items), expected_total, delivery_type, delivery_time, address, payment_method])
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _remember(phone: str, key: str, request_hash: str, response: dict):
+    with _replays_lock:
+        _replays[(phone, key)] = (time.time(), request_hash, response)
+        _replays.move_to_end((phone, key))
+        if len(_replays) > IDEMPOTENCY_CACHE_SIZE:
+            _replays.popitem(last=False)
+
+
+def _cached_replay(phone: str, key: str, request_hash: str) -> Optional[dict]:
+    with _replays_lock:
+        entry = _replays.get((phone, key))
+        if entry is None:
+            return None
+        if time.time() - entry[0] > IDEMPOTENCY_TTL:
+            del _replays[(phone, key)]
+            return None
+        _replays.move_to_end((phone, key))
+    return _check_replay(entry[1], request_hash, entry[2])
+
+
+def _check_replay(stored_hash: str, request_hash: str, response: dict) -> dict:
+    if stored_hash != request_hash:
+        raise OrderRejected(422, "Idempotency-Key was already used for a different order")
+    return response
+
+
+def prune_idempotency_keys():
+    """Delete expired keys from the table (run periodically)."""
+    conn = None
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM idempotency_keys WHERE created_at < now() - make_interval(secs => %s)", (IDEMPOTENCY_TTL,))
+        conn.commit()
+    except Exception as e:
+        print(f"Idempotency key cleanup failed: {e}")
+        if conn: conn.rollback()
+    finally:
+        if conn: release_connection(conn)
+
+
+def _recent_cancels(db_cust: dict, now: datetime) -> list:
+    """The customer's cancellations within the last hour, as ISO timestamps."""
+    try:
+        cancels = json.loads(db_cust.get("cancel_timestamps") or "[]")
+    except Exception:
+        cancels = []
+    one_hour_ago = now - timedelta(hours=1)
+    return [c for c in cancels if datetime.fromisoformat(c) > one_hour_ago]
+
+
+def _check_customer(cursor, phone: str) -> dict:
+    """Customer must exist and not be blocked for repeated cancellations.
+
+    Reads the row on the order's own transaction under FOR SHARE: a cancel
+    being recorded for this customer (an UPDATE of the row) is waited for,
+    so it always counts against the order that follows it.
+    """
+    cursor.execute("SELECT * FROM customers WHERE phone = %s FOR SHARE", (phone,))
+    db_cust = cursor.fetchone()
+    if not db_cust:
+        raise OrderRejected(404, "Customer not found")
+
+    recent_cancels = _recent_cancels(db_cust, datetime.now())
+
+    if len(recent_cancels) >= MAX_CANCELS_PER_HOUR:
+        raise OrderRejected(403, "Too many cancellations. You are blocked from placing new orders for 1 hour.")
+    # Old entries are pruned by the atomic cancel update, never by rewriting this copy
+    return db_cust
+
+
+def _price_items(rows: dict, items: list) -> tuple:
+    """Validate ordered items against locked product rows. Returns (validated_items, total)."""
+    validated_items = []
+    total = 0.0
+    wanted = {}
+    for product_id, quantity in items:
+        product = rows.get(product_id)
+        if product is None:
+            raise OrderRejected(400, "Product not found")
+        if not product["is_visible"]:
+            raise OrderRejected(400, f"Product '{product['name']}' is no longer available.")
+        if not product["in_stock"]:
+            raise OrderRejected(400, f"Product '{product['name']}' is out of stock.")
+        wanted[product_id] = wanted.get(product_id, 0) + quantity
+        if product["stock_qty"] is not None and wanted[product_id] > product["stock_qty"]:
+            raise OrderRejected(400, f"Only {product['stock_qty']} left of '{product['name']}'.")
+        subtotal = product["price"] * quantity
+        total += subtotal
+        validated_items.append({
+            "product_id": product_id,
+            "name": product["name"],
+            "price": product["price"],
+            "quantity": quantity,
+            "subtotal": subtotal,
+        })
+    return validated_items, total
+
+
+def place_order(phone: str, items: list, expected_total: float, delivery_type: str = "pickup", delivery_time: str = "same_day", address: "Optional[str]" = None, payment_method: str = "cod", idempotency_key: "Optional[str]" = None, save_address: bool = False) -> tuple:
+    """Verify and insert an order in a single transaction.
+
+    items is a list of (product_id, quantity). Prices, visibility and stock
+    are read from the ordered product rows under FOR NO KEY UPDATE (taken in
+    id order, so concurrent checkouts cannot deadlock), which lets the stock
+    check and the decrement happen without an admin edit or another order
+    slipping in between. Only the ordered rows are locked, plus the
+    customer's row FOR SHARE for the cancellation block. The order token
+    is drawn from the sequence inside the INSERT itself.
+
+    With an idempotency_key, a retry of an order that already committed gets
+    the original response back (result["replayed"] is True) without touching
+    the orders table; reusing a key for a different order raises 422.
+
+    Side effects (the new-order broadcast and, with save_address, saving the
+    address as the customer's home) are enqueued to the job outbox in the
+    same transaction and run after the response is sent.
+
+    Returns (result, timings) where timings maps stage -> milliseconds.
+    Raises OrderRejected when the order must not be placed.
+    """
+    timer = _StageTimer()
+    request_hash = None
+    if idempotency_key:
+        request_hash = _request_hash(items, expected_total, delivery_type, delivery_time, address, payment_method)
+        replay = _cached_replay(phone, idempotency_key, request_hash)
+        if replay is not None:
+            timer.mark("replay")
+            return {"replayed": True, "response": replay}, timer.finish()
+
+    jobs = []
+    if save_address and address:
+        jobs.append(("save_address", phone, {"phone": phone, "address": address}))
+
+    product_ids = sorted({pid for pid, _ in items})
+    conn = get_connection()
+    timer.mark("pool")
+    try:
+        cursor = conn.cursor()
+        if idempotency_key:
+            cursor.execute(_CLAIM_SQL, (phone, idempotency_key, request_hash, IDEMPOTENCY_TTL))
+            if cursor.fetchone() is None:
+                cursor.execute(
+                    "SELECT request_hash, response_json FROM idempotency_keys WHERE phone = %s AND key = %s",
+                    (phone, idempotency_key)
+                )
+                stored = cursor.fetchone()
+                conn.rollback()
+                replay = _check_replay(stored["request_hash"], request_hash, json.loads(stored["response_json"]))
+                _remember(phone, idempotency_key, request_hash, replay)
+                timer.mark("replay")
+                return {"replayed": True, "response": replay}, timer.finish()
+            timer.mark("claim")
+
+        # Customer row before product rows, the order cancel_order_for_customer locks them in
+        db_cust = _check_customer(cursor, phone)
+        if address is None:
+            address = db_cust.get("address")
+        timer.mark("customer")
+
+        cursor.execute(
+            "SELECT id, name, price, category, is_visible, in_stock, stock_qty FROM products WHERE id = ANY(%s) ORDER BY id FOR NO KEY UPDATE",
+            (product_ids,)
+        )
+        rows = {row["id"]: row for row in cursor.fetchall()}
+        timer.mark("lock")
+
+        validated_items, total = _price_items(rows, items)
+        if delivery_type == "delivery" and total < FREE_DELIVERY_MIN:
+            total += DELIVERY_FEE
+        if abs(total - expected_total) > 1.0:
+            raise OrderRejected(400, "Total mismatch")
+
+        # Payment status: UPI orders start as 'pending', COD orders as 'cod'
+        payment_status = "pending" if payment_method == "upi" else "cod"
+        # Delivery OTP: for UPI it's generated later by admin. For COD it's generated now.
+        delivery_otp = None
+        if delivery_type == "delivery" and payment_method == "cod":
+            delivery_otp = str(random.randint(1000, 9999))
+
+        placed_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        cursor.execute(
+            """
+            INSERT INTO orders (token, phone, items_json, status, total, timestamp, delivery_type, delivery_time, address, delivery_otp, payment_method, payment_status)
+            VALUES (nextval('order_token_seq')::text, %s, %s, 'Processing', %s, %s, %s, %s, %s, %s, %s, %s)
+            RETURNING token
+            """,
+            (phone, json.dumps(validated_items), total, placed_at, delivery_type, delivery_time, address, delivery_otp, payment_method, payment_status),
+        )
+        token = cursor.fetchone()["token"]
+        apply_order_to_profile(cursor, phone, validated_items, ordered_at=placed_at,
+                               categories={pid: row["category"] for pid, row in rows.items()})
+        record_purchases(cursor, phone, [item["product_id"] for item in validated_items], placed_at)
+        timer.mark("insert")
+
+        tracked = {}
+        for item in validated_items:
+            if rows[item["product_id"]]["stock_qty"] is not None:
+                tracked[item["product_id"]] = tracked.get(item["product_id"], 0) + item["quantity"]
+        levels = reserve_stock(cursor, token, tracked)
+        timer.mark("stock")
+
+        response = {"token": token, "total": total, "status": "Processing", "payment_method": payment_method}
+        if delivery_otp:
+            response["delivery_otp"] = delivery_otp
+        if idempotency_key:
+            cursor.execute(
+                "UPDATE idempotency_keys SET response_json = %s WHERE phone = %s AND key = %s",
+                (json.dumps(response), phone, idempotency_key)
+            )
+
+        jobs.append(("broadcast", phone, {
+            "type": "new_order",
+            "token": token,
+            "customer_name": db_cust.get("name") or "Anonymous User",
+            "phone": phone,
+        }))
+        enqueue_jobs(cursor, jobs)
+
+        conn.commit()
+        timer.mark("commit")
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        release_connection(conn)
+
+    apply_stock_levels(levels)
+    if idempotency_key:
+        _remember(phone, idempotency_key, request_hash, response)
+    result = {
+        "replayed": False,
+        "response": response,
+        "token": token,
+        "total": total,
+        "delivery_otp": delivery_otp,
+        "customer": db_cust,
+        "items": validated_items,
+    }
+    return result, timer.finish()
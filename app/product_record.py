@@ -0,0 +1,76 @@
+# ============================================================
+# product_record.py — Compact Product Rows for the Catalog Cache
+# ============================================================
+# Every worker holds the whole catalog in memory. A plain dict per product
+# carries a hash table sized for its 15 keys; a slotted object stores the
+# same values in a fixed array, and interning the category, sub-category,
+# unit and image URL strings (placeholder images repeat) makes the
+# thousands of rows share one copy of each.
+# ProductRecord is a read-mostly Mapping, so existing p['id'] / p.get(...)
+# code, dict(p) and pydantic validation into ProductOut keep working.
+import sys
+from collections.abc import Mapping
+from operator import attrgetter
+
+# Columns of the products table, in table order (also the ProductOut fields)
+FIELDS = (
+    'id', 'name', 'price', 'mrp', 'description', 'image_url', 'category', 'sub_category',
+    'base_name', 'unit', 'is_visible', 'in_stock', 'is_newly_launched', 'display_order', 'stock_qty',
+)
+_FIELD_SET = frozenset(FIELDS)
+_values = attrgetter(*FIELDS)
+# Text columns whose values repeat across many rows
+_INTERNED = ('category', 'sub_category', 'unit', 'image_url')
+
+
+class ProductRecord(Mapping):
+    """One catalog row. Keys are fixed to FIELDS; values can be updated in place."""
+
+    __slots__ = FIELDS
+
+    def __init__(self, row: Mapping):
+        for field in FIELDS:
+            setattr(self, field, row.get(field))
+        for field in _INTERNED:
+            value = getattr(self, field)
+            if isinstance(value, str):
+                setattr(self, field, sys.intern(value))
+
+    def __getitem__(self, key):
+        if key in _FIELD_SET:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        # Overridden: Mapping.get goes through __getitem__ and an exception per miss
+        return getattr(self, key) if key in _FIELD_SET else default
+
+    def __iter__(self):
+        return iter(FIELDS)
+
+    def __len__(self):
+        return len(FIELDS)
+
+    def __contains__(self, key):
+        return key in _FIELD_SET
+
+    def __setitem__(self, key, value):
+        if key not in _FIELD_SET:
+            raise KeyError(key)
+        setattr(self, key, sys.intern(value) if key in _INTERNED and isinstance(value, str) else value)
+
+    def as_dict(self) -> dict:
+        """A plain dict copy; much faster than dict(record) (no per-key __getitem__)."""
+        return dict(zip(FIELDS, _values(self)))
+
+    def update(self, updates: Mapping):
+        for key, value in updates.items():
+            self[key] = value
+
+    def __repr__(self):
+        return f"ProductRecord(id={self.id!r}, name={self.name!r})"
+
+
+def from_rows(rows) -> list:
+    """ProductRecords for an iterable of row mappings (cursor rows, snapshot dicts)."""
+    return [ProductRecord(row) for row in rows]
@@ -0,0 +1,104 @@
+# ============================================================
+# profiling.py — On-Demand CPU Sampling and Allocation Profiles
+# ============================================================
+# Nothing here runs until an admin asks for a profile: no tracing hooks,
+# no background thread. A profile is time-bounded and only one may run at a
+# time per process.
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+MAX_PROFILE_SECONDS = 60
+# Leaf frames in these modules mean the thread is parked, not burning CPU
+_IDLE_MODULES = ("threading.py", "selectors.py", "queue.py", "socket.py", "ssl.py", "thread.py")
+
+_busy = threading.Lock()
+
+
+class ProfilerBusy(Exception):
+    """Raised when another profile is already running in this process."""
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{getattr(code, 'co_qualname', code.co_name)} ({os.path.basename(code.co_filename)})"
+
+
+def _is_idle(frame) -> bool:
+    return os.path.basename(frame.f_code.co_filename) in _IDLE_MODULES
+
+
+def sample_cpu(seconds: float, interval: float = 0.005, include_idle: bool = False) -> str:
+    """Sample every thread's stack for `seconds` and return collapsed stacks.
+
+    Output is one "thread;outer;...;inner count" line per distinct stack,
+    the format flamegraph.pl, speedscope and inferno read directly.
+    Blocks the calling thread for the duration; call it via asyncio.to_thread.
+    """
+    if not _busy.acquire(blocking=False):
+        raise ProfilerBusy()
+    try:
+        seconds = min(max(seconds, 0.1), MAX_PROFILE_SECONDS)
+        own_ident = threading.get_ident()
+        counts = {}
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident or (not include_idle and _is_idle(frame)):
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                stack.append(names.get(ident, f"thread-{ident}"))
+                key = ";".join(reversed(stack))
+                counts[key] = counts.get(key, 0) + 1
+            time.sleep(interval)
+        return "\n".join(f"{stack} {n}" for stack, n in sorted(counts.items(), key=lambda kv: -kv[1])) + "\n"
+    finally:
+        _busy.release()
+
+
+def allocation_snapshot(seconds: float, top: int = 25, frames: int = 1) -> dict:
+    """Trace allocations for `seconds` and return the top-N sites by size still allocated.
+
+    tracemalloc is started only for the window (unless it was already on) and
+    stopped afterwards, so allocations cost nothing extra once it returns.
+    """
+    if not _busy.acquire(blocking=False):
+        raise ProfilerBusy()
+    started_here = False
+    try:
+        seconds = min(max(seconds, 0.1), MAX_PROFILE_SECONDS)
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(max(1, frames))
+            started_here = True
+        time.sleep(seconds)
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ))
+        traced, peak = tracemalloc.get_traced_memory()
+    finally:
+        if started_here:
+            tracemalloc.stop()
+        _busy.release()
+
+    key_type = "traceback" if frames > 1 else "lineno"
+    stats = snapshot.statistics(key_type)[:top]
+    return {
+        "seconds": seconds,
+        "traced_kb": round(traced / 1024, 1),
+        "peak_kb": round(peak / 1024, 1),
+        "top": [
+            {
+                "site": ";".join(f"{os.path.basename(f.filename)}:{f.lineno}" for f in reversed(stat.traceback)),
+                "size_kb": round(stat.size / 1024, 1),
+                "count": stat.count,
+            }
+            for stat in stats
+        ],
+    }
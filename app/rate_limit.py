@@ -0,0 +1,304 @@
+# ============================================================
+# rate_limit.py — Sliding-Window Counter Rate Limiter
+# ============================================================
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from database import get_connection, release_connection
+
+
+class SlidingWindowLimiter:
+    """Approximate sliding-window limiter with fixed-size state per key.
+
+    Each key keeps only [window_start, previous_count, current_count]. The
+    request count over the trailing window is estimated by weighting the
+    previous fixed window by how much of it still overlaps the sliding one,
+    so every check is O(1) regardless of the limit size.
+
+    Keys are kept in LRU order and the least recently used ones are evicted
+    once max_keys is reached, so memory stays bounded under an IP-spraying
+    attack without resetting every other client's counters.
+    """
+
+    def __init__(self, max_keys: int = 10000):
+        self.max_keys = max_keys
+        self._entries: "OrderedDict[str, list]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def hit(self, key: str, limit: int, window: int, now: "float | None" = None) -> bool:
+        """Record a request for key. Returns False if it exceeds the limit."""
+        if now is None:
+            now = time.time()
+        window_start = int(now // window) * window
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = [window_start, 0, 0]
+                self._entries[key] = entry
+                if len(self._entries) > self.max_keys:
+                    self._entries.popitem(last=False)
+            else:
+                self._entries.move_to_end(key)
+                if entry[0] != window_start:
+                    # Roll the window: the old current window becomes "previous"
+                    # only if it is the one immediately before this window.
+                    entry[1] = entry[2] if window_start - entry[0] == window else 0
+                    entry[2] = 0
+                    entry[0] = window_start
+
+            overlap = 1.0 - (now - window_start) / window
+            if entry[1] * overlap + entry[2] >= limit:
+                return False
+            entry[2] += 1
+            return True
+
+    def prune(self, max_age: int = 3600, now: "float | None" = None) -> int:
+        """Drop keys idle for longer than max_age seconds. Returns the number removed."""
+        if now is None:
+            now = time.time()
+        removed = 0
+        with self._lock:
+            # Entries are in LRU order, so stop at the first recently used one.
+            while self._entries:
+                key, entry = next(iter(self._entries.items()))
+                if now - entry[0] < max_age:
+                    break
+                self._entries.popitem(last=False)
+                removed += 1
+        return removed
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class MemoryBackend:
+    """Per-process rate-limit and login-lockout state (single-worker deployments)."""
+
+    def __init__(self, max_keys: int = 10000):
+        self.limiter = SlidingWindowLimiter(max_keys=max_keys)
+        self._lockouts: dict = {}
+        self._lock = threading.Lock()
+
+    def hit(self, key: str, limit: int, window: int) -> bool:
+        return self.limiter.hit(key, limit, window)
+
+    def get_lockout(self, key: str) -> float:
+        """Return the epoch time the key is locked until (0 if never locked)."""
+        with self._lock:
+            info = self._lockouts.get(key)
+            return info["locked_until"] if info else 0
+
+    def record_failure(self, key: str, max_attempts: int, lockout_seconds: int):
+        """Count a failed attempt. Returns (attempts, locked_until)."""
+        now = time.time()
+        with self._lock:
+            info = self._lockouts.setdefault(key, {"attempts": 0, "locked_until": 0, "updated": now})
+            info["attempts"] += 1
+            info["updated"] = now
+            if info["attempts"] >= max_attempts:
+                info["locked_until"] = now + lockout_seconds
+            return info["attempts"], info["locked_until"]
+
+    def clear_failures(self, key: str):
+        with self._lock:
+            self._lockouts.pop(key, None)
+
+    def prune(self):
+        now = time.time()
+        self.limiter.prune(max_age=3600, now=now)
+        with self._lock:
+            stale = [k for k, v in self._lockouts.items() if v["locked_until"] < now and now - v["updated"] > 86400]
+            for k in stale:
+                self._lockouts.pop(k, None)
+
+
+# Applies one hit to the shared sliding-window row in a single statement.
+# %(pending)s hits were already admitted locally, in the window starting at
+# %(pending_window)s, and are always counted: into the current window, into the
+# previous one if they were admitted before the roll, or not at all if older.
+# The current hit is only counted when the estimate is still under the limit.
+_PENDING_PREV = "CASE WHEN %(pending_window)s = %(window_start)s - %(window)s THEN %(pending)s ELSE 0 END"
+_PENDING_CURR = "CASE WHEN %(pending_window)s = %(window_start)s THEN %(pending)s ELSE 0 END"
+_PREV = f"CASE WHEN r.window_start = EXCLUDED.window_start THEN r.prev_count WHEN r.window_start = EXCLUDED.window_start - %(window)s THEN r.curr_count ELSE 0 END + {_PENDING_PREV}"
+_CURR = f"CASE WHEN r.window_start = EXCLUDED.window_start THEN r.curr_count ELSE 0 END + {_PENDING_CURR}"
+_ALLOWED = f"(({_PREV}) * %(overlap)s + ({_CURR}) < %(limit)s)"
+_NEW_ALLOWED = f"(({_PENDING_PREV}) * %(overlap)s + ({_PENDING_CURR}) < %(limit)s)"
+_HIT_SQL = f"""
+    INSERT INTO rate_limits AS r (key, window_start, prev_count, curr_count, allowed, updated_at)
+    VALUES (%(key)s, %(window_start)s, {_PENDING_PREV}, {_PENDING_CURR} + CASE WHEN {_NEW_ALLOWED} THEN 1 ELSE 0 END, {_NEW_ALLOWED}, now())
+    ON CONFLICT (key) DO UPDATE SET
+        prev_count = {_PREV},
+        curr_count = {_CURR} + CASE WHEN {_ALLOWED} THEN 1 ELSE 0 END,
+        allowed = {_ALLOWED},
+        window_start = EXCLUDED.window_start,
+        updated_at = now()
+    RETURNING prev_count, curr_count, allowed
+"""
+
+_FAILURE_SQL = """
+    INSERT INTO login_lockouts AS l (key, attempts, locked_until, updated_at)
+    VALUES (%(key)s, 1, CASE WHEN %(max_attempts)s <= 1 THEN %(lock_until)s ELSE 0 END, now())
+    ON CONFLICT (key) DO UPDATE SET
+        attempts = l.attempts + 1,
+        locked_until = CASE WHEN l.attempts + 1 >= %(max_attempts)s THEN %(lock_until)s ELSE l.locked_until END,
+        updated_at = now()
+    RETURNING attempts, locked_until
+"""
+
+
+class PostgresBackend:
+    """Rate-limit and lockout state shared by every worker through Postgres.
+
+    Each check is one UPSERT against an UNLOGGED table (no WAL, so it is cheap
+    and the counters are simply lost on a crash, which is fine for limits).
+    To skip the round trip for clients that are clearly under their limit,
+    each worker may admit a small local budget of requests between syncs:
+    a 1/WEB_CONCURRENCY share of LOCAL_FRACTION of the headroom seen at the
+    last sync. Those locally admitted hits are flushed with the next UPSERT,
+    so every hit is counted, but a worker's estimate can be stale: all
+    workers together may overshoot the shared limit by at most
+    LOCAL_FRACTION of it. Scopes with a limit below LOCAL_MIN_LIMIT
+    (e.g. 5 logins/min) get no local budget, always sync, and are exact.
+    """
+
+    LOCAL_FRACTION = float(os.getenv("RATE_LIMIT_LOCAL_FRACTION", "0.5"))
+    LOCAL_MIN_LIMIT = int(os.getenv("RATE_LIMIT_LOCAL_MIN_LIMIT", "20"))
+
+    def __init__(self, max_keys: int = 10000):
+        self.workers = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+        self.fallback = MemoryBackend(max_keys=max_keys)
+        # key -> [window_start, synced_estimate, pending, in_flight]; pending hits were admitted
+        # in window_start, in_flight ones are being flushed
+        self._local: "OrderedDict[str, list]" = OrderedDict()
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+
+    def hit(self, key: str, limit: int, window: int) -> bool:
+        now = time.time()
+        window_start = int(now // window) * window
+        overlap = 1.0 - (now - window_start) / window
+
+        with self._lock:
+            state = self._local.get(key)
+            if state is not None and state[0] == window_start and limit >= self.LOCAL_MIN_LIMIT:
+                budget = (limit - state[1]) * self.LOCAL_FRACTION / self.workers
+                if state[2] + state[3] + 1 <= budget:
+                    state[2] += 1
+                    self._local.move_to_end(key)
+                    return True
+            # Claim the pending hits for this sync, so a concurrent sync cannot flush them too
+            pending, pending_window = 0, window_start
+            if state is not None:
+                pending, pending_window, state[2] = state[2], state[0], 0
+                state[3] += pending
+
+        conn = None
+        try:
+            conn = get_connection()
+            cursor = conn.cursor()
+            cursor.execute(_HIT_SQL, {
+                "key": key, "window_start": window_start, "window": window,
+                "pending": pending, "pending_window": pending_window, "overlap": overlap, "limit": limit,
+            })
+            row = cursor.fetchone()
+            conn.commit()
+        except Exception as e:
+            print(f"Shared rate limit check failed, using local limiter: {e}")
+            if conn: conn.rollback()
+            with self._lock:
+                # Not flushed: hand the claimed hits back for the next sync (if still the same window)
+                state = self._local.get(key)
+                if state is not None:
+                    state[3] -= pending
+                    if state[0] == pending_window:
+                        state[2] += pending
+            return self.fallback.hit(key, limit, window)
+        finally:
+            if conn: release_connection(conn)
+
+        with self._lock:
+            # Keep hits admitted or claimed by other syncs meanwhile; they are not in row yet.
+            # Hits admitted in another window cannot be carried under this one's tag: dropped.
+            state = self._local.get(key)
+            unflushed, in_flight = (state[2], state[3] - pending) if state is not None else (0, 0)
+            if state is not None and state[0] != window_start:
+                unflushed = 0
+            self._local[key] = [window_start, row["prev_count"] * overlap + row["curr_count"], unflushed, max(in_flight, 0)]
+            self._local.move_to_end(key)
+            if len(self._local) > self.max_keys:
+                self._local.popitem(last=False)
+        return bool(row["allowed"])
+
+    def get_lockout(self, key: str) -> float:
+        conn = None
+        try:
+            conn = get_connection()
+            cursor = conn.cursor()
+            cursor.execute("SELECT locked_until FROM login_lockouts WHERE key = %s", (key,))
+            row = cursor.fetchone()
+            conn.commit()
+            return row["locked_until"] if row else 0
+        except Exception as e:
+            print(f"Shared lockout lookup failed, using local state: {e}")
+            if conn: conn.rollback()
+            return self.fallback.get_lockout(key)
+        finally:
+            if conn: release_connection(conn)
+
+    def record_failure(self, key: str, max_attempts: int, lockout_seconds: int):
+        conn = None
+        try:
+            conn = get_connection()
+            cursor = conn.cursor()
+            cursor.execute(_FAILURE_SQL, {
+                "key": key, "max_attempts": max_attempts, "lock_until": time.time() + lockout_seconds,
+            })
+            row = cursor.fetchone()
+            conn.commit()
+            return row["attempts"], row["locked_until"]
+        except Exception as e:
+            print(f"Shared lockout update failed, using local state: {e}")
+            if conn: conn.rollback()
+            return self.fallback.record_failure(key, max_attempts, lockout_seconds)
+        finally:
+            if conn: release_connection(conn)
+
+    def clear_failures(self, key: str):
+        self.fallback.clear_failures(key)
+        conn = None
+        try:
+            conn = get_connection()
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM login_lockouts WHERE key = %s", (key,))
+            conn.commit()
+        except Exception as e:
+            print(f"Shared lockout reset failed: {e}")
+            if conn: conn.rollback()
+        finally:
+            if conn: release_connection(conn)
+
+    def prune(self):
+        self.fallback.prune()
+        conn = None
+        try:
+            conn = get_connection()
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM rate_limits WHERE updated_at < now() - interval '1 hour'")
+            cursor.execute("DELETE FROM login_lockouts WHERE updated_at < now() - interval '1 day' AND locked_until < extract(epoch FROM now())")
+            conn.commit()
+        except Exception as e:
+            print(f"Rate limit cleanup failed: {e}")
+            if conn: conn.rollback()
+        finally:
+            if conn: release_connection(conn)
+
+
+def create_backend():
+    """Pick the limiter/lockout store from RATE_LIMIT_BACKEND (memory | postgres)."""
+    max_keys = int(os.getenv("RATE_LIMIT_MAX_KEYS", "10000"))
+    if os.getenv("RATE_LIMIT_BACKEND", "memory").lower() == "postgres":
+        return PostgresBackend(max_keys=max_keys)
+    return MemoryBackend(max_keys=max_keys)
@@ -0,0 +1,153 @@
+# ============================================================
+# rec_artifacts.py — Versioned Recommendation Model Artifacts
+# ============================================================
+# Written offline by scripts/train_recommendations.py, memory-mapped here.
+# Layout (little-endian, every array 8-byte aligned):
+#   header:  magic | version | meta offset | meta length
+#   tables:  per table: int64 keys (sorted) | uint32 offsets (count + 1) | int32 values
+#   meta:    JSON: created_at, params, category popularity, table index
+# A table maps an integer key (product id, or a customer phone as a number) to
+# a ranked list of product ids. Lookups binary-search the mapped keys, so
+# nothing is decoded up front and the OS shares pages between workers.
+# RECS_DIR/CURRENT names the live file; it is replaced atomically, and each
+# worker swaps to the new file on its next refresh() without a restart.
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+from array import array
+from bisect import bisect_left
+from typing import Optional
+
+RECS_DIR = os.getenv("RECS_DIR") or os.path.join(os.path.dirname(__file__), ".cache", "recs")
+POINTER_NAME = "CURRENT"
+
+_MAGIC = b"KGSREC01"
+_HEADER = struct.Struct("<8sqQQ")
+
+
+def _pad(n: int) -> int:
+    return (8 - n % 8) % 8
+
+
+class RecArtifact:
+    """One mapped artifact file. Safe to share between threads (read-only)."""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.version, meta_offset, meta_len = _HEADER.unpack_from(self._mm, 0)
+        if magic != _MAGIC or meta_offset + meta_len != len(self._mm):
+            raise ValueError(f"{path} is not a recommendation artifact")
+        meta = json.loads(self._mm[meta_offset:meta_offset + meta_len])
+        self.path = path
+        self.created_at = meta.get("created_at")
+        self.params = meta.get("params", {})
+        self.category_popular = meta.get("category_popular", {})
+        view = memoryview(self._mm)
+        self._tables = {}
+        for name, t in meta["tables"].items():
+            start, count, total = t["offset"], t["count"], t["values"]
+            keys_end = start + 8 * count
+            offsets_end = keys_end + 4 * (count + 1)
+            values_start = offsets_end + _pad(offsets_end)
+            self._tables[name] = (
+                view[start:keys_end].cast("q"),
+                view[keys_end:offsets_end].cast("I"),
+                view[values_start:values_start + 4 * total].cast("i"),
+            )
+
+    def lookup(self, table: str, key: int) -> list:
+        """Ranked product ids for key, or [] if the table or key is absent."""
+        entry = self._tables.get(table)
+        if entry is None:
+            return []
+        keys, offsets, values = entry
+        i = bisect_left(keys, key)
+        if i == len(keys) or keys[i] != key:
+            return []
+        return values[offsets[i]:offsets[i + 1]].tolist()
+
+    def tables(self) -> dict:
+        return {name: len(keys) for name, (keys, _, _) in self._tables.items()}
+
+
+def write(directory: str, version: int, tables: dict, meta: dict) -> str:
+    """Write an artifact and make it current. tables: {name: {int key: [product ids]}}.
+
+    The file is written under a temporary name and renamed, then the CURRENT
+    pointer is replaced the same way, so readers never see a partial file.
+    """
+    buf = bytearray(_HEADER.size)
+    index = {}
+    for name, mapping in tables.items():
+        keys = sorted(mapping)
+        offsets, values = array("I", [0]), array("i")
+        for key in keys:
+            values.extend(mapping[key])
+            offsets.append(len(values))
+        index[name] = {"offset": len(buf), "count": len(keys), "values": len(values)}
+        for part in (array("q", keys), offsets, values):
+            if sys.byteorder != "little":
+                part.byteswap()
+            buf += part.tobytes()
+            buf += bytes(_pad(len(buf)))
+    meta_bytes = json.dumps(dict(meta, tables=index)).encode()
+    _HEADER.pack_into(buf, 0, _MAGIC, version, len(buf), len(meta_bytes))
+    buf += meta_bytes
+
+    os.makedirs(directory, exist_ok=True)
+    name = f"recs-{version}.bin"
+    tmp = os.path.join(directory, f".{name}.tmp")
+    with open(tmp, "wb") as f:
+        f.write(buf)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, os.path.join(directory, name))
+    pointer_tmp = os.path.join(directory, f".{POINTER_NAME}.tmp")
+    with open(pointer_tmp, "w") as f:
+        f.write(name)
+    os.replace(pointer_tmp, os.path.join(directory, POINTER_NAME))
+    return os.path.join(directory, name)
+
+
+# ── Live artifact (per process) ──────────────────────────
+
+_current: Optional[RecArtifact] = None
+_current_name: Optional[str] = None
+_lock = threading.Lock()
+
+
+def current() -> Optional[RecArtifact]:
+    """The artifact in use, or None when no model has been trained yet."""
+    return _current
+
+
+def refresh(directory: str = RECS_DIR) -> bool:
+    """Swap to the file CURRENT points at if it changed. Returns True on a swap.
+
+    Requests already holding the previous artifact finish with it; its
+    mapping is released once the last reference goes away.
+    """
+    global _current, _current_name
+    try:
+        with open(os.path.join(directory, POINTER_NAME)) as f:
+            name = f.read().strip()
+    except FileNotFoundError:
+        return False
+    if name == _current_name:
+        return False
+    with _lock:
+        if name == _current_name:
+            return False
+        try:
+            artifact = RecArtifact(os.path.join(directory, name))
+        except Exception as e:
+            print(f"Recommendation artifact {name} could not be loaded: {e}")
+            _current_name = name  # don't retry a broken file every refresh
+            return False
+        _current, _current_name = artifact, name
+    print(f"Recommendation model v{artifact.version} loaded ({artifact.tables()}).")
+    return True
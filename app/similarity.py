@@ -0,0 +1,172 @@
+# ============================================================
+# similarity.py — Precomputed Similar-Products Index
+# ============================================================
+# Products are TF-IDF vectors over their title: word tokens, character
+# trigrams of those words (catch abbreviations like "Liq." / "Liquid") and
+# the brand (first word of the name). Cosine similarity is computed through
+# an inverted index restricted to the product's category, plus a boost for a
+# matching sub-category. The top-K neighbors of every product are kept, so
+# serving is a dict lookup; when a few products change only they and the
+# lists they appear in are recomputed.
+import heapq
+import math
+import re
+import threading
+
+NEIGHBORS_K = 24
+SUB_CATEGORY_BOOST = 0.25
+TRIGRAM_WEIGHT = 0.5
+BRAND_WEIGHT = 0.5
+# Past this share of products changed since the last full build, rebuild
+# (IDF weights are frozen between full builds)
+FULL_REBUILD_FRACTION = 0.05
+
+_WORD_RE = re.compile(r"[a-z]+|[0-9]+")
+
+
+def _signature(p: dict) -> tuple:
+    """The fields a product's vector and neighbors depend on."""
+    return (p.get('name') or '', p.get('base_name') or '', p.get('category') or '', p.get('sub_category') or '')
+
+
+def _term_counts(p: dict) -> dict:
+    tf = {}
+    title = (p.get('base_name') or p.get('name') or '').lower()
+    for word in _WORD_RE.findall(title):
+        if word.isdigit():
+            continue  # pack sizes and counts say nothing about the product
+        tf['w:' + word] = tf.get('w:' + word, 0.0) + 1.0
+        padded = f" {word} "
+        for i in range(len(padded) - 2):
+            gram = 'c:' + padded[i:i + 3]
+            tf[gram] = tf.get(gram, 0.0) + TRIGRAM_WEIGHT
+    name_words = _WORD_RE.findall((p.get('name') or '').lower())
+    if name_words:
+        tf['b:' + name_words[0]] = tf.get('b:' + name_words[0], 0.0) + BRAND_WEIGHT
+    return tf
+
+
+class SimilarityIndex:
+    """Top-K similar products per product id. Reads are lock-free: neighbor
+    lists are replaced, never mutated, so readers always see a whole list."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._signatures = {}   # pid -> signature the vector was built from
+        self._groups = {}       # pid -> (category, sub_category)
+        self._members = {}      # category or (category, sub_category) -> set of pids
+        self._vectors = {}      # pid -> {term: weight}, L2-normalized
+        self._postings = {}     # (category, term) -> {pid: weight}
+        self._idf = {}
+        self._unseen_idf = 1.0
+        self._neighbors = {}    # pid -> [(score, pid)], best first
+        self._changed_since_build = 0
+        self._source = None
+
+    def neighbors(self, product_id: int) -> list:
+        """Neighbor ids, most similar first."""
+        return [pid for _, pid in self._neighbors.get(product_id, ())]
+
+    def sync(self, products: list, source_key=None) -> str:
+        """Bring the index in line with `products`. source_key identifies the
+        list's state (e.g. its cache generation) so unchanged lists cost nothing.
+        Returns "current", "updated" or "rebuilt"."""
+        if source_key is not None and source_key == self._source:
+            return "current"
+        with self._lock:
+            if source_key is not None and source_key == self._source:
+                return "current"
+            current = {p['id']: p for p in products}
+            changed = [p for pid, p in current.items() if self._signatures.get(pid) != _signature(p)]
+            removed = [pid for pid in self._signatures if pid not in current]
+            outcome = "current"
+            if not self._signatures or self._changed_since_build + len(changed) + len(removed) > FULL_REBUILD_FRACTION * len(current):
+                self._build(products)
+                outcome = "rebuilt"
+            elif changed or removed:
+                for pid in removed:
+                    self._remove(pid)
+                for p in changed:
+                    if p['id'] in self._signatures:
+                        self._remove(p['id'])
+                    self._add(p)
+                self._changed_since_build += len(changed) + len(removed)
+                outcome = "updated"
+            self._source = source_key
+            return outcome
+
+    # ── Internals (called with the lock held) ─────────────
+
+    def _build(self, products: list):
+        counts = {p['id']: _term_counts(p) for p in products}
+        df = {}
+        for tf in counts.values():
+            for term in tf:
+                df[term] = df.get(term, 0) + 1
+        n = len(products)
+        self._idf = {term: math.log((1 + n) / (1 + d)) + 1 for term, d in df.items()}
+        self._unseen_idf = math.log(1 + n) + 1
+        self._signatures, self._groups, self._members = {}, {}, {}
+        self._vectors, self._postings = {}, {}
+        for p in products:
+            self._index(p, counts[p['id']])
+        self._neighbors = {pid: self._top(self._scores(pid)) for pid in self._vectors}
+        self._changed_since_build = 0
+
+    def _index(self, p: dict, tf: dict):
+        pid = p['id']
+        category, sub_category = p.get('category') or '', p.get('sub_category') or ''
+        weights = {term: count * self._idf.get(term, self._unseen_idf) for term, count in tf.items()}
+        norm = math.sqrt(sum(w * w for w in weights.values())) or 1.0
+        vector = {term: w / norm for term, w in weights.items()}
+        self._signatures[pid] = _signature(p)
+        self._groups[pid] = (category, sub_category)
+        self._members.setdefault(category, set()).add(pid)
+        if sub_category:
+            self._members.setdefault((category, sub_category), set()).add(pid)
+        self._vectors[pid] = vector
+        for term, w in vector.items():
+            self._postings.setdefault((category, term), {})[pid] = w
+
+    def _scores(self, pid: int) -> dict:
+        """Similarity of pid to every related product in its category."""
+        category, sub_category = self._groups[pid]
+        scores = {}
+        for term, w in self._vectors[pid].items():
+            for other, ow in self._postings[(category, term)].items():
+                scores[other] = scores.get(other, 0.0) + w * ow
+        if sub_category:
+            for other in self._members[(category, sub_category)]:
+                scores[other] = scores.get(other, 0.0) + SUB_CATEGORY_BOOST
+        scores.pop(pid, None)
+        return scores
+
+    @staticmethod
+    def _top(scores: dict) -> list:
+        # Ties go to the lower id so results are stable across rebuilds
+        return [(score, pid) for pid, score in heapq.nsmallest(NEIGHBORS_K, scores.items(), key=lambda kv: (-kv[1], kv[0]))]
+
+    def _remove(self, pid: int):
+        category, sub_category = self._groups.pop(pid)
+        for term in self._vectors.pop(pid):
+            self._postings[(category, term)].pop(pid, None)
+        self._members[category].discard(pid)
+        if sub_category:
+            self._members[(category, sub_category)].discard(pid)
+        del self._signatures[pid]
+        self._neighbors.pop(pid, None)
+        # Lists that held pid lose a slot; recompute them so they stay K long
+        for other in self._members[category]:
+            if any(n == pid for _, n in self._neighbors.get(other, ())):
+                self._neighbors[other] = self._top(self._scores(other))
+
+    def _add(self, p: dict):
+        pid = p['id']
+        self._index(p, _term_counts(p))
+        scores = self._scores(pid)
+        self._neighbors[pid] = self._top(scores)
+        # Similarity is symmetric: pid may now belong in the lists of the products it scored against
+        for other, score in scores.items():
+            current = self._neighbors.get(other, [])
+            if len(current) < NEIGHBORS_K or (score, -pid) > (current[-1][0], -current[-1][1]):
+                self._neighbors[other] = sorted(current + [(score, pid)], key=lambda sp: (-sp[0], sp[1]))[:NEIGHBORS_K]
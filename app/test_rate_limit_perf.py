@@ -0,0 +1,51 @@
+import time
+
+from rate_limit import SlidingWindowLimiter
+
+
+class ListTimestampLimiter:
+    """The previous implementation: a list of timestamps per key, filtered on every call."""
+
+    def __init__(self):
+        self.store = {}
+
+    def hit(self, key, limit, window, now):
+        if len(self.store) > 10000:
+            self.store.clear()
+        if key not in self.store:
+            self.store[key] = []
+        self.store[key] = [t for t in self.store[key] if now - t < window]
+        if len(self.store[key]) >= limit:
+            return False
+        self.store[key].append(now)
+        return True
+
+
+def bench(label, limiter, keys, limit, window, calls):
+    now = 1_700_000_000.0
+    start = time.perf_counter()
+    for i in range(calls):
+        # ~2000 requests/sec of simulated traffic
+        now += 0.0005
+        limiter.hit(keys[i % len(keys)], limit, window, now)
+    duration = time.perf_counter() - start
+    print(f"    {label:<22} {calls / duration:>12,.0f} checks/s   ({duration * 1e6 / calls:.2f} us/check)")
+
+
+def run_performance_test():
+    print("=== MICROBENCHMARK: RATE LIMITER ===")
+    calls = 200_000
+    scenarios = [
+        ("hot key, limit=120", ["rate_limit:products:10.0.0.1"], 120),
+        ("hot key, limit=1000", ["rate_limit:products:10.0.0.1"], 1000),
+        ("500 clients, limit=60", [f"rate_limit:products:10.0.{i // 256}.{i % 256}" for i in range(500)], 60),
+        ("20k clients (spray)", [f"rate_limit:products:10.{i // 65536}.{i // 256 % 256}.{i % 256}" for i in range(20000)], 60),
+    ]
+    for name, keys, limit in scenarios:
+        print(f"[*] {name}")
+        bench("list of timestamps", ListTimestampLimiter(), keys, limit, 60, calls)
+        bench("sliding window counter", SlidingWindowLimiter(max_keys=10000), keys, limit, 60, calls)
+
+
+if __name__ == "__main__":
+    run_performance_test()
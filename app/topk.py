@@ -0,0 +1,42 @@
+# ============================================================
+# topk.py — Bounded Top-K Selection for Recommenders
+# ============================================================
+# Recommenders want the best `limit` of many candidates. A bounded heap
+# keeps only k entries (O(n log k)) instead of sorting all n, and the
+# predicate (visibility, stock, exclusions) only runs for candidates that
+# would make the cut, so rejected ones never reach the heap.
+import heapq
+from itertools import islice
+
+
+def top_k(items, k: int, key, predicate=None) -> list:
+    """The k items with the largest key(item) that pass predicate, best first.
+
+    Ties keep input order, exactly like sorted(..., key=key, reverse=True)[:k].
+    """
+    if k <= 0:
+        return []
+    heap = []
+    for i, item in enumerate(items):
+        score = key(item)
+        # Once full, a later item must strictly beat the worst kept one; checking
+        # that first spares the predicate for most candidates
+        if len(heap) == k and score <= heap[0][0]:
+            continue
+        if predicate is not None and not predicate(item):
+            continue
+        # -i breaks ties toward earlier items and keeps items themselves out of comparisons
+        entry = (score, -i, item)
+        if len(heap) < k:
+            heapq.heappush(heap, entry)
+        else:
+            heapq.heapreplace(heap, entry)
+    heap.sort(reverse=True)
+    return [item for _, _, item in heap]
+
+
+def first_k(items, k: int, predicate=None) -> list:
+    """The first k items that pass predicate, for inputs that are already ranked. Stops early."""
+    if predicate is not None:
+        items = filter(predicate, items)
+    return list(islice(items, max(k, 0)))
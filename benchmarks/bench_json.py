@@ -0,0 +1,94 @@
+# ============================================================
+# bench_json.py — Response Serialization Micro-Benchmark
+# ============================================================
+"""
+Time the response step of the read endpoints that opted into
+fast_json.respond(): FastAPI's default path (response_model validation,
+or jsonable_encoder for routes without one, then JSON encoding) against
+orjson without validation. Payloads are real endpoint data from a
+synthetic dataset; the database work itself is not timed.
+
+    python -m benchmarks.bench_json
+    DATABASE_URL=postgresql://... python -m benchmarks.bench_json   # use an existing, populated database
+"""
+import argparse
+import os
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "app"))
+
+
+def _sync(coro):
+    """Run a coroutine that never suspends, without event-loop overhead in the timings."""
+    try:
+        coro.send(None)
+    except StopIteration as done:
+        return done.value
+    raise RuntimeError("coroutine suspended")
+
+
+def _default_path(route, payload) -> bytes:
+    from fastapi.responses import JSONResponse
+    from fastapi.routing import serialize_response
+
+    field = route.response_field
+    content = _sync(serialize_response(field=field, response_content=payload, dump_json=field is not None))
+    return content if isinstance(content, bytes) else JSONResponse(content).body
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Response serialization micro-benchmark")
+    parser.add_argument("--products", type=int, default=5000)
+    parser.add_argument("--customers", type=int, default=500)
+    parser.add_argument("--orders", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    if not os.getenv("DATABASE_URL"):
+        from benchmarks import datagen, pg_fixture
+        print("[*] Preparing database...")
+        os.environ["DATABASE_URL"] = pg_fixture.start()
+        datagen.generate(os.environ["DATABASE_URL"], args.products, args.customers, args.orders, seed=args.seed)
+    os.environ.setdefault("SECRET_KEY", "bench")
+
+    import database
+    import fast_json
+    import main as app_main
+
+    products = database.get_all_products()
+    phone = database.get_all_orders()[0]["phone"]
+    context = database.get_customer_context(phone)
+    pid = products[0]["id"]
+    payloads = {
+        "/api/products?include_hidden=true": ("/api/products", products),
+        "/api/products?sort=price&limit=100": ("/api/products", database.query_products(sort="price", limit=100)),
+        "/api/admin/products": ("/api/admin/products", products),
+        "/api/orders": ("/api/orders", database.get_all_orders()),
+        "/api/orders/history": ("/api/orders/history", database.get_orders_by_phone(phone)),
+        "/api/home": ("/api/home", {
+            "products": context["products"][:30],
+            "trending": [p["id"] for p in context["products"][:12]],
+            "recommended": [p["id"] for p in context["products"][12:24]],
+            "reorder": [p["id"] for p in context["products"][24:30]],
+            "favorites": [],
+        }),
+        "/api/recommendations": ("/api/recommendations", database.get_personalized_recommendations(phone, 12)),
+        "/api/recommendations/similar/{id}": ("/api/recommendations/similar/{product_id}", database.get_similar_products(pid, 6)),
+        "/api/recommendations/reorder": ("/api/recommendations/reorder", database.get_smart_reorder_reminders(phone, 6)),
+    }
+    routes = {r.path: r for r in app_main.app.routes if getattr(r, "methods", None) and "GET" in r.methods}
+
+    print(f"{'endpoint':<40} {'items':>6} {'default':>10} {'fast':>10} {'speedup':>8}")
+    for label, (path, payload) in payloads.items():
+        route = routes[path]
+        items = len(payload) if isinstance(payload, list) else len(payload.get("products", [payload]))
+        runs = max(3, 20_000 // max(items, 1))
+        old = min(timeit.repeat(lambda: _default_path(route, payload), number=runs, repeat=5)) / runs
+        new = min(timeit.repeat(lambda: fast_json.dumps(payload), number=runs, repeat=5)) / runs
+        print(f"{label:<40} {items:>6} {old * 1000:>8.3f}ms {new * 1000:>8.3f}ms {old / new:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
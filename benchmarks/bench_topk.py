@@ -0,0 +1,64 @@
+# ============================================================
+# bench_topk.py — Top-K Selection Micro-Benchmark
+# ============================================================
+"""
+Compare the old "sort every candidate, filter, slice" pattern with the
+bounded-heap selection in app/topk.py on synthetic catalogs. Needs no
+database or server.
+
+    python -m benchmarks.bench_topk
+    python -m benchmarks.bench_topk --sizes 4000,100000 --limit 12
+"""
+import argparse
+import os
+import random
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "app"))
+
+from topk import top_k  # noqa: E402
+
+
+def _catalog(rng: random.Random, n: int) -> dict:
+    # Roughly the live mix: most products sellable, some hidden or out of stock
+    return {pid: {"id": pid, "is_visible": rng.random() > 0.05, "in_stock": rng.random() > 0.15} for pid in range(1, n + 1)}
+
+
+def _available(p: dict) -> bool:
+    return bool(p.get("is_visible") and p.get("in_stock"))
+
+
+def _sort_filter(scores: dict, products: dict, limit: int) -> list:
+    ranked = sorted(scores, key=lambda pid: scores[pid], reverse=True)
+    return [pid for pid in ranked if _available(products[pid])][:limit]
+
+
+def _heap(scores: dict, products: dict, limit: int) -> list:
+    return top_k(scores, limit, key=scores.__getitem__, predicate=lambda pid: _available(products[pid]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Top-K selection micro-benchmark")
+    parser.add_argument("--sizes", default="4000,100000", help="comma-separated catalog sizes")
+    parser.add_argument("--limit", type=int, default=12)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    print(f"{'products':>10} {'candidates':>10} {'sort+filter':>12} {'heap':>10} {'speedup':>8}")
+    for n in (int(s) for s in args.sizes.split(",")):
+        products = _catalog(rng, n)
+        # Integer scores like order counts, so ties are common
+        scores = {pid: rng.randint(0, 50) for pid in products}
+        if _sort_filter(scores, products, args.limit) != _heap(scores, products, args.limit):
+            raise SystemExit(f"Results differ at {n} products")
+        runs = max(3, 200_000 // n)
+        old = min(timeit.repeat(lambda: _sort_filter(scores, products, args.limit), number=runs, repeat=5)) / runs
+        new = min(timeit.repeat(lambda: _heap(scores, products, args.limit), number=runs, repeat=5)) / runs
+        print(f"{n:>10} {len(scores):>10} {old * 1000:>10.2f}ms {new * 1000:>8.2f}ms {old / new:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+# ============================================================
+# datagen.py — Synthetic Catalog, Customers and Order History
+# ============================================================
+import csv
+import json
+import os
+import random
+import sys
+from datetime import datetime, timedelta
+
+import psycopg2  # type: ignore
+from psycopg2 import extras  # type: ignore
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "app"))
+
+from migrations import migrate  # noqa: E402
+
+CATALOG_CSV = os.path.join(ROOT, "ULTIMATE_ZEPTO_CATALOG.csv")
+
+# Items per basket: most carts are small, a long tail of monthly stock-ups
+BASKET_SIZES = list(range(1, 16))
+BASKET_WEIGHTS = [18, 16, 14, 11, 9, 7, 6, 5, 4, 3, 2, 2, 1, 1, 1]
+STATUS_MIX = (("Delivered", 0.8), ("Processing", 0.1), ("Cancelled", 0.1))
+HISTORY_DAYS = 180
+
+
+def _load_templates() -> list:
+    """Rows of the real catalog; their category mix drives the synthetic one."""
+    with open(CATALOG_CSV, newline="", encoding="utf-8") as f:
+        rows = [r for r in csv.DictReader(f) if r.get("name") and r.get("Category")]
+    if not rows:
+        raise SystemExit(f"No catalog rows found in {CATALOG_CSV}")
+    return rows
+
+
+def _products(rng: random.Random, n: int) -> list:
+    templates = _load_templates()
+    seen = {}
+    products = []
+    for _ in range(n):
+        t = rng.choice(templates)
+        name = t["name"].strip()
+        seen[name] = seen.get(name, 0) + 1
+        if seen[name] > 1:
+            name = f"{name} ({seen[name]})"
+        try:
+            mrp = float(t.get("mrp") or 0)
+        except ValueError:
+            mrp = 0.0
+        mrp = mrp if mrp > 0 else round(rng.uniform(10, 600))
+        price = round(mrp * rng.choice((1.0, 1.0, 0.95, 0.9, 0.85)), 2)
+        products.append((
+            name, price, mrp, t.get("Standardized_Name") or name, "/static/placeholder.png",
+            t["Category"], t.get("Sub_Category") or "", t.get("Standardized_Name") or name,
+            t.get("Size_Weight") or "pc",
+        ))
+    return products
+
+
+def generate(database_url: str, products: int = 5000, customers: int = 2000, orders: int = 20000, seed: int = 42) -> dict:
+    """Create the schema in an empty database and fill it. Returns what the load scenarios need."""
+    rng = random.Random(seed)
+    conn = psycopg2.connect(database_url, cursor_factory=extras.RealDictCursor)
+    try:
+        cursor = conn.cursor()
+        migrate(cursor)
+
+        extras.execute_values(
+            cursor,
+            "INSERT INTO products (name, price, mrp, description, image_url, category, sub_category, base_name, unit) VALUES %s",
+            _products(rng, products), page_size=1000,
+        )
+        cursor.execute("SELECT id, name, price, category FROM products ORDER BY id")
+        catalog = [dict(r) for r in cursor.fetchall()]
+
+        # Zipf-like popularity over a shuffled catalog, plus per-customer category affinity
+        ranked = catalog[:]
+        rng.shuffle(ranked)
+        weights = [1.0 / (rank + 1) ** 1.1 for rank in range(len(ranked))]
+        by_category = {}
+        for p, w in zip(ranked, weights):
+            by_category.setdefault(p["category"], ([], []))
+            by_category[p["category"]][0].append(p)
+            by_category[p["category"]][1].append(w)
+        categories = list(by_category)
+
+        now = datetime.now()
+        phones = [f"9{rng.randrange(10**8, 10**9)}" for _ in range(customers)]
+        phones = list(dict.fromkeys(phones))
+        extras.execute_values(
+            cursor,
+            "INSERT INTO customers (phone, name, address, cancel_timestamps, created_at) VALUES %s",
+            [(ph, f"Bench {i}", None, "[]", (now - timedelta(days=HISTORY_DAYS)).isoformat()) for i, ph in enumerate(phones)],
+            page_size=1000,
+        )
+        affinity = {ph: rng.sample(categories, k=min(3, len(categories))) for ph in phones}
+
+        order_rows = []
+        for i in range(orders):
+            phone = rng.choice(phones)
+            size = rng.choices(BASKET_SIZES, BASKET_WEIGHTS)[0]
+            picked = {}
+            for _ in range(size):
+                if rng.random() < 0.6:
+                    pool, w = by_category[rng.choice(affinity[phone])]
+                    p = rng.choices(pool, w)[0]
+                else:
+                    p = rng.choices(ranked, weights)[0]
+                picked[p["id"]] = p
+            items = []
+            for p in picked.values():
+                qty = rng.choice((1, 1, 1, 2, 2, 3))
+                items.append({"product_id": p["id"], "name": p["name"], "price": p["price"], "quantity": qty, "subtotal": p["price"] * qty})
+            placed = now - timedelta(days=rng.uniform(0, HISTORY_DAYS))
+            status = rng.choices([s for s, _ in STATUS_MIX], [w for _, w in STATUS_MIX])[0]
+            delivered_at = (placed + timedelta(hours=rng.uniform(2, 30))).isoformat() if status == "Delivered" else None
+            order_rows.append((
+                str(101 + i), phone, json.dumps(items), status, round(sum(it["subtotal"] for it in items), 2),
+                placed.strftime("%Y-%m-%d %H:%M:%S"), "pickup", "same_day", delivered_at, "cod", "cod",
+            ))
+        extras.execute_values(
+            cursor,
+            "INSERT INTO orders (token, phone, items_json, status, total, timestamp, delivery_type, delivery_time, delivered_at, payment_method, payment_status) VALUES %s",
+            order_rows, page_size=1000,
+        )
+        cursor.execute("SELECT setval('order_token_seq', %s, false)", (101 + orders,))
+        cursor.execute("ANALYZE")
+        conn.commit()
+    finally:
+        conn.close()
+
+    return {
+        "products": [{"id": p["id"], "price": p["price"], "name": p["name"]} for p in ranked[:500]],
+        "phones": phones,
+    }
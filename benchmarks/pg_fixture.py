@@ -0,0 +1,43 @@
+# ============================================================
+# pg_fixture.py — Throwaway Postgres for Benchmarks
+# ============================================================
+import os
+import tempfile
+
+import psycopg2  # type: ignore
+
+BENCH_DB = "kgs_bench"
+
+
+def start(data_dir: "str | None" = None) -> str:
+    """Return a DATABASE_URL for a freshly created, empty benchmark database.
+
+    Uses BENCH_DATABASE_URL's server when set (the database is recreated
+    there), otherwise boots a private Postgres with pgserver under data_dir.
+    """
+    server_url = os.getenv("BENCH_DATABASE_URL")
+    if server_url is None:
+        try:
+            import pgserver  # type: ignore
+        except ImportError:
+            raise SystemExit("No Postgres for benchmarks: pip install -r benchmarks/requirements.txt or set BENCH_DATABASE_URL")
+        data_dir = data_dir or os.path.join(tempfile.gettempdir(), "kgs_bench_pgdata")
+        server = pgserver.get_server(data_dir, cleanup_mode="stop")
+        server_url = server.get_uri("postgres")
+
+    conn = psycopg2.connect(server_url)
+    conn.autocommit = True
+    try:
+        cursor = conn.cursor()
+        cursor.execute(f"DROP DATABASE IF EXISTS {BENCH_DB} WITH (FORCE)")
+        cursor.execute(f"CREATE DATABASE {BENCH_DB}")
+    finally:
+        conn.close()
+    return _with_database(server_url, BENCH_DB)
+
+
+def _with_database(url: str, database: str) -> str:
+    """Swap the database name in a postgresql:// URL, keeping host/query options (e.g. ?host=/socket/dir)."""
+    head, sep, query = url.partition("?")
+    base = head.rsplit("/", 1)[0]
+    return f"{base}/{database}{sep}{query}"
@@ -0,0 +1,225 @@
+# ============================================================
+# run.py — API Load Test and Benchmark Runner
+# ============================================================
+"""
+Generate a synthetic dataset in a throwaway Postgres, start the API under
+uvicorn, drive each scenario with concurrent virtual users, and report
+throughput and p50/p95/p99 latency per request.
+
+    pip install -r benchmarks/requirements.txt
+    python -m benchmarks.run                         # all scenarios, compare to baseline
+    python -m benchmarks.run --scenarios browse,checkout --duration 20
+    python -m benchmarks.run --save-baseline         # record a new baseline
+
+Exits with status 1 when a request's p95 or throughput regresses by more
+than --tolerance against benchmarks/baseline.json.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import secrets
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+import jwt
+
+from benchmarks import datagen, pg_fixture
+from benchmarks.scenarios import SCENARIOS
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_PATH = os.path.join(ROOT, "benchmarks", "baseline.json")
+
+
+class Session:
+    """One virtual user. Every request comes from a random client IP, like real
+    traffic, so per-IP rate limits apply as they would in production."""
+
+    def __init__(self, client: httpx.AsyncClient, data: dict, tokens: dict, results: dict, rng: random.Random):
+        self.client = client
+        self.data = data
+        self.tokens = tokens
+        self.results = results
+        self.rng = rng
+        self.phone = rng.choice(data["phones"])
+
+    async def call(self, label: str, method: str, path: str, customer: bool = False, admin: bool = False, headers: "dict | None" = None, **kwargs):
+        headers = dict(headers or {})
+        headers["X-Forwarded-For"] = f"10.{self.rng.randrange(256)}.{self.rng.randrange(256)}.{self.rng.randrange(1, 255)}"
+        if customer:
+            headers["Authorization"] = f"Bearer {self.tokens['customers'][self.phone]}"
+        if admin:
+            headers["Authorization"] = f"Bearer {self.tokens['admin']}"
+        stats = self.results.setdefault(label, {"latencies": [], "errors": 0, "limited": 0})
+        started = time.perf_counter()
+        try:
+            response = await self.client.request(method, path, headers=headers, **kwargs)
+            status = response.status_code
+        except httpx.HTTPError:
+            status = 0
+        stats["latencies"].append(time.perf_counter() - started)
+        if status == 429:
+            stats["limited"] += 1
+        elif not 200 <= status < 300:
+            stats["errors"] += 1
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _start_server(database_url: str, secret_key: str, workers: int) -> "tuple[subprocess.Popen, str]":
+    port = _free_port()
+    env = dict(os.environ,
+               DATABASE_URL=database_url, SECRET_KEY=secret_key, LOG_LEVEL="WARNING",
+               WEB_CONCURRENCY=str(workers),
+               CATALOG_SNAPSHOT_PATH=os.path.join(tempfile.mkdtemp(prefix="kgs_bench_"), "catalog.snapshot"))
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(workers), "--proxy-headers", "--forwarded-allow-ips", "127.0.0.1", "--log-level", "warning"],
+        cwd=os.path.join(ROOT, "app"), env=env,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise SystemExit("API server exited during startup")
+        try:
+            if httpx.get(f"{base_url}/health", timeout=1).status_code == 200:
+                return proc, base_url
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.25)
+    proc.terminate()
+    raise SystemExit("API server did not become healthy within 60s")
+
+
+def _tokens(secret_key: str, phones: list) -> dict:
+    exp = int(time.time()) + 24 * 3600
+    return {
+        "admin": jwt.encode({"role": "admin", "exp": exp}, secret_key, algorithm="HS256"),
+        "customers": {ph: jwt.encode({"role": "customer", "phone": ph, "exp": exp}, secret_key, algorithm="HS256") for ph in phones},
+    }
+
+
+async def _run_scenario(base_url: str, name: str, concurrency: int, duration: float, warmup: float, data: dict, tokens: dict, seed: int) -> dict:
+    scenario = SCENARIOS[name]
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=30, limits=limits) as client:
+        async def user(results: dict, stop_at: float, rng: random.Random):
+            session = Session(client, data, tokens, results, rng)
+            while time.perf_counter() < stop_at:
+                await scenario(session, rng)
+
+        # Warm caches and connections; these samples are discarded
+        await asyncio.gather(*(user({}, time.perf_counter() + warmup, random.Random(seed + i)) for i in range(concurrency)))
+        results = {}
+        started = time.perf_counter()
+        await asyncio.gather(*(user(results, started + duration, random.Random(seed + 1000 + i)) for i in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    report = {}
+    for label, stats in results.items():
+        lat = sorted(stats["latencies"])
+        pct = lambda q: lat[min(len(lat) - 1, int(q * len(lat)))] * 1000  # noqa: E731
+        report[label] = {
+            "requests": len(lat), "rps": round(len(lat) / elapsed, 1),
+            "p50": round(pct(0.50), 2), "p95": round(pct(0.95), 2), "p99": round(pct(0.99), 2),
+            "errors": stats["errors"], "rate_limited": stats["limited"],
+        }
+    return report
+
+
+def _compare(report: dict, baseline: dict, tolerance: float) -> list:
+    regressions = []
+    for scenario, requests in report.items():
+        for label, now in requests.items():
+            before = baseline.get(scenario, {}).get(label)
+            if not before:
+                continue
+            if now["p95"] > before["p95"] * (1 + tolerance):
+                regressions.append(f"{scenario} / {label}: p95 {before['p95']}ms -> {now['p95']}ms")
+            if now["rps"] < before["rps"] * (1 - tolerance):
+                regressions.append(f"{scenario} / {label}: throughput {before['rps']} -> {now['rps']} req/s")
+    return regressions
+
+
+def _print_report(report: dict, baseline: dict):
+    print(f"\n{'scenario / request':<70} {'req/s':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'err':>5} {'429':>5} {'p95 vs base':>12}")
+    for scenario, requests in report.items():
+        for label, r in sorted(requests.items()):
+            before = baseline.get(scenario, {}).get(label)
+            delta = f"{(r['p95'] / before['p95'] - 1) * 100:+.0f}%" if before and before["p95"] else "-"
+            print(f"{scenario + ' / ' + label:<70} {r['rps']:>8} {r['p50']:>8} {r['p95']:>8} {r['p99']:>8} {r['errors']:>5} {r['rate_limited']:>5} {delta:>12}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="KGS API load test and benchmark suite")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma-separated: " + ", ".join(SCENARIOS))
+    parser.add_argument("--products", type=int, default=5000)
+    parser.add_argument("--customers", type=int, default=2000)
+    parser.add_argument("--orders", type=int, default=20000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=15, help="measured seconds per scenario")
+    parser.add_argument("--warmup", type=float, default=3)
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed relative p95/throughput regression")
+    args = parser.parse_args()
+
+    names = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = [n for n in names if n not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)}")
+
+    print("[*] Preparing database...")
+    database_url = pg_fixture.start()
+    started = time.perf_counter()
+    data = datagen.generate(database_url, args.products, args.customers, args.orders, seed=args.seed)
+    print(f"[*] Generated {args.products} products, {len(data['phones'])} customers, {args.orders} orders in {time.perf_counter() - started:.1f}s")
+
+    secret_key = secrets.token_hex(32)
+    tokens = _tokens(secret_key, data["phones"])
+    proc, base_url = _start_server(database_url, secret_key, args.workers)
+    report = {}
+    try:
+        for name in names:
+            print(f"[*] {name}: {args.concurrency} users for {args.duration:.0f}s")
+            report[name] = asyncio.run(_run_scenario(base_url, name, args.concurrency, args.duration, args.warmup, data, tokens, args.seed))
+    finally:
+        proc.terminate()
+        proc.wait(timeout=30)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    _print_report(report, baseline)
+
+    if args.save_baseline:
+        baseline.update(report)
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f"\n[*] Baseline saved to {args.baseline}")
+        return
+
+    regressions = _compare(report, baseline, args.tolerance)
+    if regressions:
+        print("\n[!] Regressions against baseline:")
+        for r in regressions:
+            print(f"    - {r}")
+        sys.exit(1)
+    print("\n[*] No regressions against baseline." if baseline else "\n[*] No baseline to compare against (use --save-baseline).")
+
+
+if __name__ == "__main__":
+    main()
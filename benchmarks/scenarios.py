@@ -0,0 +1,59 @@
+# ============================================================
+# scenarios.py — Load Scenarios (one user "step" each)
+# ============================================================
+# Each scenario is an async function (session, rng) that issues the requests
+# one user action makes. session.call() times every request under its label.
+import uuid
+
+
+async def browse(session, rng):
+    """Open the app: catalog, categories, trending."""
+    await session.call("GET /api/products", "GET", "/api/products")
+    await session.call("GET /api/categories", "GET", "/api/categories")
+    await session.call("GET /api/trending", "GET", "/api/trending")
+
+
+async def home(session, rng):
+    """Logged-in home screen: every widget from one batched request."""
+    await session.call("GET /api/home", "GET", "/api/home", customer=True)
+
+
+async def search(session, rng):
+    """Search runs client-side over the catalog; opening a result loads similar items."""
+    await session.call("GET /api/products", "GET", "/api/products")
+    product = rng.choice(session.data["products"])
+    await session.call("GET /api/recommendations/similar/{id}", "GET", f"/api/recommendations/similar/{product['id']}")
+
+
+async def cart_fbt(session, rng):
+    """Cart page: frequently-bought-together for the cart, plus personalised picks."""
+    cart = [p["id"] for p in rng.sample(session.data["products"], k=rng.randint(1, 5))]
+    await session.call("POST /api/recommendations/frequently-bought-together", "POST",
+                       "/api/recommendations/frequently-bought-together", json={"product_ids": cart})
+    await session.call("GET /api/recommendations", "GET", "/api/recommendations", customer=True)
+
+
+async def checkout(session, rng):
+    """Place a pickup COD order with a fresh Idempotency-Key."""
+    picked = rng.sample(session.data["products"], k=rng.randint(1, 4))
+    items = [{"product_id": p["id"], "name": p["name"][:100], "price": p["price"], "quantity": rng.randint(1, 3)} for p in picked]
+    total = sum(it["price"] * it["quantity"] for it in items)
+    await session.call("POST /api/orders", "POST", "/api/orders", customer=True,
+                       json={"items": items, "total": total}, headers={"Idempotency-Key": str(uuid.uuid4())})
+
+
+async def admin_dashboard(session, rng):
+    """Admin landing page: orders, customers, full product list."""
+    await session.call("GET /api/orders", "GET", "/api/orders", admin=True)
+    await session.call("GET /api/admin/customers", "GET", "/api/admin/customers", admin=True)
+    await session.call("GET /api/admin/products", "GET", "/api/admin/products", admin=True)
+
+
+SCENARIOS = {
+    "browse": browse,
+    "home": home,
+    "search": search,
+    "cart_fbt": cart_fbt,
+    "checkout": checkout,
+    "admin_dashboard": admin_dashboard,
+}
@@ -0,0 +1,295 @@
+# ============================================================
+# train_recommendations.py — Offline Recommendation Model Training
+# ============================================================
+"""
+Stream the order history out of Postgres, train the recommendation model and
+write a versioned artifact that running API workers pick up within a minute
+(see app/rec_artifacts.py). Nothing is computed per request from this data.
+
+    pip install -r scripts/requirements-train.txt
+    python scripts/train_recommendations.py                  # train and publish
+    python scripts/train_recommendations.py --evaluate       # also report holdout recall
+    python scripts/train_recommendations.py --dry-run        # train, don't publish
+
+The artifact holds:
+  item_neighbors  product -> similar products: co-occurrence in baskets
+                  blended with cosine over the customer-item matrix
+  user_recs       customer -> ranked products they have not bought, from
+                  implicit-feedback matrix factorization (ALS)
+  category_popular category -> products by recency-weighted purchases
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+import psycopg2
+from psycopg2 import extras
+from dotenv import load_dotenv
+from scipy import sparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "app"))
+
+import rec_artifacts  # noqa: E402
+
+load_dotenv(os.path.join(ROOT, "app", ".env"))
+
+
+# ── Data ─────────────────────────────────────────────────
+
+def _parse_time(ts: str) -> float:
+    try:
+        return datetime.fromisoformat(ts.replace("Z", "+00:00")).replace(tzinfo=None).timestamp()
+    except ValueError:
+        return datetime.strptime(ts[:19], "%Y-%m-%d %H:%M:%S").timestamp()
+
+
+def load_data(database_url: str, batch_size: int) -> dict:
+    """Products plus one (customer, product ids, time) row per non-cancelled order, streamed with a server-side cursor."""
+    conn = psycopg2.connect(database_url)
+    try:
+        cursor = conn.cursor(cursor_factory=extras.RealDictCursor)
+        cursor.execute("SELECT id, category, is_visible FROM products ORDER BY id")
+        products = cursor.fetchall()
+        column = {p["id"]: i for i, p in enumerate(products)}
+
+        orders = []
+        stream = conn.cursor(name="train_orders")
+        stream.itersize = batch_size
+        stream.execute("SELECT phone, items_json, timestamp FROM orders WHERE status != 'Cancelled' ORDER BY id")
+        for phone, items_json, ts in stream:
+            try:
+                items = {column[int(it["product_id"])] for it in json.loads(items_json) if int(it.get("product_id") or 0) in column}
+                at = _parse_time(ts)
+            except (ValueError, TypeError, KeyError):
+                continue
+            if items:
+                orders.append((phone, sorted(items), at))
+        stream.close()
+        conn.commit()
+    finally:
+        conn.close()
+    return {"products": products, "orders": orders}
+
+
+def _matrices(orders: list, customers: dict, n_items: int):
+    """Binary orders x items basket matrix and customers x items purchase-count matrix."""
+    rows, cols = [], []
+    for r, (_, items, _) in enumerate(orders):
+        rows.extend([r] * len(items))
+        cols.extend(items)
+    baskets = sparse.csr_matrix((np.ones(len(cols), dtype=np.float32), (rows, cols)), shape=(len(orders), n_items))
+    owner = np.array([customers[phone] for phone, _, _ in orders], dtype=np.int64)
+    purchases = sparse.csr_matrix((np.ones(len(cols), dtype=np.float32), (owner[rows], cols)), shape=(len(customers), n_items))
+    purchases.sum_duplicates()
+    return baskets, purchases
+
+
+# ── Item-item similarity ─────────────────────────────────
+
+def _cosine_columns(m) -> sparse.csr_matrix:
+    norms = np.sqrt(np.asarray(m.multiply(m).sum(axis=0)).ravel())
+    norms[norms == 0] = 1.0
+    normalized = m @ sparse.diags(1.0 / norms)
+    return (normalized.T @ normalized).tocsr()
+
+
+def item_neighbors(baskets, purchases, k: int, co_weight: float) -> list:
+    """Top-k neighbor columns per item column."""
+    scores = (co_weight * _cosine_columns(baskets) + (1 - co_weight) * _cosine_columns(purchases)).tocsr()
+    scores.setdiag(0)
+    scores.eliminate_zeros()
+    return _top_k_rows(scores, k)
+
+
+def _top_k_rows(m, k: int) -> list:
+    result = []
+    for r in range(m.shape[0]):
+        start, end = m.indptr[r], m.indptr[r + 1]
+        data, idx = m.data[start:end], m.indices[start:end]
+        if len(data) > k:
+            keep = np.argpartition(-data, k)[:k]
+            data, idx = data[keep], idx[keep]
+        result.append(idx[np.lexsort((idx, -data))].tolist())
+    return result
+
+
+# ── Popularity ───────────────────────────────────────────
+
+def category_popular(products: list, orders: list, half_life_days: float, n: int) -> dict:
+    now = time.time()
+    weights = np.zeros(len(products))
+    for _, items, at in orders:
+        weights[items] += 0.5 ** ((now - at) / 86400 / half_life_days)
+    by_category = {}
+    for col in np.argsort(-weights, kind="stable"):
+        if weights[col] <= 0:
+            break
+        p = products[col]
+        ranked = by_category.setdefault(p["category"], [])
+        if len(ranked) < n:
+            ranked.append(p["id"])
+    return by_category
+
+
+# ── Implicit-feedback matrix factorization ───────────────
+
+def _als_step(confidence, fixed, reg: float) -> np.ndarray:
+    """Solve every row's factors given the other side (Hu, Koren & Volinsky 2008)."""
+    f = fixed.shape[1]
+    gram = fixed.T @ fixed + reg * np.eye(f)
+    solved = np.zeros((confidence.shape[0], f), dtype=np.float64)
+    for r in range(confidence.shape[0]):
+        start, end = confidence.indptr[r], confidence.indptr[r + 1]
+        if start == end:
+            continue
+        idx, c = confidence.indices[start:end], confidence.data[start:end]
+        y = fixed[idx]
+        # (YtY + Yt (C - I) Y + reg I) x = Yt C p, with p = 1 on observed items
+        solved[r] = np.linalg.solve(gram + (y.T * c) @ y, (y.T * (c + 1)).sum(axis=1))
+    return solved
+
+
+def factorize(purchases, factors: int, reg: float, alpha: float, iterations: int, seed: int):
+    confidence = purchases.copy().astype(np.float64)
+    confidence.data = alpha * np.log1p(confidence.data)  # C - 1
+    confidence_t = confidence.T.tocsr()
+    rng = np.random.default_rng(seed)
+    users = rng.normal(scale=0.01, size=(purchases.shape[0], factors))
+    items = rng.normal(scale=0.01, size=(purchases.shape[1], factors))
+    for _ in range(iterations):
+        users = _als_step(confidence, items, reg)
+        items = _als_step(confidence_t, users, reg)
+    return users, items
+
+
+def user_recommendations(users, items, purchases, allowed, n: int, chunk: int = 1024) -> list:
+    """Top-n unpurchased, allowed item columns per customer row."""
+    result = []
+    for start in range(0, users.shape[0], chunk):
+        scores = users[start:start + chunk] @ items.T
+        scores[:, ~allowed] = -np.inf
+        bought = purchases[start:start + chunk]
+        scores[bought.nonzero()] = -np.inf
+        top = np.argpartition(-scores, min(n, scores.shape[1] - 1), axis=1)[:, :n]
+        for row, cols in enumerate(top):
+            cols = cols[np.argsort(-scores[row, cols], kind="stable")]
+            result.append([c for c in cols.tolist() if np.isfinite(scores[row, c])])
+    return result
+
+
+# ── Evaluation ───────────────────────────────────────────
+
+def evaluate(data: dict, args) -> dict:
+    """Hold out each repeat customer's latest order; recall@n over its items they had not bought before."""
+    latest = {}
+    for i, (phone, _, at) in enumerate(data["orders"]):
+        if phone not in latest or at >= data["orders"][latest[phone]][2]:
+            latest[phone] = i
+    counts = {}
+    for phone, _, _ in data["orders"]:
+        counts[phone] = counts.get(phone, 0) + 1
+    held = {i for phone, i in latest.items() if counts[phone] > 1}
+    train = [o for i, o in enumerate(data["orders"]) if i not in held]
+    customers = {phone: r for r, phone in enumerate(dict.fromkeys(o[0] for o in train))}
+    n_items = len(data["products"])
+    _, purchases = _matrices(train, customers, n_items)
+    users, items = factorize(purchases, args.factors, args.reg, args.alpha, args.iterations, args.seed)
+    allowed = np.ones(n_items, dtype=bool)
+    recs = user_recommendations(users, items, purchases, allowed, args.top_n)
+    popularity = np.asarray(purchases.sum(axis=0)).ravel()
+
+    hits = {"als": 0, "popularity": 0}
+    total = 0
+    for i in held:
+        phone, held_items, _ = data["orders"][i]
+        row = customers[phone]
+        bought = set(purchases[row].indices.tolist())
+        new_items = set(held_items) - bought
+        if not new_items:
+            continue
+        total += len(new_items)
+        hits["als"] += len(new_items & set(recs[row]))
+        popular = [c for c in np.argsort(-popularity, kind="stable") if c not in bought][:args.top_n]
+        hits["popularity"] += len(new_items & set(popular))
+    return {name: round(h / total, 4) if total else None for name, h in hits.items()} | {"held_out_items": total}
+
+
+# ── CLI ──────────────────────────────────────────────────
+
+def main():
+    parser = argparse.ArgumentParser(description="Train recommendation models and publish a versioned artifact")
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL"))
+    parser.add_argument("--out-dir", default=rec_artifacts.RECS_DIR)
+    parser.add_argument("--neighbors", type=int, default=20, help="similar items kept per product")
+    parser.add_argument("--co-weight", type=float, default=0.6, help="basket co-occurrence share of item similarity")
+    parser.add_argument("--top-n", type=int, default=24, help="recommendations kept per customer and per category")
+    parser.add_argument("--factors", type=int, default=32)
+    parser.add_argument("--reg", type=float, default=0.1)
+    parser.add_argument("--alpha", type=float, default=15.0, help="confidence scaling of purchase counts")
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument("--half-life-days", type=float, default=30.0, help="recency decay for category popularity")
+    parser.add_argument("--batch-size", type=int, default=5000, help="orders fetched per round trip")
+    parser.add_argument("--keep", type=int, default=3, help="artifact versions kept on disk")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--evaluate", action="store_true", help="report holdout recall before training the full model")
+    parser.add_argument("--dry-run", action="store_true", help="train but do not publish")
+    args = parser.parse_args()
+    if not args.database_url:
+        parser.error("DATABASE_URL is not set (app/.env or --database-url)")
+
+    started = time.perf_counter()
+    data = load_data(args.database_url, args.batch_size)
+    products, orders = data["products"], data["orders"]
+    print(f"[*] Loaded {len(products)} products and {len(orders)} orders in {time.perf_counter() - started:.1f}s")
+    if not orders:
+        raise SystemExit("No orders to train on.")
+
+    if args.evaluate:
+        mark = time.perf_counter()
+        print(f"[*] Holdout recall@{args.top_n}: {evaluate(data, args)} ({time.perf_counter() - mark:.1f}s)")
+
+    mark = time.perf_counter()
+    customers = {phone: r for r, phone in enumerate(dict.fromkeys(o[0] for o in orders))}
+    baskets, purchases = _matrices(orders, customers, len(products))
+    ids = [p["id"] for p in products]
+    neighbors = item_neighbors(baskets, purchases, args.neighbors, args.co_weight)
+    print(f"[*] Item similarity: {time.perf_counter() - mark:.1f}s")
+
+    mark = time.perf_counter()
+    users, items = factorize(purchases, args.factors, args.reg, args.alpha, args.iterations, args.seed)
+    allowed = np.array([bool(p["is_visible"]) for p in products])
+    recs = user_recommendations(users, items, purchases, allowed, args.top_n)
+    print(f"[*] Matrix factorization ({len(customers)} customers x {len(products)} products): {time.perf_counter() - mark:.1f}s")
+
+    tables = {
+        "item_neighbors": {ids[c]: [ids[n] for n in row] for c, row in enumerate(neighbors) if row},
+        # Phones are stored as numbers; the API looks them up the same way
+        "user_recs": {int(phone): [ids[c] for c in recs[r]] for phone, r in customers.items() if phone.isdigit() and recs[r]},
+    }
+    meta = {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "params": {k: v for k, v in vars(args).items() if k not in ("database_url", "out_dir", "evaluate", "dry_run")},
+        "category_popular": category_popular(products, orders, args.half_life_days, args.top_n),
+        "orders": len(orders),
+    }
+    if args.dry_run:
+        print(f"[*] Dry run: {len(tables['item_neighbors'])} item lists, {len(tables['user_recs'])} customer lists (not published)")
+        return
+
+    version = int(time.time())
+    path = rec_artifacts.write(args.out_dir, version, tables, meta)
+    print(f"[*] Published v{version}: {path} ({os.path.getsize(path) / 1024:.0f} KB) in {time.perf_counter() - started:.1f}s total")
+
+    # Keep the newest versions for rollback (point CURRENT at an older file to roll back)
+    versions = sorted(f for f in os.listdir(args.out_dir) if f.startswith("recs-") and f.endswith(".bin"))
+    for old in versions[:-args.keep]:
+        os.remove(os.path.join(args.out_dir, old))
+
+
+if __name__ == "__main__":
+    main()